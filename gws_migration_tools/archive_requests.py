@@ -1,13 +1,16 @@
+import os
+import json
 import argparse
 import datetime
 
 from gws_migration_tools import gws
+from gws_migration_tools.journal import JournalTruncated
 from gws_migration_tools.migration_request_lib \
     import RequestsManager, finished_statuses
 
 
 def parse_args(arg_list = None):
-    
+
     parser = argparse.ArgumentParser(
         arg_list,
         description=('archive finished requests more than a given number of days old)'))
@@ -22,11 +25,151 @@ def parse_args(arg_list = None):
                         nargs='+'
                     )
 
+    parser.add_argument('--full',
+                        help=('rescan the finished request directories, instead of '
+                              'carrying on from the state saved by the last run'),
+                        action='store_true'
+                    )
+
     args = parser.parse_args()
 
     return args
 
 
+class ArchiveState(object):
+    """
+    State saved between runs of archive-offline-requests, so that each run
+    only needs to look at requests which have finished since the last one.
+    Kept as a small JSON file in the .mngr directory, holding:
+
+       offset: the journal offset up to which transitions have been taken
+               into account (the watermark)
+       pending: for each finished status directory, the requests found
+                there which were not yet old enough to archive, as a
+                mapping of filename to date (as an ordinal)
+
+    If the journal is missing, or has been compacted past the saved offset,
+    the finished directories are listed again instead.
+    """
+
+    _file = '.archive_state'
+
+    def __init__(self, reqs_mgr):
+        self.reqs_mgr = reqs_mgr
+        self.path = os.path.join(reqs_mgr.base_dir, self._file)
+        self.offset = None
+        self.pending = dict((reqs_mgr._dir_lookup[status], {})
+                            for status in finished_statuses)
+        self._finished_dirs = dict((reqs_mgr._dir_lookup[status], status)
+                                   for status in finished_statuses)
+
+
+    def load(self):
+        "returns True if there was a saved state"
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return False
+        self.offset = state['offset']
+        for dirname, pending in state['pending'].items():
+            if dirname in self.pending:
+                self.pending[dirname] = pending
+        return True
+
+
+    def save(self):
+        tmp_path = os.path.join(os.path.dirname(self.path),
+                                '.tmp_' + os.path.basename(self.path))
+        with open(tmp_path, 'w') as f:
+            json.dump({'offset': self.offset, 'pending': self.pending}, f)
+        os.rename(tmp_path, self.path)
+
+
+    def _add(self, dirname, filename):
+        _, _, _, date = self.reqs_mgr.parse_filename(filename)
+        self.pending[dirname][filename] = date.toordinal()
+
+
+    def rescan(self):
+        "lists the finished directories, replacing the pending requests"
+        journal = self.reqs_mgr.journal
+        # take the offset first: records added during the listing are
+        # then replayed next time, which is harmless
+        self.offset = journal.end_offset() if journal.exists() else None
+        for pending in self.pending.values():
+            pending.clear()
+        for status, filename, _ in self.reqs_mgr.scan_filenames(finished_statuses):
+            self._add(self.reqs_mgr._dir_lookup[status], filename)
+
+
+    def update(self):
+        """
+        Brings the pending requests up to date from the journal records
+        since the saved offset.  Falls back to rescan() if that is not
+        possible.
+        """
+        journal = self.reqs_mgr.journal
+        if self.offset is None or not journal.exists():
+            return self.rescan()
+        try:
+            records, self.offset = journal.read_since(self.offset)
+        except JournalTruncated:
+            return self.rescan()
+
+        for record in records:
+            filename = record['fn']
+            if record['op'] == 'move':
+                self.pending.get(record['from'], {}).pop(filename, None)
+                dirname = record['to']
+            elif record['op'] == 'archive':
+                self.pending.get(record['st'], {}).pop(filename, None)
+                continue
+            else:
+                dirname = record['st']
+            if dirname in self.pending:
+                self._add(dirname, filename)
+
+
+    def due(self, archive_up_to):
+        """
+        Returns a list of (status, filename) for the pending requests dated
+        on or before archive_up_to, oldest first.
+        """
+        up_to = archive_up_to.toordinal()
+        due = [(ordinal, dirname, filename)
+               for dirname, pending in self.pending.items()
+               for filename, ordinal in pending.items()
+               if ordinal <= up_to]
+        due.sort()
+        return [(self._finished_dirs[dirname], filename)
+                for _, dirname, filename in due]
+
+
+    def remove(self, status, filename):
+        self.pending[self.reqs_mgr._dir_lookup[status]].pop(filename, None)
+
+
+def archive_workspace(reqs_mgr, archive_up_to, full=False):
+
+    state = ArchiveState(reqs_mgr)
+    if full or not state.load():
+        state.rescan()
+    else:
+        state.update()
+
+    for status, filename in state.due(archive_up_to):
+        req = reqs_mgr.make_request(filename, status)
+        print('Archiving {}'.format(req))
+        try:
+            req.archive()
+        except FileNotFoundError:
+            print('{} is no longer there - skipping'.format(req))
+        state.remove(status, filename)
+
+    state.save()
+
+
 def main():
 
     args = parse_args()
@@ -42,11 +185,9 @@ def main():
             continue
 
         reqs_mgr = RequestsManager(gws_root)
+        reqs_mgr._check_initialised()
 
-        for req in reqs_mgr.scan(all_users=True,
-                                  statuses=finished_statuses):
-
-            if req.date <= archive_up_to:
-                print('Archiving {}'.format(req))
-                req.archive()
+        archive_workspace(reqs_mgr, archive_up_to, full=args.full)
 
+        # drop journal records for archived requests from the older segments
+        reqs_mgr.journal.compact()
@@ -0,0 +1,92 @@
+import collections
+
+from gws_migration_tools.migration_request_lib import \
+    RequestStatus, default_read_workers
+
+
+def _withdraw(req, message):
+    req.set_status(RequestStatus.WITHDRAWN)
+
+
+def _fail(req, message):
+    req.set_failed(message or "failed by the GWS manager")
+
+
+def _requeue(req, message):
+    req.requeue()
+
+
+# for each bulk operation: the statuses it applies to, and the function
+# which applies it to one request
+bulk_operations = {
+    'withdraw': ([RequestStatus.NEW], _withdraw),
+    'fail': ([RequestStatus.NEW, RequestStatus.SUBMITTING,
+              RequestStatus.SUBMITTED], _fail),
+    'requeue': ([RequestStatus.FAILED], _requeue),
+}
+
+
+class BulkResult(object):
+    """
+    Outcome of a bulk operation on one group workspace.
+
+    changed: requests to which the operation was applied (or would have
+             been, for a dry run)
+    skipped: number of matching requests left alone, keyed on status
+    skipped_ids: status of each matching request left alone, keyed on id
+    errors: list of (request, exception) for requests where applying the
+            operation failed, e.g. because a handler changed its status
+            in the meantime
+    """
+
+    def __init__(self, gws_root, operation, dry_run=False):
+        self.gws_root = gws_root
+        self.operation = operation
+        self.dry_run = dry_run
+        self.changed = []
+        self.skipped = collections.Counter()
+        self.skipped_ids = {}
+        self.errors = []
+
+
+    def dump(self):
+        print("group workspace: {}".format(self.gws_root))
+        print(" {}: {} request(s){}".format(
+            self.operation, len(self.changed),
+            (' (dry run - nothing changed)' if self.dry_run else '')))
+        for status, count in sorted(self.skipped.items(),
+                                    key=lambda item: item[0].value):
+            print(" skipped: {} request(s) with status {}".format(
+                count, status.name))
+        for req, exc in self.errors:
+            print(" error: {}: {}".format(req, exc))
+
+
+def apply_bulk(reqs_mgr, operation, query, all_users=False, message=None,
+               dry_run=False, max_workers=default_read_workers, verbose=False):
+    """
+    Applies one of the bulk_operations to every unarchived request matching
+    a RequestQuery, from a single scan.  Matching requests whose status
+    the operation does not apply to are counted as skipped.  Returns a
+    BulkResult.
+    """
+    statuses, func = bulk_operations[operation]
+    result = BulkResult(reqs_mgr.gws_root, operation, dry_run=dry_run)
+
+    for req in reqs_mgr.select(query, all_users=all_users,
+                               max_workers=max_workers):
+        if req.status not in statuses:
+            result.skipped[req.status] += 1
+            result.skipped_ids[req.reqid] = req.status
+            continue
+        if not dry_run:
+            try:
+                func(req, message)
+            except (OSError, ValueError) as exc:
+                result.errors.append((req, exc))
+                continue
+        if verbose:
+            print("{}: {}".format(operation, req))
+        result.changed.append(req)
+
+    return result
@@ -0,0 +1,108 @@
+import os
+import json
+import time
+
+
+class Checkpoint(object):
+    """
+    Records, for each handler action, the ids of the requests it has
+    processed in handling cycles that were stopped before they had been
+    through all of them, so that the next cycle can carry on with the
+    others (see resume_order).  Ids are added up over successive stopped
+    cycles until one gets through all the requests.  Kept as a small JSON
+    file in the .mngr directory.
+    """
+
+    _file = '.checkpoint'
+
+    def __init__(self, reqs_mgr):
+        self.path = os.path.join(reqs_mgr.base_dir, self._file)
+        try:
+            with open(self.path) as f:
+                self._state = json.load(f)
+        except (FileNotFoundError, ValueError):
+            self._state = {}
+
+
+    def get(self, action_name):
+        "set of the ids of the requests already processed by the given action"
+        handled = self._state.get(action_name)
+        if not isinstance(handled, list):
+            return set()  # none, or the last id recorded by an older version
+        return set(handled)
+
+
+    def set(self, action_name, handled):
+        if not handled:
+            self._state.pop(action_name, None)
+        else:
+            self._state[action_name] = sorted(handled)
+
+
+    def save(self):
+        tmp_path = os.path.join(os.path.dirname(self.path),
+                                '.tmp_' + os.path.basename(self.path))
+        with open(tmp_path, 'w') as f:
+            json.dump(self._state, f)
+        os.rename(tmp_path, self.path)
+
+
+def resume_order(reqs, handled):
+    """
+    Returns the requests reordered so that those whose ids are not in
+    handled (those processed by earlier cycles that were stopped) come
+    first, followed by the rest, each in the given order.  The action's
+    own selection (e.g. fair-share order) is applied afterwards, and
+    keeps this order within each of its queues, so requests are carried
+    on with in the order in which they would have been reached.
+    """
+    if not handled:
+        return list(reqs)
+    return ([req for req in reqs if req.reqid not in handled]
+            + [req for req in reqs if req.reqid in handled])
+
+
+class Deadline(object):
+    """
+    Time limit on a handling cycle.  expired() becomes true once there is
+    no longer time to process another request, judging by the longest
+    time that any request has taken so far.
+    """
+
+    def __init__(self, max_runtime=None):
+        self.end = None if max_runtime is None else time.time() + max_runtime
+        self._longest = 0.
+        self._started = None
+        self._parent = None
+
+
+    def share(self, fraction):
+        """
+        Returns a Deadline for a fraction of the time left (e.g. for one of
+        several actions, so that one of them cannot use up the time of the
+        others).  Requests timed against it count towards this one too.
+        """
+        sub = Deadline()
+        if self.end is not None:
+            now = time.time()
+            sub.end = now + max(self.end - now, 0.) * fraction
+        sub._parent = self
+        return sub
+
+
+    def start_request(self):
+        self._started = time.time()
+
+
+    def end_request(self):
+        if self._started is not None:
+            self._longest = max(self._longest, time.time() - self._started)
+            if self._parent is not None:
+                self._parent._longest = max(self._parent._longest, self._longest)
+            self._started = None
+
+
+    def expired(self):
+        if self.end is None:
+            return False
+        return time.time() + self._longest >= self.end
@@ -0,0 +1,263 @@
+import os
+import stat
+import json
+import time
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+
+
+default_algorithm = 'sha256'
+
+# size of each read when hashing a file
+chunk_size = 8 * 1024 * 1024
+
+# small files are hashed in batches, to limit the per-task overhead of the
+# process pool; a batch is closed when it reaches either limit
+batch_bytes = 256 * 1024 * 1024
+batch_files = 256
+
+
+def default_hash_workers():
+    return os.cpu_count() or 4
+
+
+def hash_file(path, algorithm=default_algorithm):
+    "returns the hex digest of a file, read in large chunks"
+    h = hashlib.new(algorithm)
+    buf = bytearray(chunk_size)
+    view = memoryview(buf)
+    with open(path, 'rb', buffering=0) as f:
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            h.update(view[:n])
+    return h.hexdigest()
+
+
+def _hash_batch(root, relpaths, algorithm):
+    """
+    Runs in a worker process.  Returns a list of (relpath, digest, error)
+    for the files of one batch.
+    """
+    results = []
+    for relpath in relpaths:
+        try:
+            results.append((relpath, hash_file(_join(root, relpath),
+                                               algorithm), None))
+        except OSError as exc:
+            results.append((relpath, None, str(exc)))
+    return results
+
+
+def _join(root, relpath):
+    # a root which is a single file is listed with an empty relative path
+    return os.path.join(root, relpath) if relpath else root
+
+
+def list_tree(root):
+    """
+    Returns (files, links) for a directory tree (or single file), where
+    files is a list of (relative path, size) for the regular files and
+    links maps the relative path of each symbolic link to its target.
+    Symbolic links are not followed.
+    """
+    files = []
+    links = {}
+    st = os.lstat(root)
+    if not stat.S_ISDIR(st.st_mode):
+        return [('', st.st_size)], links
+
+    for dirpath, dirnames, filenames in os.walk(root):
+        reldir = os.path.relpath(dirpath, root)
+        for name in dirnames + filenames:
+            path = os.path.join(dirpath, name)
+            relpath = os.path.normpath(os.path.join(reldir, name))
+            try:
+                st = os.lstat(path)
+            except OSError:
+                continue
+            if stat.S_ISLNK(st.st_mode):
+                links[relpath] = os.readlink(path)
+            elif stat.S_ISREG(st.st_mode):
+                files.append((relpath, st.st_size))
+    return files, links
+
+
+def hash_files(root, files, algorithm=default_algorithm, max_workers=None):
+    """
+    Hashes the given (relative path, size) files under root using a pool
+    of processes, so that hashing is limited by the disk rather than by
+    one CPU.  Large files are hashed individually and small ones in
+    batches, largest first so that the pool is kept busy to the end.
+    Iterable which yields (relpath, digest, error) in no particular order.
+    """
+    batches = []
+    batch = []
+    size_in_batch = 0
+    for relpath, size in sorted(files, key=lambda item: -item[1]):
+        if size >= batch_bytes:
+            batches.append([relpath])
+            continue
+        batch.append(relpath)
+        size_in_batch += size
+        if size_in_batch >= batch_bytes or len(batch) >= batch_files:
+            batches.append(batch)
+            batch = []
+            size_in_batch = 0
+    if batch:
+        batches.append(batch)
+
+    with ProcessPoolExecutor(max_workers=max_workers or default_hash_workers()) \
+            as executor:
+        futures = [executor.submit(_hash_batch, root, batch, algorithm)
+                   for batch in batches]
+        for future in futures:
+            for result in future.result():
+                yield result
+
+
+class Manifest(object):
+    """
+    Checksums of the files of a directory tree, with their sizes, and the
+    targets of any symbolic links.  Stored as JSON lines: a header with
+    the algorithm, original root and creation time, then one line per
+    file ({"p": path, "s": size, "h": digest}) or link ({"p": path,
+    "l": target}), with paths relative to the root.
+    """
+
+    def __init__(self, root, algorithm=default_algorithm, created=None):
+        self.root = root
+        self.algorithm = algorithm
+        self.created = created
+        self.files = {}  # relpath: (size, digest)
+        self.links = {}  # relpath: target
+
+
+    @classmethod
+    def build(cls, root, algorithm=default_algorithm, max_workers=None):
+        """
+        Builds the manifest for a tree.  Raises OSError if any file could
+        not be read.
+        """
+        manifest = cls(root, algorithm=algorithm, created=time.time())
+        files, manifest.links = list_tree(root)
+        sizes = dict(files)
+        for relpath, digest, error in hash_files(root, files, algorithm=algorithm,
+                                                 max_workers=max_workers):
+            if error:
+                raise OSError("cannot checksum {}: {}".format(
+                    _join(root, relpath), error))
+            manifest.files[relpath] = (sizes[relpath], digest)
+        return manifest
+
+
+    @property
+    def total_bytes(self):
+        return sum(size for size, _ in self.files.values())
+
+
+    def save(self, path):
+        tmp_path = os.path.join(os.path.dirname(path),
+                                '.tmp_' + os.path.basename(path))
+        with open(tmp_path, 'w') as f:
+            f.write(json.dumps({'algorithm': self.algorithm,
+                                'root': self.root,
+                                'created': self.created}) + '\n')
+            for relpath in sorted(self.files):
+                size, digest = self.files[relpath]
+                f.write(json.dumps({'p': relpath, 's': size, 'h': digest}) + '\n')
+            for relpath in sorted(self.links):
+                f.write(json.dumps({'p': relpath, 'l': self.links[relpath]}) + '\n')
+        os.chmod(tmp_path, 0o644)
+        os.rename(tmp_path, path)
+
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            header = json.loads(f.readline())
+            manifest = cls(header['root'], algorithm=header['algorithm'],
+                           created=header.get('created'))
+            for line in f:
+                item = json.loads(line)
+                if 'l' in item:
+                    manifest.links[item['p']] = item['l']
+                else:
+                    manifest.files[item['p']] = (item['s'], item['h'])
+        return manifest
+
+
+    def verify(self, root, max_workers=None):
+        """
+        Checks a tree (e.g. retrieved data) against the manifest.  Sizes
+        and links are compared first, and only files whose size matches
+        are hashed.  Files in the tree but not in the manifest are
+        reported as extra.  Returns a VerificationResult.
+        """
+        result = VerificationResult()
+        files, links = list_tree(root)
+        sizes = dict(files)
+
+        to_hash = []
+        for relpath, (size, _) in self.files.items():
+            if relpath not in sizes:
+                result.missing.append(relpath)
+            elif sizes[relpath] != size:
+                result.mismatched.append(relpath)
+            else:
+                to_hash.append((relpath, size))
+        result.extra.extend(relpath for relpath in sizes
+                            if relpath not in self.files)
+
+        for relpath, target in self.links.items():
+            if relpath not in links:
+                result.missing.append(relpath)
+            elif links[relpath] != target:
+                result.mismatched.append(relpath)
+
+        for relpath, digest, error in hash_files(root, to_hash,
+                                                 algorithm=self.algorithm,
+                                                 max_workers=max_workers):
+            result.checked += 1
+            if error:
+                result.unreadable.append(relpath)
+            elif digest != self.files[relpath][1]:
+                result.mismatched.append(relpath)
+
+        return result
+
+
+class VerificationResult(object):
+
+    def __init__(self):
+        self.checked = 0
+        self.missing = []
+        self.mismatched = []
+        self.unreadable = []
+        self.extra = []
+
+
+    @property
+    def ok(self):
+        return not (self.missing or self.mismatched or self.unreadable)
+
+
+    def to_params(self):
+        "summary recorded in the retrieval request"
+        return {'verified': self.ok,
+                'verify_checked': self.checked,
+                'verify_missing': len(self.missing),
+                'verify_mismatched': len(self.mismatched),
+                'verify_unreadable': len(self.unreadable),
+                'verify_extra': len(self.extra)}
+
+
+    def __str__(self):
+        s = 'checked {} files: {} missing, {} mismatched, {} unreadable, {} extra'.format(
+            self.checked, len(self.missing), len(self.mismatched),
+            len(self.unreadable), len(self.extra))
+        examples = sorted(self.missing + self.mismatched + self.unreadable)[:5]
+        if examples:
+            s += ' (e.g. {})'.format(', '.join(examples))
+        return s
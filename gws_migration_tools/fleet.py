@@ -0,0 +1,154 @@
+import os
+import sys
+import json
+import argparse
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from gws_migration_tools import gws
+from gws_migration_tools.migration_request_lib import \
+    RequestsManager, RequestStatus
+from gws_migration_tools.summary import summarise
+
+
+def parse_args(arg_list = None):
+
+    parser = argparse.ArgumentParser(
+        arg_list,
+        description=('find all group workspaces for which migrations have been '
+                     'initialised, and report on their requests'))
+
+    parser.add_argument('prefix',
+                        help=('only look under these layout prefixes '
+                              '(default: all configured layouts)'),
+                        nargs='*')
+
+    parser.add_argument('-l', '--list',
+                        help=('only list the workspace paths, one per line '
+                              '(e.g. for passing to handle-offline-requests)'),
+                        action='store_true')
+
+    parser.add_argument('-s', '--stale-days',
+                        help=('report unfinished requests made more than this '
+                              'number of days ago as stuck (default: 7)'),
+                        type=int,
+                        default=7)
+
+    parser.add_argument('-a', '--archived',
+                        help=('also count archived requests (in jsonl output); '
+                              'this walks the whole archive of each workspace'),
+                        action='store_true')
+
+    parser.add_argument('-j', '--jobs',
+                        help='number of workspaces to scan concurrently (default: 16)',
+                        type=int,
+                        default=16)
+
+    parser.add_argument('-f', '--format',
+                        help='output format (default: text)',
+                        choices=('text', 'jsonl'),
+                        default='text')
+
+    return parser.parse_args()
+
+
+def find_workspaces(prefixes=None, max_workers=16):
+    """
+    Returns the roots of the initialised group workspaces under the
+    configured layouts, optionally restricted to the given layout prefixes.
+    """
+    layouts = gws.get_gws_layouts()
+    if prefixes:
+        prefixes = [os.path.join(prefix, '') for prefix in prefixes]
+        layouts = [(prefix, depth) for prefix, depth in layouts
+                   if prefix in prefixes]
+    return gws.find_initialised_workspaces(layouts, max_workers=max_workers)
+
+
+def scan_workspaces(gws_roots, stale_days=7, max_workers=16,
+                    include_archived=False):
+    """
+    Summarises the requests of several group workspaces concurrently
+    (only counting archived requests if include_archived).  Iterable which
+    yields (gws_root, summary, error) in the order of the supplied roots,
+    where one of summary and error is None.
+    """
+    stale_before = datetime.date.today() - datetime.timedelta(days=stale_days)
+
+    def scan_one(gws_root):
+        try:
+            return (summarise(RequestsManager(gws_root),
+                              stale_before=stale_before,
+                              include_archived=include_archived), None)
+        except Exception as exc:
+            return (None, exc)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for gws_root, (summary, error) in zip(gws_roots,
+                                              executor.map(scan_one, gws_roots)):
+            yield gws_root, summary, error
+
+
+def _print_report(results):
+    totals = dict((status, 0) for status in (RequestStatus.NEW,
+                                            RequestStatus.SUBMITTING,
+                                            RequestStatus.SUBMITTED))
+    num_stale = 0
+    num_errors = 0
+
+    print('{:<50} {:>6} {:>6} {:>6} {:>6} {:>8}'.format(
+        'workspace', 'new', 'subm*', 'subm', 'stuck', 'oldest'))
+
+    for gws_root, summary, error in results:
+        if error:
+            num_errors += 1
+            print('{:<50} scan failed: {}'.format(gws_root, error))
+            continue
+
+        counts = [summary.count_for_status(status) for status in totals]
+        for status, count in zip(totals, counts):
+            totals[status] += count
+        stale = sum(summary.stale.values())
+        num_stale += stale
+        ages = [summary.age_days(status) for status in (RequestStatus.NEW,
+                                                        RequestStatus.SUBMITTED)]
+        ages = [age for age in ages if age is not None]
+
+        print('{:<50} {:>6} {:>6} {:>6} {:>6} {:>8}'.format(
+            gws_root, counts[0], counts[1], counts[2], stale,
+            '{}d'.format(max(ages)) if ages else '-'))
+
+    print('')
+    print('total: {} new, {} submitting, {} submitted, {} stuck, {} unreadable'
+          .format(totals[RequestStatus.NEW],
+                  totals[RequestStatus.SUBMITTING],
+                  totals[RequestStatus.SUBMITTED],
+                  num_stale, num_errors))
+
+
+def main():
+
+    args = parse_args()
+
+    gws_roots = find_workspaces(args.prefix, max_workers=args.jobs)
+
+    if args.list:
+        for gws_root in gws_roots:
+            print(gws_root)
+        return
+
+    results = scan_workspaces(gws_roots,
+                              stale_days=args.stale_days,
+                              max_workers=args.jobs,
+                              include_archived=args.archived)
+
+    if args.format == 'jsonl':
+        for gws_root, summary, error in results:
+            if error:
+                record = {'gws': gws_root, 'error': str(error)}
+            else:
+                record = summary.to_record()
+            print(json.dumps(record))
+            sys.stdout.flush()
+    else:
+        _print_report(results)
@@ -0,0 +1,224 @@
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+
+from gws_migration_tools.migration_request_lib import \
+    all_statuses, finished_statuses, _is_tmp_path, BadFileName
+from gws_migration_tools.util import get_user_login_name
+
+
+class InotifyUnavailable(Exception):
+    pass
+
+
+class PollingWatcher(object):
+    """
+    Watches directories by listing them at intervals and comparing the
+    listings with the previous ones.  Directories whose modification time
+    has not changed since the last poll are not listed again.
+
+    poll() returns a list of (key, filename, added) where key is the key
+    supplied for the directory and added is True / False for a file that
+    has appeared / disappeared.
+    """
+
+    def __init__(self, dirs, interval=5.0):
+        self.dirs = dirs  # list of (key, path)
+        self.interval = interval
+        self._listings = {}
+        self._mtimes = {}
+        for key, path in dirs:
+            self._mtimes[path] = os.stat(path).st_mtime
+            self._listings[path] = _list_requests(path)
+
+
+    def poll(self):
+        time.sleep(self.interval)
+        events = []
+        for key, path in self.dirs:
+            mtime = os.stat(path).st_mtime
+            if mtime == self._mtimes[path]:
+                continue
+            self._mtimes[path] = mtime
+            old = self._listings[path]
+            new = _list_requests(path)
+            self._listings[path] = new
+            events.extend((key, filename, False) for filename in old - new)
+            events.extend((key, filename, True) for filename in new - old)
+        return events
+
+
+class InotifyWatcher(object):
+    """
+    Watches directories using the Linux inotify interface, with the same
+    poll() interface as PollingWatcher.  Note that on network filesystems
+    inotify only sees changes made from the local host.
+    """
+
+    _IN_CREATE = 0x00000100
+    _IN_DELETE = 0x00000200
+    _IN_MOVED_FROM = 0x00000040
+    _IN_MOVED_TO = 0x00000080
+    _IN_NONBLOCK = 0o4000
+    _IN_CLOEXEC = 0o2000000
+    _event_header = struct.Struct('iIII')
+
+    def __init__(self, dirs, interval=5.0):
+        libc_name = ctypes.util.find_library('c')
+        if not libc_name:
+            raise InotifyUnavailable('C library not found')
+        libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise InotifyUnavailable('inotify not supported')
+
+        self.interval = interval
+        self._fd = libc.inotify_init1(self._IN_NONBLOCK | self._IN_CLOEXEC)
+        if self._fd < 0:
+            raise InotifyUnavailable(os.strerror(ctypes.get_errno()))
+
+        mask = (self._IN_CREATE | self._IN_DELETE |
+                self._IN_MOVED_FROM | self._IN_MOVED_TO)
+        self._keys = {}
+        for key, path in dirs:
+            wd = libc.inotify_add_watch(self._fd, os.fsencode(path), mask)
+            if wd < 0:
+                os.close(self._fd)
+                raise InotifyUnavailable(os.strerror(ctypes.get_errno()))
+            self._keys[wd] = key
+
+
+    def poll(self):
+        readable, _, _ = select.select([self._fd], [], [], self.interval)
+        if not readable:
+            return []
+        try:
+            data = os.read(self._fd, 65536)
+        except OSError as exc:
+            if exc.errno == errno.EAGAIN:
+                return []
+            raise
+
+        events = []
+        pos = 0
+        while pos < len(data):
+            wd, mask, _, name_len = self._event_header.unpack_from(data, pos)
+            pos += self._event_header.size
+            filename = os.fsdecode(data[pos:pos + name_len].rstrip(b'\0'))
+            pos += name_len
+            if wd not in self._keys or not _is_request_filename(filename):
+                continue
+            added = bool(mask & (self._IN_CREATE | self._IN_MOVED_TO))
+            events.append((self._keys[wd], filename, added))
+        return events
+
+
+    def close(self):
+        os.close(self._fd)
+
+
+def _is_request_filename(filename):
+    return not (_is_tmp_path(filename) or filename == 'archive')
+
+
+def _list_requests(path):
+    return set(filename for filename in os.listdir(path)
+               if _is_request_filename(filename))
+
+
+def make_watcher(dirs, interval=5.0, use_inotify=True):
+    """
+    Returns an InotifyWatcher for the directories if possible, otherwise
+    a PollingWatcher.
+    """
+    if use_inotify:
+        try:
+            return InotifyWatcher(dirs, interval=interval)
+        except InotifyUnavailable:
+            pass
+    return PollingWatcher(dirs, interval=interval)
+
+
+def follow(mgrs, query, all_users=False, interval=5.0, use_inotify=True,
+           stream=sys.stdout):
+    """
+    Prints the current state of the matching requests in one or more
+    workspaces (one line per request), and then prints a line each time
+    one of them changes status, until interrupted.
+    """
+    # archiving is seen as a removal from a finished status directory
+    dirs = [((mgr, status), mgr.get_dir_for_status(status))
+            for mgr in mgrs for status in all_statuses]
+
+    # start watching before the initial scan so that no change is missed
+    watcher = make_watcher(dirs, interval=interval, use_inotify=use_inotify)
+
+    current = {}  # (gws_root, filename) -> status
+    for mgr in mgrs:
+        for req in mgr.scan(all_users=all_users, query=query):
+            stream.write('{}\n'.format(req))
+        for status, filename, _ in mgr.scan_filenames():
+            current[(mgr.gws_root, filename)] = status
+    stream.flush()
+
+    if query.users is None and not all_users:
+        query.users = set([get_user_login_name()])
+
+    while True:
+        # events are handled in order, so that a request which appears in
+        # a status directory and leaves it again (e.g. moved to DONE and
+        # then archived) is reported at each step
+        removed = {}  # key -> (mgr, status) for requests which have left
+        for (mgr, status), filename, is_added in watcher.poll():
+            try:
+                user, request_type, reqid, date = mgr.parse_filename(filename)
+            except BadFileName:
+                continue  # not a request file, as when scanning
+            if not query.match_filename(user, request_type, reqid, date):
+                continue
+            key = (mgr.gws_root, filename)
+            if is_added:
+                old_status = current.get(key)
+                current[key] = status
+                removed.pop(key, None)
+                if old_status == status:
+                    continue  # content updated in place
+                if query.match_status(status) or (old_status and
+                                                  query.match_status(old_status)):
+                    _report(stream, key,
+                            old_status.name if old_status else 'created',
+                            status.name)
+            elif current.get(key) == status:
+                # reported when it is added elsewhere, if it is
+                removed[key] = (mgr, status)
+
+        for key, (mgr, status) in removed.items():
+            del current[key]
+            archived_status = _find_archived(mgr, key[1])
+            if archived_status is not None:
+                if (query.match_status(status)
+                    or query.match_status(archived_status)):
+                    _report(stream, key, status.name,
+                            '{} (archived)'.format(archived_status.name))
+            elif query.match_status(status):
+                _report(stream, key, status.name, 'removed')
+
+        stream.flush()
+
+
+def _find_archived(mgr, filename):
+    "status under which a request has been archived, or None"
+    for status in finished_statuses:
+        if os.path.exists(mgr.get_request_file_path(filename, status, True)):
+            return status
+    return None
+
+
+def _report(stream, key, old, new):
+    gws_root, filename = key
+    stream.write('{} {} {}: {} -> {}\n'.format(
+        time.strftime('%Y-%m-%d %H:%M:%S'), gws_root, filename, old, new))
@@ -1,5 +1,6 @@
 import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
 
 
 class NotAGroupWorkspace(Exception):
@@ -10,6 +11,33 @@ class NotAGroupWorkspace(Exception):
             return "not a group workspace"
 
 
+# Group workspace layouts, as (prefix, depth) where depth is the number of
+# path components in a workspace root, e.g. /gws/nopw/j04/myws has depth 4.
+# Can be overridden with a comma-separated list of prefix:depth in the
+# GWS_MIGRATION_LAYOUTS environment variable.
+default_gws_layouts = [('/gws/', 4),
+                       ('/group_workspaces/', 3)]
+
+
+def get_gws_layouts():
+    """
+    Returns the list of (prefix, depth) for the recognised group workspace
+    layouts.
+    """
+    if 'GWS_MIGRATION_LAYOUTS' in os.environ:
+        layouts = []
+        for item in os.environ['GWS_MIGRATION_LAYOUTS'].split(','):
+            prefix, depth = item.rsplit(':', 1)
+            layouts.append((os.path.join(prefix, ''), int(depth)))
+    else:
+        layouts = list(default_gws_layouts)
+
+    if '_USE_TEST_GWS' in os.environ:
+        layouts.append(('/tmp/', 2))
+
+    return layouts
+
+
 def get_gws_root_from_path(path):
     
     """
@@ -17,15 +45,9 @@ def get_gws_root_from_path(path):
     path does not have to exist, but the GWS must do so.
     """
 
-    if path.startswith("/gws/"):
-        depth = 4
-
-    elif path.startswith("/group_workspaces/"):
-        depth = 3
-
-    elif '_USE_TEST_GWS' in os.environ and path.startswith("/tmp/"):
-        depth = 2
-
+    for prefix, depth in get_gws_layouts():
+        if path.startswith(prefix):
+            break
     else:
         raise NotAGroupWorkspace(path)
 
@@ -42,6 +64,42 @@ def get_gws_root_from_path(path):
     return gws_path
 
 
+def find_initialised_workspaces(layouts=None, max_workers=16):
+    """
+    Returns a sorted list of the roots of all group workspaces (under the
+    configured layouts, by default) which have a .mngr directory.
+    Directories at each level are listed concurrently.  Unreadable
+    directories are skipped.
+    """
+    if layouts == None:
+        layouts = get_gws_layouts()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        found = []
+        for prefix, depth in layouts:
+            prefix = os.path.normpath(prefix)
+            prefix_depth = len(prefix.strip('/').split('/'))
+            level = [prefix]
+            for _ in range(depth - prefix_depth):
+                level = [path
+                         for paths in executor.map(_list_subdirs, level)
+                         for path in paths]
+            found.extend(path for path in level 
+                         if os.path.isdir(get_mgr_directory(path)))
+
+    return sorted(set(found))
+
+
+def _list_subdirs(path):
+    try:
+        with os.scandir(path) as entries:
+            return [entry.path for entry in entries
+                    if not entry.name.startswith('.')
+                    and entry.is_dir(follow_symlinks=False)]
+    except OSError:
+        return []
+
+
 def am_gws_manager(gws_root):
     """
     Returns boolean, True if user is GWS manager.
@@ -1,10 +1,21 @@
+import os
+import time
 import argparse
+import collections
 
 
 from gws_migration_tools import gws
 from gws_migration_tools.migration_request_lib \
-    import RequestsManager, RequestStatus
+    import RequestsManager, RequestStatus, RequestBase, MigrationRequest, \
+    RetrievalRequest, RetryPolicy, SubmissionDeferred, jdma_iface
 from gws_migration_tools.util import get_traceback
+from gws_migration_tools.sizing import parse_size
+from gws_migration_tools.fleet import find_workspaces
+from gws_migration_tools.lease import LeaseManager
+from gws_migration_tools.checkpoint import Checkpoint, Deadline, resume_order
+from gws_migration_tools.writer import durability_levels
+from gws_migration_tools.reconcile import reconcile_submitting
+from gws_migration_tools.plan import CycleStats, plan_workspace, dump_totals
 
 
 def parse_args(arg_list = None):
@@ -47,17 +58,137 @@ def parse_args(arg_list = None):
                               action='store_true'
                           )
 
+    parser.add_argument('--max-retries',
+                        help=('number of times to retry submitting a request after '
+                              'transient JDMA failures (default: {})'
+                              ).format(RequestBase.retry_policy.max_retries),
+                        type=int,
+                        default=RequestBase.retry_policy.max_retries)
+
+    parser.add_argument('--max-transient-failures',
+                        help=('stop acting on a group workspace for this cycle after '
+                              'this many consecutive transient JDMA failures '
+                              '(default: 3)'),
+                        type=int,
+                        default=3)
+
+    parser.add_argument('--max-submitted',
+                        help=('maximum number of requests in progress on JDMA '
+                              'for each group workspace (default: no limit)'),
+                        type=int)
+
+    parser.add_argument('--max-submitted-per-user',
+                        help=('maximum number of requests in progress on JDMA '
+                              'for each user in a group workspace (default: no limit)'),
+                        type=int)
+
+    parser.add_argument('--measure',
+                        help=('record the file count and total size of directories '
+                              'to be migrated before submitting them, if not '
+                              'already known'),
+                        action='store_true')
+
+    parser.add_argument('--split-size',
+                        help=('split directories bigger than this (e.g. 50T) into '
+                              'batches of about this size, submitted as separate '
+                              'JDMA jobs which can run in parallel'),
+                        type=parse_size)
+
+    parser.add_argument('--max-parts',
+                        help=('maximum number of batches a directory is split into '
+                              '(default: {})').format(MigrationRequest.max_parts),
+                        type=int,
+                        default=MigrationRequest.max_parts)
+
+    parser.add_argument('--checksum',
+                        help=('build a checksum manifest of directories to be migrated '
+                              'before submitting them, and check retrieved data '
+                              'against it before marking retrievals as done'),
+                        action='store_true')
+
+    parser.add_argument('--hash-jobs',
+                        help=('number of processes used for checksums '
+                              '(default: one per CPU)'),
+                        type=int)
+
+    parser.add_argument('--no-space-check',
+                        help=('submit retrievals without first checking that the '
+                              'destination has room for them'),
+                        action='store_true')
+
+    parser.add_argument('--stale-submitting',
+                        help=('match requests which have been in SUBMITTING for '
+                              'longer than this many seconds (left by a handler '
+                              'that was stopped while submitting them) against '
+                              'JDMA, moving them on to SUBMITTED or back to NEW; '
+                              '0 to disable (default: 3600)'),
+                        type=float,
+                        default=3600)
+
+    parser.add_argument('--durability',
+                        help=('how hard to try to make request file updates survive '
+                              'a crash: none (no fsync), data (fsync files before '
+                              'renaming them into place) or full (also fsync the '
+                              'directories) (default: none)'),
+                        choices=durability_levels,
+                        default='none')
+
+    parser.add_argument('--group-size',
+                        help=('write updates to request files from monitoring in '
+                              'groups of up to this many, fsyncing each directory '
+                              'once per group (default: 32; 1 writes each at once)'),
+                        type=int,
+                        default=32)
+
+    workers = parser.add_argument_group('running several workers on one workspace')
+
+    workers.add_argument('-P', '--partition',
+                         help=('share the requests with other handler processes '
+                               'also run with this option, using leases'),
+                         action='store_true')
+
+    workers.add_argument('--worker-id',
+                         help='name of this worker (default: hostname-pid)')
+
+    workers.add_argument('--lease-ttl',
+                         help=('seconds after which the lease of a worker which has '
+                               'stopped renewing it may be taken over (default: 600)'),
+                         type=int,
+                         default=600)
+
+    parser.add_argument('-T', '--max-runtime',
+                        help=('stop before this many seconds have elapsed, recording '
+                              'where each action got to, so that the next run '
+                              'carries on from there'),
+                        type=float)
+
+    parser.add_argument('--plan',
+                        help=('show what a cycle would do - the requests that would '
+                              'be submitted and monitored, the JDMA calls and request '
+                              'file operations expected, and an estimate of the time '
+                              'it would take from recent cycles - without calling '
+                              'JDMA or changing any files'),
+                        action='store_true')
+
     parser.add_argument('--debug',
                         action='store_true')
 
 
+    parser.add_argument('--fleet',
+                        help=('act on all group workspaces for which migrations '
+                              'have been initialised (see fleet-offline-requests)'),
+                        action='store_true')
+
     parser.add_argument('gws',
                         help='path to group workspace',
-                        nargs='+'
+                        nargs='*'
                     )
 
     args = parser.parse_args()
 
+    if not (args.gws or args.fleet):
+        parser.error('no group workspaces specified (give paths or use --fleet)')
+
     return args
 
 
@@ -65,12 +196,114 @@ class Submit:
     name = 'submit'
     input_status = RequestStatus.NEW
     method = 'claim_and_submit'
+    plan_method = '_planned_submit_calls'
+    planned_status = RequestStatus.SUBMITTING
+    # each submission is written out in full before the next JDMA call (the
+    # request file itself is always flushed before it changes status)
+    commit_each = True
+
+    @staticmethod
+    def select(reqs, reqs_mgr, args):
+        return fair_share_schedule(reqs, reqs_mgr,
+                                   max_in_flight=args.max_submitted,
+                                   max_in_flight_per_user=args.max_submitted_per_user)
 
 
 class Monitor:
     name = 'monitor'
     input_status = RequestStatus.SUBMITTED
     method = 'monitor'
+    plan_method = '_planned_check_calls'
+    planned_status = None
+    commit_each = False
+
+    @staticmethod
+    def select(reqs, reqs_mgr, args):
+        return reqs
+
+
+# statuses of requests which count towards the in-flight limits
+in_flight_statuses = (RequestStatus.SUBMITTING, RequestStatus.SUBMITTED)
+
+
+def count_in_flight(reqs_mgr):
+    """
+    Returns (total, per_user) numbers of requests currently being handled
+    by JDMA, from the filenames only.
+    """
+    per_user = collections.Counter()
+    for status, filename, _ in reqs_mgr.scan_filenames(in_flight_statuses):
+        user, _, _, _ = reqs_mgr.parse_filename(filename)
+        per_user[user] += 1
+    return sum(per_user.values()), per_user
+
+
+def fair_share_order(reqs, reqs_mgr, in_flight_per_user=None):
+    """
+    Iterable which yields (user, request) for NEW requests in a fair order:
+    users take turns, those with fewest requests already in flight going
+    first in each round, and each user's turns alternate between request
+    types.  Within a user and request type, requests are taken in the order
+    supplied.
+    """
+    if in_flight_per_user is None:
+        in_flight_per_user = collections.Counter()
+
+    queues = collections.OrderedDict()  # user -> request type -> deque
+    for req in reqs:
+        user, request_type, _, _ = reqs_mgr.parse_filename(req.filename)
+        queues.setdefault(user, collections.OrderedDict()) \
+              .setdefault(request_type, collections.deque()).append(req)
+
+    turns = dict((user, collections.deque(by_type))
+                 for user, by_type in queues.items())
+
+    while queues:
+        for user in sorted(queues, key=lambda user: in_flight_per_user[user]):
+            by_type = queues[user]
+            request_type = turns[user][0]
+            turns[user].rotate(-1)
+            yield user, by_type[request_type].popleft()
+            if not by_type[request_type]:
+                del by_type[request_type]
+                turns[user].remove(request_type)
+                if not by_type:
+                    del queues[user]
+
+
+def fair_share_schedule(reqs, reqs_mgr,
+                        max_in_flight=None, max_in_flight_per_user=None):
+    """
+    Iterable which yields the NEW requests to submit in this cycle, in
+    fair-share order (see fair_share_order), stopping when the limits on
+    the numbers of requests in flight for the workspace or for a user have
+    been reached.  Requests which are waiting to be retried after a
+    transient failure are skipped.  The rest are left in NEW for later
+    cycles.
+    """
+    total, per_user = count_in_flight(reqs_mgr)
+    now = time.time()
+
+    for user, req in fair_share_order(reqs, reqs_mgr, per_user):
+        if max_in_flight is not None and total >= max_in_flight:
+            return
+        if (max_in_flight_per_user is not None
+            and per_user[user] >= max_in_flight_per_user):
+            continue
+        try:
+            if not req.is_due(now):
+                continue
+        except FileNotFoundError:
+            continue  # withdrawn since the scan
+
+        total += 1
+        per_user[user] += 1
+        yield req
+
+        # give the slot back if the request was not submitted after all
+        if req.status not in in_flight_statuses:
+            total -= 1
+            per_user[user] -= 1
 
 
 def main():
@@ -86,6 +319,20 @@ def main():
     else:
         request_types = None  # no filter
 
+    RequestBase.retry_policy = RetryPolicy(
+        max_retries=args.max_retries,
+        base_delay=RequestBase.retry_policy.base_delay,
+        max_delay=RequestBase.retry_policy.max_delay)
+
+    MigrationRequest.measure_before_submit = args.measure
+    MigrationRequest.checksum_before_submit = args.checksum
+    MigrationRequest.split_bytes = args.split_size
+    MigrationRequest.max_parts = args.max_parts
+    RetrievalRequest.verify_after_retrieval = args.checksum
+    RetrievalRequest.check_space_before_submit = not args.no_space_check
+    MigrationRequest.hash_workers = RetrievalRequest.hash_workers = args.hash_jobs
+    RequestsManager.default_durability = args.durability
+
     actions = []
     # monitor before submit (avoids pointlessly checking requests
     # that have only just been submitted)
@@ -96,7 +343,21 @@ def main():
     else:
         actions = [Monitor, Submit]
 
-    for gws_path in args.gws:
+    deadline = Deadline(args.max_runtime)
+
+    gws_paths = list(args.gws)
+    if args.fleet:
+        gws_paths.extend(find_workspaces())
+
+    if args.plan:
+        plan_workspaces(gws_paths, actions, request_types, args)
+        return
+
+    for gws_path in gws_paths:
+        if deadline.expired():
+            print("Time limit reached - not handling remaining group workspaces")
+            break
+
         gws_root = gws.get_gws_root_from_path(gws_path)
 
         if not gws.am_gws_manager(gws_root):
@@ -105,21 +366,140 @@ def main():
 
         reqs_mgr = RequestsManager(gws_root)
 
-        for action in actions:
-
-            reqs = reqs_mgr.scan(all_users=True,
-                                 statuses=(action.input_status,),
-                                 request_types=request_types)
-
-            reqs.sort(key=lambda req:req.reqid)
-
-            for req in reqs:
+        for path in reqs_mgr.remove_stale_tmp_files():
+            print("Removed temporary file left by an interrupted write: {}".format(path))
+
+        lease_mgr = None
+        if args.partition:
+            lease_mgr = LeaseManager(reqs_mgr,
+                                     worker_id=args.worker_id,
+                                     ttl=args.lease_ttl)
+            lease_mgr.heartbeat()
+
+        try:
+            if args.stale_submitting:
+                reconcile_workspace(reqs_mgr, args, lease_mgr=lease_mgr)
+            handle_workspace(reqs_mgr, actions, request_types, args,
+                             lease_mgr=lease_mgr, deadline=deadline)
+        finally:
+            if lease_mgr:
+                lease_mgr.unregister()
+
+
+def plan_workspaces(gws_paths, actions, request_types, args):
+    "show what a cycle would do (see plan_workspace), with totals"
+    plans = []
+    for gws_path in gws_paths:
+        plan = plan_workspace(RequestsManager(gws.get_gws_root_from_path(gws_path)),
+                              actions, request_types, args)
+        plan.dump()
+        plans.append(plan)
+
+    if len(plans) > 1:
+        print("total for {} group workspaces:".format(len(plans)))
+        jdma_calls = collections.Counter()
+        file_ops = collections.Counter()
+        for plan in plans:
+            jdma_calls.update(plan.jdma_calls)
+            file_ops.update(plan.file_ops)
+        dump_totals(jdma_calls, file_ops, sum(plan.seconds for plan in plans),
+                    sum(action.num_unknown_ops for plan in plans
+                        for action in plan.actions),
+                    indent=' ')
+
+    if args.max_runtime and sum(plan.seconds for plan in plans) > args.max_runtime:
+        print("The estimated time is more than the limit of {} seconds; the cycle "
+              "would stop early and carry on in the next one".format(args.max_runtime))
+
+
+def reconcile_workspace(reqs_mgr, args, lease_mgr=None):
+    "deal with requests left in SUBMITTING (see reconcile_submitting)"
+    try:
+        with reqs_mgr.group_commit(max_pending=args.group_size):
+            for message in reconcile_submitting(reqs_mgr, args.stale_submitting,
+                                                lease_mgr=lease_mgr):
+                print(message)
+    except Exception as err:
+        print("reconciliation of requests in SUBMITTING failed with: {}".format(err))
+        if args.debug:
+            print('=============')
+            print(err)
+            print(get_traceback())
+            print('=============')
+
+
+def handle_workspace(reqs_mgr, actions, request_types, args,
+                     lease_mgr=None, deadline=None):
+
+    if deadline is None:
+        deadline = Deadline()
+
+    checkpoint = Checkpoint(reqs_mgr)
+    stats = CycleStats(reqs_mgr)
+
+    for i, action in enumerate(actions):
+
+        # each action gets an equal share of the time left (including any
+        # that earlier actions did not need), so that a large backlog for
+        # one of them cannot stop the others having a turn
+        action_deadline = deadline.share(1. / (len(actions) - i))
+
+        reqs = reqs_mgr.scan(all_users=True,
+                             statuses=(action.input_status,),
+                             request_types=request_types)
+
+        reqs.sort(key=lambda req:req.reqid)
+
+        # carry on from where an earlier cycle was stopped
+        handled = checkpoint.get(action.name)
+        reqs = resume_order(reqs, handled)
+
+        if lease_mgr:
+            reqs = lease_mgr.partition(reqs)
+
+        num_transient = 0
+        stopped = False
+
+        # updates to request files are written in groups (see RequestWriter)
+        with reqs_mgr.group_commit(max_pending=args.group_size):
+            for req in action.select(reqs, reqs_mgr, args):
+                if num_transient >= args.max_transient_failures:
+                    print("{}: too many transient JDMA failures, "
+                          "leaving remaining requests until next time"
+                          .format(action.name))
+                    stopped = True
+                    break
+                if action_deadline.expired():
+                    print("{}: time limit reached, leaving remaining requests "
+                          "until next time".format(action.name))
+                    stopped = True
+                    break
+                if lease_mgr:
+                    lease_mgr.maybe_heartbeat()
+                    if not lease_mgr.acquire(req.reqid):
+                        continue  # another worker has it
+                    if not os.path.exists(req._path):
+                        lease_mgr.release(req.reqid)
+                        continue  # already handled by another worker
                 method = getattr(req, action.method)
+                action_deadline.start_request()
+                started = time.time()
+                op_counts = reqs_mgr.op_counts.copy()
+                if lease_mgr:
+                    lease_mgr.start_keep_alive()
                 try:
                     message = method()
                     if message:
                         print(message)
+                    num_transient = 0
+                except SubmissionDeferred as err:
+                    if err.transient:
+                        num_transient += 1
+                    print("{} of request {}: deferred: {}"
+                          .format(action.name, req.reqid, err))
                 except Exception as err:
+                    if jdma_iface.is_transient_error(err):
+                        num_transient += 1
                     print("{} of request {}: failed with: {}"
                           .format(action.name, req.reqid, err))
                     if args.debug:
@@ -127,3 +507,26 @@ def main():
                         print(err)
                         print(get_traceback())
                         print('=============')
+                finally:
+                    if lease_mgr:
+                        lease_mgr.stop_keep_alive()
+                    handled.add(req.reqid)
+                    # updates must be on disk before the lease is given up
+                    if action.commit_each or lease_mgr:
+                        reqs_mgr.writer.commit()
+                    action_deadline.end_request()
+                    stats.add(action.name, req.request_type, time.time() - started,
+                              reqs_mgr.op_counts - op_counts)
+                    if lease_mgr:
+                        lease_mgr.release(req.reqid)
+
+        stats.save()
+
+        if stopped:
+            # only those still waiting for this action need remembering
+            checkpoint.set(action.name,
+                           handled.intersection(req.reqid for req in reqs))
+            checkpoint.save()
+        elif checkpoint.get(action.name):
+            checkpoint.set(action.name, None)
+            checkpoint.save()
@@ -5,6 +5,8 @@ import argparse
 from gws_migration_tools import gws
 from gws_migration_tools.migration_request_lib import \
     RequestsManager, NotInitialised
+from gws_migration_tools.storage_policy import StoragePolicy, storage_backends
+from gws_migration_tools.sizing import parse_size
 
 
 def parse_args(arg_list = None):
@@ -12,15 +14,64 @@ def parse_args(arg_list = None):
     parser = argparse.ArgumentParser(
         arg_list,
         description=('create directories required for migration requests '
-                     'for a group workspace '
+                     'for a group workspace, and set its storage policy '
                      '(to be run by GWS manager)'))
 
     parser.add_argument('gws',
                         help='path to group workspace')
 
+    policy = parser.add_argument_group(
+        'storage policy (changes the current policy; by default everything '
+        'is migrated to {})'.format(StoragePolicy().default_storage))
+
+    policy.add_argument('--reset-storage-policy',
+                        help='start from the default policy, rather than the current one',
+                        action='store_true')
+
+    policy.add_argument('--default-storage',
+                        help='storage backend for migrations',
+                        choices=storage_backends)
+
+    policy.add_argument('--small-size',
+                        help=('send directories of up to this size (e.g. 10G) which '
+                              'are expected to be retrieved often to the storage '
+                              'backend for small directories'),
+                        type=parse_size)
+
+    policy.add_argument('--small-storage',
+                        help=('storage backend for small directories (default: {})'
+                              .format(StoragePolicy().small_storage)),
+                        choices=storage_backends)
+
+    policy.add_argument('--frequent-retrievals',
+                        help=('expect a directory to be retrieved often only if '
+                              'its migration request says so, or it has already been '
+                              'retrieved this many times (by default, any small '
+                              'directory not requested as rarely retrieved)'),
+                        type=int)
+
     return parser.parse_args()
 
 
+def set_storage_policy(mgr, args):
+    """
+    Changes the storage policy of the workspace as given by the
+    arguments, if any are given, and prints it.
+    """
+    policy = StoragePolicy() if args.reset_storage_policy else mgr.storage_policy
+    changed = args.reset_storage_policy
+    for key, value in (('default_storage', args.default_storage),
+                       ('small_bytes', args.small_size),
+                       ('small_storage', args.small_storage),
+                       ('frequent_retrievals', args.frequent_retrievals)):
+        if value != None:
+            setattr(policy, key, value)
+            changed = True
+    if changed:
+        policy.save(mgr)
+    print("storage policy: {}".format(policy))
+
+
 def main():
 
     args = parse_args()
@@ -38,3 +89,4 @@ def main():
         print("Initialisation failed")
         sys.exit(1)
     print("created control files/directories under {}".format(mgr.base_dir))
+    set_storage_policy(mgr, args)
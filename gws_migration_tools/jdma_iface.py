@@ -1,10 +1,20 @@
 import os
 import time
+import calendar
 import re
 import sys
+import socket
+import collections
 
 from jdma_client import jdma_lib, jdma_common
 
+try:
+    from requests import exceptions as _http_exceptions
+    _transient_http_errors = (_http_exceptions.ConnectionError,
+                              _http_exceptions.Timeout)
+except ImportError:
+    _transient_http_errors = ()
+
 from gws_migration_tools.util import get_user_login_name
 from gws_migration_tools.gws import get_gws_root_from_path
 
@@ -13,21 +23,67 @@ class JDMAInterfaceError(Exception):
     pass
 
 
+def set_jdma_api_url(url):
+    """
+    Point jdma_lib at a different JDMA server (e.g. a mock_jdma server for
+    testing).  This is done at import time if GWS_MIGRATION_JDMA_URL is set.
+    """
+    settings = getattr(jdma_lib, 'settings', None)
+    if settings is None or not hasattr(settings, 'JDMA_API_URL'):
+        raise JDMAInterfaceError('cannot set the JDMA URL in this version of jdma_client')
+    settings.JDMA_API_URL = url
+
+
+class JDMATransientError(JDMAInterfaceError):
+    """
+    An error which is expected to go away if the same call is retried
+    later (e.g. JDMA returned a 5xx status code)
+    """
+    pass
+
+
 class JDMAInterface(object):
 
     def __init__(self, username=None):
         if not username:
             username = get_user_login_name()
         self.username = username
+        self._os_creds = None
         self._set_storage_params()
 
 
     def _set_storage_params(self):
+        # default storage backend, used where a request does not give one
         self.storage_type = 'elastictape'
         self.credentials = {}
 
 
-    def submit_migrate(self, params):
+    def get_credentials(self, storage):
+        "credentials for a storage backend"
+        if storage == self.storage_type:
+            return self.credentials
+        if storage == 'objectstore':
+            return self._objectstore_credentials()
+        return {}
+
+
+    def _objectstore_credentials(self):
+        if not self._os_creds:
+            creds_file = os.path.join(os.environ['HOME'], '.os_creds')
+            self._os_creds = self._read_creds(creds_file)
+        return self._os_creds
+
+
+    def _read_creds(self, path):
+        with open(path) as f:
+            access_key = f.readline().strip()
+            secret_key = f.readline().strip()
+        return {'access_key': access_key,
+                'secret_key': secret_key}
+
+
+    def submit_migrate(self, params, filelist=None, part=None, num_parts=None,
+                       check_existing=True):
         """
         Submit a MIGRATE job.
         Wraps jdma_lib with the following constraints:
@@ -35,6 +91,17 @@ class JDMAInterface(object):
             label is this directory to be uploaded
             workspace (used for storage allocation) matches the one on which the files are located
 
+        For a migration split into several batches, call once for each
+        part (numbered from 1), with the filelist of that part; the label
+        is then the directory followed by the part number (see part_label).
+
+        The batch goes to the storage backend recorded in the request
+        (see storage_policy), or else the default one.
+
+        Unless check_existing is False (when carrying on with the other
+        parts of a split migration whose batches are already on storage),
+        submitting the first part fails if the path has been migrated.
+
         Returns the request ID
         """
         
@@ -42,21 +109,39 @@ class JDMAInterface(object):
 
         workspace = self._get_workspace(path)
 
-        batch_id = self._get_batch_id_for_path(path)
-        if batch_id != None:
-            raise JDMAInterfaceError(('Path {} has already been migrated (as batch ID: {})'
-                                      ).format(path, batch_id))
+        if check_existing and (part == None or part == 1):
+            batch_ids = self._get_batch_ids_for_path(path)
+            if batch_ids:
+                raise JDMAInterfaceError(('Path {} has already been migrated (as batch ID: {})'
+                                          ).format(path, ','.join(map(str, batch_ids))))
+
+        if part == None:
+            filelist = [path]
+            label = path
+        else:
+            label = self.part_label(path, part, num_parts)
+
+        storage = params.get('storage') or self.storage_type
 
         resp = jdma_lib.upload_files(
             self.username,
-            filelist=[path],
+            filelist=filelist,
             request_type='MIGRATE',
-            storage=self.storage_type,
-            label=path,
-            credentials=self.credentials,
+            storage=storage,
+            label=label,
+            credentials=self.get_credentials(storage),
             workspace=workspace)
 
         return self._resp_to_req_id(resp)
+
+
+    _part_label_matcher = re.compile(r'(?P<path>.*) \(part (?P<part>[0-9]+) of '
+                                     r'(?P<num_parts>[0-9]+)\)$').match
+
+
+    def part_label(self, path, part, num_parts):
+        "label of one batch of a migration split into several batches"
+        return '{} (part {} of {})'.format(path, part, num_parts)
         
 
     def _resp_to_req_id(self, resp):
@@ -65,25 +150,33 @@ class JDMAInterface(object):
         or if status code was not 200, raises an exception with 
         the error.
         """
+        status_code = resp.status_code
+
         try:
             fields = resp.json()
         except ValueError:
+            if status_code // 100 == 5:
+                raise JDMATransientError('JDMA request failed with HTTP status code {}'
+                                         .format(status_code))
             raise JDMAInterfaceError('unparseable response from JDMA')
 
-        status_code = resp.status_code
-
         if status_code == 200:
             try:
                 return fields['request_id']
             except KeyError:
                 raise JDMAInterfaceError('no request ID in JDMA response')
             
-        elif 'error' in fields:
-            raise JDMAInterfaceError('JDMA request failed with HTTP status code {} and message: {}'
-                                     .format(status_code, fields['error']))
+        if status_code // 100 == 5:
+            error_class = JDMATransientError
         else:
-            raise JDMAInterfaceError('JDMA request failed with HTTP status code {}'
-                                     .format(status_code))
+            error_class = JDMAInterfaceError
+
+        if 'error' in fields:
+            raise error_class('JDMA request failed with HTTP status code {} and message: {}'
+                              .format(status_code, fields['error']))
+        else:
+            raise error_class('JDMA request failed with HTTP status code {}'
+                              .format(status_code))
 
 
     def _get_workspace(self, path):
@@ -99,17 +192,163 @@ class JDMAInterface(object):
     
 
     def _get_batch_id_for_path(self, path, must_exist=False):
-        id = self._get_batch_id_for_path2(path)
+        batch = self._get_batch_for_path2(path)
+        id = None if batch == None else batch['migration_id']
         if id == None and must_exist:
             raise JDMAInterfaceError('could not find batch on storage for path {}'.format(path))
         else:
             return id
 
 
-    def _get_batch_id_for_path2(self, path):
+    def get_batch_ids_for_path(self, path):
+        """
+        Returns the IDs of the batches on storage holding a migrated path:
+        a single batch, or for a migration split into parts, the batch
+        of each part in order.  Raises an exception if there are none or
+        some parts are missing.
+        """
+        return [batch['migration_id'] for batch in self.get_batches_for_path(path)]
+
+
+    def get_batches_for_path(self, path):
+        """
+        As get_batch_ids_for_path, but returns the batch records as given
+        by JDMA (which include the storage backend holding each batch).
+        """
+        batches = self._get_batches_for_path(path)
+        if not batches:
+            raise JDMAInterfaceError('could not find batch on storage for path {}'.format(path))
+        return batches
+
+
+    def _get_batch_ids_for_path(self, path):
+        return [batch['migration_id'] for batch in self._get_batches_for_path(path)]
+
+
+    def _get_batches_for_path(self, path):
+        batch = self._get_batch_for_path2(path)
+        if batch != None:
+            return [batch]
+        return self._get_part_batches(path)
+
+
+    def _get_part_batches(self, path):
+        """
+        Look up the batches on storage labelled as parts of the supplied
+        path, returning them in order of part number (or an empty list if
+        there are none).
+        """
+        resp = jdma_lib.get_batch(self.username,
+                                  workspace=self._get_workspace(path))
+        if resp.status_code != 200:
+            return []
+        resp_dict = resp.json()
+        batches = resp_dict.get('migrations', [resp_dict])
+
+        parts = {}
+        num_parts = None
+        for batch in batches:
+            m = self._part_label_matcher(batch.get('label') or '')
+            if (not m or m.group('path') != path
+                or jdma_common.get_batch_stage(batch['stage']) != 'ON_STORAGE'):
+                continue
+            num_parts = int(m.group('num_parts'))
+            parts[int(m.group('part'))] = batch
+
+        if not parts:
+            return []
+        if sorted(parts) != list(range(1, num_parts + 1)):
+            raise JDMAInterfaceError('found parts {} of {} on storage for path {}'
+                                     .format(','.join(map(str, sorted(parts))),
+                                             num_parts, path))
+        return [parts[part] for part in sorted(parts)]
+
+
+    def get_catalogue(self, path):
+        """
+        Returns a JDMACatalogue of the batches of the workspace containing
+        the path and the JDMA requests of this user, from one query of
+        each.
+        """
+        workspace = self._get_workspace(path)
+        batches = self._list(jdma_lib.get_batch(self.username, workspace=workspace),
+                             'migrations', 'batches of workspace {}'.format(workspace))
+        requests = self._list(jdma_lib.get_request(self.username),
+                              'requests', 'requests of user {}'.format(self.username))
+        return JDMACatalogue(self, batches, requests)
+
+
+    def get_stored_parts(self, path, num_parts):
+        """
+        For a migration of a path split into num_parts parts, returns a
+        dictionary of part number: ID of the JDMA request which migrated
+        it, for the parts whose batches are on storage (e.g. left by an
+        earlier attempt in which another part failed).
+        """
+        workspace = self._get_workspace(path)
+        labels = dict((self.part_label(path, part, num_parts), part)
+                      for part in range(1, num_parts + 1))
+        batches = [batch for batch in
+                   self._list(jdma_lib.get_batch(self.username, workspace=workspace),
+                              'migrations', 'batches of workspace {}'.format(workspace))
+                   if batch.get('label') in labels
+                   and jdma_common.get_batch_stage(batch['stage']) == 'ON_STORAGE']
+        if not batches:
+            return {}
+        requests = self._list(jdma_lib.get_request(self.username),
+                              'requests', 'requests of user {}'.format(self.username))
+        catalogue = JDMACatalogue(self, batches, requests)
+        stored = {}
+        for batch in batches:
+            job = catalogue.find_request('PUT', [batch['migration_id']])
+            if job is None:
+                raise JDMAInterfaceError(
+                    'batch {} of {} is on storage, but the JDMA request which put '
+                    'it there was not found'.format(batch['migration_id'],
+                                                    batch['label']))
+            stored[labels[batch['label']]] = job['request_id']
+        return stored
+
+
+    def get_migrated_size(self, path):
+        """
+        Returns the total size in bytes of the batch or batches on storage
+        holding a migrated path, if JDMA reports the sizes of batches, or
+        None.
+        """
+        workspace = self._get_workspace(path)
+        batches = self._list(jdma_lib.get_batch(self.username, workspace=workspace),
+                             'migrations', 'batches of workspace {}'.format(workspace))
+        sizes = []
+        for batch in batches:
+            label = batch.get('label') or ''
+            m = self._part_label_matcher(label)
+            if ((label == path or (m and m.group('path') == path))
+                and jdma_common.get_batch_stage(batch['stage']) == 'ON_STORAGE'):
+                sizes.append(batch.get('size'))
+        if not sizes or None in sizes:
+            return None
+        return sum(sizes)
+
+
+    def _list(self, resp, key, description):
+        "the records in a response to a query which may match several"
+        if resp.status_code == 404:
+            return []
+        if resp.status_code // 100 == 5:
+            raise JDMATransientError('JDMA query failure (HTTP status code {}) listing {}'
+                                     .format(resp.status_code, description))
+        if resp.status_code != 200:
+            raise JDMAInterfaceError('JDMA error (HTTP status code {}) listing {}'
+                                     .format(resp.status_code, description))
+        resp_dict = resp.json()
+        return resp_dict.get(key, [resp_dict])
+
+
+    def _get_batch_for_path2(self, path):
         """
         Look up the batch with label = the supplied path
-        and whose location is 'ON_STORAGE'
+        and whose location is 'ON_STORAGE', returning its record
         """
 
         workspace = self._get_workspace(path)
@@ -132,8 +371,9 @@ class JDMAInterface(object):
         else:
             batches = [resp_dict]
         
-        batch_ids = [batch['migration_id'] for batch in batches 
-                     if jdma_common.get_batch_stage(batch['stage']) == 'ON_STORAGE']
+        batches = [batch for batch in batches 
+                   if jdma_common.get_batch_stage(batch['stage']) == 'ON_STORAGE']
+        batch_ids = [batch['migration_id'] for batch in batches]
     
         num_matches = len(batch_ids)
 
@@ -141,7 +381,7 @@ class JDMAInterface(object):
             return None
 
         elif num_matches == 1:
-            return batch_ids[0]
+            return batches[0]
 
         else:
             raise JDMAInterfaceError('found more than one batch on storage for path {} (ids={})'
@@ -161,11 +401,20 @@ class JDMAInterface(object):
         
         batch_id = self._get_batch_id_for_path(orig_path, must_exist=True)
 
+        return self.retrieve_batch(batch_id, new_path,
+                                   storage=params.get('storage'))
+
+
+    def retrieve_batch(self, batch_id, target_dir, storage=None):
+        """
+        submit a RETRIEVE job for one batch (held on the given storage
+        backend, by default the default one), returning the request ID
+        """
         resp = jdma_lib.download_files(            
             self.username,
             batch_id=batch_id,
-            target_dir=new_path,
-            credentials=self.credentials)
+            target_dir=target_dir,
+            credentials=self.get_credentials(storage or self.storage_type))
             
         return self._resp_to_req_id(resp)
 
@@ -176,16 +425,36 @@ class JDMAInterface(object):
 
         batch_id = self._get_batch_id_for_path(orig_path, must_exist=True)
         
+        return self.delete_batch(batch_id, storage=params.get('storage'))
+
+
+    def delete_batch(self, batch_id, storage=None):
+        """
+        submit a DELETE job for one batch (held on the given storage
+        backend, by default the default one), returning the request ID
+        """
+        storage = storage or self.storage_type
         resp = jdma_lib.delete_batch(self.username,
                                      batch_id,
-                                     storage=self.storage_type,
-                                     credentials=self.credentials)
+                                     storage=storage,
+                                     credentials=self.get_credentials(storage))
          
         return self._resp_to_req_id(resp)
             
         
 
 
+    def is_transient_error(self, exc):
+        """
+        Returns True if an exception raised by one of the submit or check
+        methods is worth retrying later (JDMA unavailable or timing out),
+        or False if the request should be treated as failed.
+        """
+        return isinstance(exc, (JDMATransientError, socket.timeout,
+                                ConnectionError, TimeoutError)
+                          + _transient_http_errors)
+
+
     def check(self, params):
         """
         Check status of a request.
@@ -196,16 +465,67 @@ class JDMAInterface(object):
            and maybe a key 'message' with a message
         """
 
+        ext_ids = params.get('external_ids')
+        if ext_ids:
+            return self._check_several(ext_ids)
+
         ext_id = params.get('external_id')
         if not ext_id:
             raise JDMAInterfaceError('attempt to check a request that has not '
                                      'yet been submitted')
 
+        stage_name = self._get_request_stage(ext_id)
+
+        message = 'JDMA reported stage {} when checked at {}'.format(stage_name,
+                                                                     time.asctime())
+
+        return { 'succeeded': self._stage_succeeded(stage_name),
+                 'message': message}
+
+
+    def _check_several(self, ext_ids):
+        """
+        Check a request which was submitted as several JDMA requests (one
+        per batch).  It has succeeded when they all have, and failed if
+        any of them has.
+        """
+        stage_names = [self._get_request_stage(ext_id) for ext_id in ext_ids]
+        outcomes = [self._stage_succeeded(name) for name in stage_names]
+        if False in outcomes:
+            succeeded = False
+        elif None in outcomes:
+            succeeded = None
+        else:
+            succeeded = True
+
+        counts = collections.Counter(stage_names)
+        message = 'JDMA reported stages {} for {} requests when checked at {}'.format(
+            ', '.join('{} x{}'.format(name, counts[name]) for name in sorted(counts)),
+            len(ext_ids), time.asctime())
+
+        return { 'succeeded': succeeded,
+                 'message': message}
+
+
+    def _stage_succeeded(self, stage_name):
+        "True / False if completed / failed, or None if still in progress"
+        if stage_name in ('PUT_COMPLETED',
+                          'GET_COMPLETED',
+                          'DELETE_COMPLETED'):
+            return True
+        elif stage_name == 'FAILED':
+            return False
+        else:
+            return None
+
+
+    def _get_request_stage(self, ext_id):
+
         resp = jdma_lib.get_request(self.username, req_id=ext_id)
 
         if resp.status_code // 100 == 5:
-            raise JDMAInterfaceError("JDMA query failure checking request {}"
-                                     .format(message, ext_id))            
+            raise JDMATransientError("JDMA query failure (HTTP status code {}) checking request {}"
+                                     .format(resp.status_code, ext_id))
 
         ext_req = resp.json()
 
@@ -219,25 +539,86 @@ class JDMAInterface(object):
                                      .format(message, ext_id))
 
         stage = ext_req['stage']
-        stage_name = jdma_common.get_request_stage(stage)
+        return jdma_common.get_request_stage(stage)
+        
+        
 
-        message = 'JDMA reported stage {} when checked at {}'.format(stage_name,
-                                                                     time.asctime())
+class JDMACatalogue(object):
+    """
+    Snapshot of the batches of a workspace and the JDMA requests of a user,
+    for matching up many requests at once without querying JDMA for each.
+    """
 
-        if stage_name in ('PUT_COMPLETED',
-                          'GET_COMPLETED',
-                          'DELETE_COMPLETED'):
-            succeeded = True
-        
-        elif stage_name == 'FAILED':
-            succeeded = False
+    # JDMA request types as reported, by the kind of job
+    _request_types = {'PUT': ('PUT', 'MIGRATE'),
+                      'GET': ('GET',),
+                      'DELETE': ('DELETE',)}
 
-        else:
-            succeeded = None
+    def __init__(self, iface, batches, requests):
+        self.iface = iface
+        self._batches_by_label = collections.defaultdict(list)
+        for batch in batches:
+            self._batches_by_label[batch.get('label')].append(batch['migration_id'])
+        self._requests_by_batch = collections.defaultdict(list)
+        for req in requests:
+            self._requests_by_batch[req.get('migration_id')].append(req)
 
-        return { 'succeeded': succeeded,
-                 'message': message}
-        
-        
+
+    def batch_ids(self, label):
+        "IDs of the batches with the given label, in any state"
+        return list(self._batches_by_label.get(label, []))
+
+
+    def batch_ids_for_path(self, path):
+        """
+        Returns a list with, for each batch holding the migrated path (one,
+        or one per part of a migration split into parts, in part order),
+        a list of the IDs of the batches with its label.
+        """
+        if path in self._batches_by_label:
+            return [self.batch_ids(path)]
+        parts = {}
+        for label in self._batches_by_label:
+            m = self.iface._part_label_matcher(label or '')
+            if m and m.group('path') == path:
+                parts[int(m.group('part'))] = self.batch_ids(label)
+        return [parts[part] for part in sorted(parts)]
+
+
+    def find_request(self, kind, batch_ids, since=None, exclude=()):
+        """
+        Returns the earliest JDMA request of the given kind (PUT, GET or
+        DELETE) on one of the given batches, made no earlier than since
+        (if the time of the request is known) and whose ID is not in
+        exclude, or None.
+        """
+        candidates = []
+        for batch_id in batch_ids:
+            for req in self._requests_by_batch.get(batch_id, []):
+                if (req.get('request_type', '').upper() not in self._request_types[kind]
+                    or req['request_id'] in exclude):
+                    continue
+                when = self.request_time(req)
+                if since != None and when != None and when < since:
+                    continue
+                candidates.append(req)
+        if not candidates:
+            return None
+        return min(candidates, key=lambda req: req['request_id'])
+
+
+    @staticmethod
+    def request_time(req):
+        "time at which JDMA accepted a request, or None if not known"
+        try:
+            return calendar.timegm(time.strptime(req['date'][:19],
+                                                 '%Y-%m-%dT%H:%M:%S'))
+        except (KeyError, TypeError, ValueError):
+            return None
+
+
+
+if 'GWS_MIGRATION_JDMA_URL' in os.environ:
+    set_jdma_api_url(os.environ['GWS_MIGRATION_JDMA_URL'])
 
 jdma_iface = JDMAInterface()
@@ -0,0 +1,225 @@
+import os
+import re
+import json
+import time
+import fcntl
+
+
+class JournalTruncated(Exception):
+    """
+    Raised when reading from an offset which is earlier than anything still
+    kept in the journal.  The consumer needs to rescan the request
+    directories and then continue from the current end offset.
+    """
+    pass
+
+
+class Journal(object):
+    """
+    Append-only log of request transitions, kept in the .mngr directory of
+    a group workspace.
+
+    Each record is one line of JSON, with keys:
+       t: time of the transition (seconds since the epoch)
+       op: one of 'create', 'move', 'param', 'archive'
+       id: request id
+       fn: request filename
+       from, to: old and new status directory names (for 'move')
+       st: status directory name (for 'create', 'param', 'archive')
+       key: parameter name (for 'param')
+
+    Positions in the journal are given as offsets, which increase
+    monotonically over the life of the journal, so a consumer can save the
+    offset returned by read_since() and later continue from it.
+
+    The journal is stored as segments called journal.<start offset>.  When
+    the newest segment reaches max_segment_size, a new one is started.
+    compact() replaces the older segments by a single segment which only
+    holds the latest record for each request that has not been archived.  A
+    consumer whose saved offset falls within a compacted segment will be
+    given the whole of that segment again; records describe the new state
+    of a request, so applying one more than once is harmless.
+    """
+
+    _prefix = 'journal.'
+    _lock_file = 'journal.lock'
+    _compacted_suffix = '.c'
+    _segment_matcher = re.compile(r'journal\.(?P<start>[0-9]+)(?P<compacted>\.c)?$').match
+
+    max_segment_size = 4 * 1024 * 1024
+
+    def __init__(self, directory):
+        self.directory = directory
+
+
+    @property
+    def _lock_path(self):
+        return os.path.join(self.directory, self._lock_file)
+
+
+    def exists(self):
+        return os.path.exists(self._lock_path)
+
+
+    def initialise(self):
+        if not os.path.exists(self._lock_path):
+            _create_shared_file(self._lock_path)
+        if not self._segments():
+            _create_shared_file(self._segment_path(0, False))
+
+
+    def _segment_path(self, start, compacted):
+        return os.path.join(self.directory,
+                            '{}{:016d}{}'.format(self._prefix, start,
+                                                 self._compacted_suffix
+                                                 if compacted else ''))
+
+
+    def _segments(self):
+        """
+        returns list of (start, compacted) for the segments, in order
+        """
+        segments = []
+        for filename in os.listdir(self.directory):
+            m = self._segment_matcher(filename)
+            if m:
+                segments.append((int(m.group('start')),
+                                 bool(m.group('compacted'))))
+        segments.sort()
+        return segments
+
+
+    def _locked(self):
+        return _LockedFile(self._lock_path)
+
+
+    def append(self, op, reqid, filename, **fields):
+        """
+        Appends a record.  Does nothing if the journal has not been
+        initialised for this workspace.
+        """
+        if not self.exists():
+            return
+        record = {'t': round(time.time(), 6), 'op': op, 'id': reqid, 'fn': filename}
+        record.update(fields)
+        line = (json.dumps(record, separators=(',', ':')) + '\n').encode()
+
+        with self._locked():
+            start, _ = self._segments()[-1]
+            path = self._segment_path(start, False)
+            size = os.path.getsize(path)
+            if size >= self.max_segment_size:
+                path = self._segment_path(start + size, False)
+                _create_shared_file(path)
+            fd = os.open(path, os.O_WRONLY | os.O_APPEND)
+            try:
+                os.write(fd, line)
+            finally:
+                os.close(fd)
+
+
+    def end_offset(self):
+        "offset immediately after the last record"
+        segments = self._segments()
+        if not segments:
+            return 0
+        start, compacted = segments[-1]
+        return start + os.path.getsize(self._segment_path(start, compacted))
+
+
+    def read_since(self, offset=0):
+        """
+        Returns (records, next_offset) where records is a list of the
+        records (as dictionaries) appended since the given offset, and
+        next_offset is the offset to pass on the next call.
+        """
+        with self._locked():
+            return self._read_since(offset)
+
+
+    def _read_since(self, offset):
+        segments = self._segments()
+        if not segments:
+            return [], offset
+        if offset < segments[0][0]:
+            raise JournalTruncated(offset)
+
+        records = []
+        next_offset = offset
+        for i, (start, compacted) in enumerate(segments):
+            if i + 1 < len(segments) and segments[i + 1][0] <= offset:
+                continue  # offset is beyond this segment
+            with open(self._segment_path(start, compacted), 'rb') as f:
+                if offset > start and not compacted:
+                    f.seek(offset - start)
+                    pos = offset
+                else:
+                    pos = start
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        break  # partially written record
+                    records.append(json.loads(line.decode()))
+                    pos += len(line)
+            next_offset = pos
+        return records, next_offset
+
+
+    def compact(self, keep_segments=1):
+        """
+        Replaces all but the newest keep_segments segments by a single
+        compacted segment, holding only the latest record for each
+        request which has not been archived.
+        """
+        with self._locked():
+            segments = self._segments()
+            old_segments = segments[:-max(keep_segments, 1)]
+            if len(old_segments) < 1 or (len(old_segments) == 1 and old_segments[0][1]):
+                return
+
+            latest = {}
+            for start, compacted in old_segments:
+                with open(self._segment_path(start, compacted), 'rb') as f:
+                    for line in f:
+                        record = json.loads(line.decode())
+                        latest[record['id']] = record
+
+            content = b''.join((json.dumps(record, separators=(',', ':')) + '\n').encode()
+                               for reqid, record in sorted(latest.items())
+                               if record['op'] != 'archive')
+
+            first_start = old_segments[0][0]
+            path = self._segment_path(first_start, True)
+            tmp_path = os.path.join(self.directory, '.tmp_' + os.path.basename(path))
+            with open(tmp_path, 'wb') as f:
+                f.write(content)
+            os.chmod(tmp_path, 0o666)
+            os.rename(tmp_path, path)
+            for start, compacted in old_segments:
+                if (start, compacted) != (first_start, True):
+                    os.remove(self._segment_path(start, compacted))
+
+
+class _LockedFile(object):
+    "context manager holding an exclusive lock on a file"
+
+    def __init__(self, path):
+        self.path = path
+
+    def __enter__(self):
+        self._f = open(self.path, 'a')
+        fcntl.lockf(self._f, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc_info):
+        fcntl.lockf(self._f, fcntl.LOCK_UN)
+        self._f.close()
+
+
+def _create_shared_file(path):
+    "create a file (if it does not exist) that all users can write to"
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT, 0o666)
+    os.close(fd)
+    try:
+        os.chmod(path, 0o666)
+    except PermissionError:
+        pass  # created by another user
@@ -0,0 +1,203 @@
+import sys
+import json
+import argparse
+import collections
+
+from gws_migration_tools import gws
+from gws_migration_tools.migration_request_lib import \
+    RequestsManager, RequestStatus, default_read_workers
+from gws_migration_tools.query import RequestQuery, parse_date
+from gws_migration_tools.fleet import find_workspaces
+from gws_migration_tools.util import percentile
+
+
+# statuses whose time-in-state is reported
+timed_statuses = [RequestStatus.NEW, RequestStatus.SUBMITTING,
+                  RequestStatus.SUBMITTED]
+
+# metrics in report order: time in each of timed_statuses, then creation
+# to completion for requests which succeeded
+metrics = [status.name for status in timed_statuses] + ['end_to_end']
+
+percentiles = (50, 90, 99)
+
+grouping_keys = ('type', 'user', 'workspace')
+
+
+def request_latencies(transitions):
+    """
+    Given the (status, time) transitions of a request, returns a list of
+    (metric, seconds): one item for each completed stay in a status in
+    timed_statuses (a request retried after a transient failure has more
+    than one stay in NEW and SUBMITTING, which are added together), and
+    end_to_end if the request is DONE.
+    """
+    times = collections.OrderedDict()
+    for (status, start), (_, end) in zip(transitions, transitions[1:]):
+        if status in timed_statuses:
+            times[status.name] = times.get(status.name, 0.) + end - start
+    latencies = list(times.items())
+    if transitions and transitions[-1][0] == RequestStatus.DONE:
+        latencies.append(('end_to_end', transitions[-1][1] - transitions[0][1]))
+    return latencies
+
+
+class LatencyReport(object):
+    """
+    Collects request latencies, grouped on a combination of request type,
+    user and workspace, and reports percentiles of each metric.
+    """
+
+    def __init__(self, group_by=('type',)):
+        self.group_by = group_by
+        self.samples = collections.defaultdict(list)  # (group, metric): [seconds]
+        self.num_requests = 0
+        self.num_untimed = 0
+
+
+    def add(self, gws_root, req, params):
+        self.num_requests += 1
+        transitions = req.get_transitions(params)
+        if not transitions:
+            self.num_untimed += 1
+            return
+        values = {'type': req.request_type, 'user': req.user,
+                  'workspace': gws_root}
+        group = tuple(values[key] for key in self.group_by)
+        for metric, seconds in request_latencies(transitions):
+            self.samples[(group, metric)].append(seconds)
+
+
+    def rows(self):
+        """
+        Iterable which yields a dictionary for each group and metric, with
+        the number of samples, percentiles and maximum (in seconds).
+        """
+        for group, metric in sorted(self.samples,
+                                    key=lambda item: (item[0],
+                                                      metrics.index(item[1]))):
+            values = sorted(self.samples[(group, metric)])
+            row = collections.OrderedDict(zip(self.group_by, group))
+            row['metric'] = metric
+            row['count'] = len(values)
+            for pct in percentiles:
+                row['p{}'.format(pct)] = percentile(values, pct)
+            row['max'] = values[-1]
+            yield row
+
+
+    def dump(self):
+        header = list(self.group_by) + ['metric', 'count'] + \
+            ['p{}'.format(pct) for pct in percentiles] + ['max']
+        rows = [[str(row[key]) if key in self.group_by + ('metric', 'count')
+                 else _format_seconds(row[key])
+                 for key in header]
+                for row in self.rows()]
+        widths = [max([len(key)] + [len(row[i]) for row in rows])
+                  for i, key in enumerate(header)]
+        for row in [header] + rows:
+            print('  '.join(value.ljust(width)
+                            for value, width in zip(row, widths)).rstrip())
+        print('')
+        print('{} requests, {} with no recorded transitions'.format(
+            self.num_requests, self.num_untimed))
+
+
+def _format_seconds(seconds):
+    if seconds < 120:
+        return '{:.1f}s'.format(seconds)
+    if seconds < 7200:
+        return '{:.1f}m'.format(seconds / 60.)
+    if seconds < 2 * 86400:
+        return '{:.1f}h'.format(seconds / 3600.)
+    return '{:.1f}d'.format(seconds / 86400.)
+
+
+def parse_args(arg_list = None):
+
+    parser = argparse.ArgumentParser(
+        arg_list,
+        description=('report percentiles of the time requests spend in each status, '
+                     'and of the time from creation to completion, including '
+                     'archived requests'))
+
+    parser.add_argument('gws',
+                        help='path to group workspace',
+                        nargs='*')
+
+    parser.add_argument('--fleet',
+                        help=('report on all group workspaces for which migrations '
+                              'have been initialised (see fleet-offline-requests)'),
+                        action='store_true')
+
+    parser.add_argument('-b', '--by',
+                        help=('comma-separated list of what to group the requests '
+                              'by, from {} (default: type)').format(
+                                  ', '.join(grouping_keys)),
+                        default='type')
+
+    parser.add_argument('-t', '--type',
+                        help='only include requests of this type (may be repeated)',
+                        choices=('migration', 'retrieval', 'deletion'),
+                        action='append')
+
+    parser.add_argument('--since',
+                        help='only include requests made on or after this date (YYYY-MM-DD)',
+                        type=parse_date)
+
+    parser.add_argument('--until',
+                        help='only include requests made on or before this date (YYYY-MM-DD)',
+                        type=parse_date)
+
+    parser.add_argument('-f', '--format',
+                        help='output format (default: text)',
+                        choices=('text', 'jsonl'),
+                        default='text')
+
+    parser.add_argument('-j', '--jobs',
+                        help=('number of request files to read concurrently '
+                              '(default: {})').format(default_read_workers),
+                        type=int,
+                        default=default_read_workers)
+
+    args = parser.parse_args()
+
+    if not (args.gws or args.fleet):
+        parser.error('no group workspaces specified (give paths or use --fleet)')
+
+    args.by = tuple(key for key in args.by.split(',') if key)
+    for key in args.by:
+        if key not in grouping_keys:
+            parser.error('cannot group by {}'.format(key))
+
+    return args
+
+
+def main():
+
+    args = parse_args()
+
+    gws_roots = [gws.get_gws_root_from_path(path) for path in args.gws]
+    if args.fleet:
+        gws_roots.extend(gws_root for gws_root in find_workspaces()
+                         if gws_root not in gws_roots)
+
+    query = RequestQuery(request_types=args.type,
+                         since=args.since,
+                         until=args.until)
+    report = LatencyReport(group_by=args.by)
+
+    for gws_root in gws_roots:
+        reqs_mgr = RequestsManager(gws_root)
+        for req, params in reqs_mgr.select_with_content(query,
+                                                        max_workers=args.jobs,
+                                                        all_users=True,
+                                                        include_archived=True):
+            report.add(gws_root, req, params)
+
+    if args.format == 'jsonl':
+        for row in report.rows():
+            print(json.dumps(row))
+        sys.stdout.flush()
+    else:
+        report.dump()
@@ -0,0 +1,209 @@
+import os
+import time
+import socket
+import threading
+
+
+class LeaseManager(object):
+    """
+    Lets several handler processes, possibly on different hosts, share the
+    requests of one group workspace without acting on the same request.
+
+    Each worker announces itself with a heartbeat file in .mngr/workers.
+    Workers whose heartbeat is older than the lease time-to-live are
+    presumed dead.  The requests are divided between the live workers by
+    request id (see partition), and before acting on a request a worker
+    takes a lease on it, which is a file in .mngr/leases created
+    exclusively.  A lease which has not been renewed within the
+    time-to-live can be taken over by another worker.
+
+    Expiry is based on file modification times, so the clocks of the hosts
+    running workers should be roughly in step with the file server.
+    """
+
+    _leases_dir = 'leases'
+    _workers_dir = 'workers'
+
+    def __init__(self, reqs_mgr, worker_id=None, ttl=600):
+        self.reqs_mgr = reqs_mgr
+        self.worker_id = worker_id or default_worker_id()
+        self.ttl = ttl
+        self._held = set()
+        self._last_heartbeat = None
+        self._keep_alive = None  # (thread, stop event) while keeping alive
+        for path in (self._leases_path, self._workers_path):
+            if not os.path.isdir(path):
+                os.makedirs(path, exist_ok=True)
+
+
+    @property
+    def _leases_path(self):
+        return os.path.join(self.reqs_mgr.base_dir, self._leases_dir)
+
+
+    @property
+    def _workers_path(self):
+        return os.path.join(self.reqs_mgr.base_dir, self._workers_dir)
+
+
+    def _lease_path(self, reqid):
+        return os.path.join(self._leases_path, str(reqid))
+
+
+    def _is_expired(self, mtime, now=None):
+        return (now or time.time()) - mtime > self.ttl
+
+
+    def heartbeat(self):
+        """
+        Records that this worker is alive, and renews the leases that it
+        holds.  Should be called more often than the time-to-live.
+        """
+        path = os.path.join(self._workers_path, self.worker_id)
+        with open(path, 'w') as f:
+            f.write('{}\n'.format(os.getpid()))
+        for reqid in list(self._held):
+            try:
+                os.utime(self._lease_path(reqid))
+            except FileNotFoundError:
+                pass
+        self._last_heartbeat = time.time()
+
+
+    def maybe_heartbeat(self):
+        "calls heartbeat() if a third of the time-to-live has passed since the last one"
+        if (self._last_heartbeat is None
+            or time.time() - self._last_heartbeat > self.ttl / 3):
+            self.heartbeat()
+
+
+    def start_keep_alive(self):
+        """
+        Starts a background thread which calls heartbeat() every third of
+        the time-to-live until stop_keep_alive() is called, so that leases
+        are renewed during long work on one request (e.g. checksumming or
+        splitting a large directory), and another worker cannot take over
+        a request which is being submitted.
+        """
+        if self._keep_alive is not None:
+            return
+        stop = threading.Event()
+
+        def run():
+            while not stop.wait(self.ttl / 3):
+                try:
+                    self.heartbeat()
+                except OSError:
+                    pass  # try again next time
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        self._keep_alive = (thread, stop)
+
+
+    def stop_keep_alive(self):
+        if self._keep_alive is None:
+            return
+        thread, stop = self._keep_alive
+        stop.set()
+        thread.join()
+        self._keep_alive = None
+
+
+    def unregister(self):
+        "releases all leases and removes this worker's heartbeat"
+        self.stop_keep_alive()
+        for reqid in list(self._held):
+            self.release(reqid)
+        try:
+            os.remove(os.path.join(self._workers_path, self.worker_id))
+        except FileNotFoundError:
+            pass
+
+
+    def live_workers(self):
+        now = time.time()
+        workers = []
+        for entry in os.scandir(self._workers_path):
+            try:
+                mtime = entry.stat().st_mtime
+            except FileNotFoundError:
+                continue
+            if not self._is_expired(mtime, now):
+                workers.append(entry.name)
+        if self.worker_id not in workers:
+            workers.append(self.worker_id)
+        return sorted(workers)
+
+
+    def partition(self, reqs):
+        """
+        Returns the requests which are this worker's share, i.e. those
+        whose id modulo the number of live workers matches this worker's
+        position among them.
+        """
+        workers = self.live_workers()
+        rank = workers.index(self.worker_id)
+        return [req for req in reqs if req.reqid % len(workers) == rank]
+
+
+    def acquire(self, reqid):
+        """
+        Try to take the lease on a request.  Returns True if this worker
+        now holds it.
+        """
+        path = self._lease_path(reqid)
+        for _ in range(2):
+            try:
+                fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+            except FileExistsError:
+                if not self._break_expired(path):
+                    return False
+                continue
+            try:
+                os.write(fd, '{}\n'.format(self.worker_id).encode())
+            finally:
+                os.close(fd)
+            self._held.add(reqid)
+            return True
+        return False
+
+
+    def _break_expired(self, path):
+        """
+        Remove a lease if it has expired.  The lease is first renamed to a
+        name unique to this worker, so that if two workers try to break it
+        at once, only one succeeds.  If the renamed lease turns out to be a
+        fresh one (taken by another worker in the meantime) it is put back.
+        Returns True if the lease was removed.
+        """
+        try:
+            if not self._is_expired(os.stat(path).st_mtime):
+                return False
+            stale_path = '{}.stale.{}'.format(path, self.worker_id)
+            os.rename(path, stale_path)
+        except FileNotFoundError:
+            return True  # released in the meantime
+
+        if not self._is_expired(os.stat(stale_path).st_mtime):
+            try:
+                os.link(stale_path, path)
+            except FileExistsError:
+                pass
+            os.remove(stale_path)
+            return False
+
+        os.remove(stale_path)
+        return True
+
+
+    def release(self, reqid):
+        self._held.discard(reqid)
+        try:
+            os.remove(self._lease_path(reqid))
+        except FileNotFoundError:
+            pass
+
+
+def default_worker_id():
+    return '{}-{}'.format(socket.gethostname(), os.getpid())
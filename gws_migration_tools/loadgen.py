@@ -0,0 +1,193 @@
+import os
+import sys
+import time
+import argparse
+import tempfile
+import subprocess
+from multiprocessing import Pool
+
+from gws_migration_tools.migration_request_lib import \
+    RequestsManager, finished_statuses, RequestStatus
+from gws_migration_tools.util import percentile
+from gws_migration_tools.mock_jdma import start_server, add_server_arguments
+
+
+request_types = ('migration', 'retrieval', 'deletion')
+
+
+def parse_args(arg_list = None):
+
+    parser = argparse.ArgumentParser(
+        arg_list,
+        description=('measure end-to-end request throughput and latency, by '
+                     'creating requests from several processes and running '
+                     'handle-offline-requests against a mock JDMA'))
+
+    parser.add_argument('-w', '--workspace',
+                        help=('directory to use as the group workspace '
+                              '(default: a new directory under /tmp)'))
+
+    parser.add_argument('-n', '--processes',
+                        help='number of processes creating requests (default: 4)',
+                        type=int, default=4)
+
+    parser.add_argument('-r', '--requests-per-process',
+                        help='number of requests each process creates (default: 25)',
+                        type=int, default=25)
+
+    parser.add_argument('-t', '--types',
+                        help=('comma-separated request types, run as successive '
+                              'phases on the same directories (default: migration)'),
+                        default='migration')
+
+    parser.add_argument('-i', '--cycle-interval',
+                        help='seconds between handler runs (default: 1)',
+                        type=float, default=1.0)
+
+    parser.add_argument('--timeout',
+                        help='give up on a phase after this many seconds (default: 600)',
+                        type=float, default=600.)
+
+    parser.add_argument('--handler-args',
+                        help='extra arguments for handle-offline-requests',
+                        default='')
+
+    parser.add_argument('--jdma-url',
+                        help='use this JDMA (or mock JDMA) instead of starting a mock one')
+
+    add_server_arguments(parser)
+
+    args = parser.parse_args()
+
+    args.types = args.types.split(',')
+    for request_type in args.types:
+        if request_type not in request_types:
+            parser.error('unknown request type {}'.format(request_type))
+
+    return args
+
+
+def _create_requests(task):
+    """
+    Creates requests of one type in one process.  Returns a list of
+    (reqid, creation time).
+    """
+    gws_root, request_type, worker_index, num_requests = task
+    mgr = RequestsManager(gws_root)
+    created = []
+    for i in range(num_requests):
+        path = os.path.join(gws_root, 'data', 'p{}_{}'.format(worker_index, i))
+        if request_type == 'migration':
+            os.makedirs(path, exist_ok=True)
+            with open(os.path.join(path, 'file'), 'w') as f:
+                f.write('{}\n'.format(path))
+            req = mgr.create_migration_request({'path': path})
+        elif request_type == 'retrieval':
+            req = mgr.create_retrieval_request({'orig_path': path,
+                                                'new_path': path + '_retrieved'})
+        else:
+            req = mgr.create_deletion_request({'orig_path': path})
+        created.append((req.reqid, time.time()))
+    return created
+
+
+class PhaseResult(object):
+
+    def __init__(self, request_type, num_requests):
+        self.request_type = request_type
+        self.num_requests = num_requests
+        self.create_time = None
+        self.wall_time = None
+        self.cycles = []  # duration of each handler run
+        self.latencies = []  # creation to observed completion, per request
+        self.num_failed = 0
+
+
+    def report(self):
+        completed = len(self.latencies)
+        latencies = sorted(self.latencies)
+        cycles = sorted(self.cycles)
+        print('phase: {} ({} requests)'.format(self.request_type, self.num_requests))
+        print(' created in {:.2f}s ({:.1f} requests/s)'.format(
+            self.create_time, self.num_requests / max(self.create_time, 1e-9)))
+        print(' finished: {} ({} failed), not finished: {}'.format(
+            completed, self.num_failed, self.num_requests - completed))
+        print(' wall time {:.2f}s, throughput {:.2f} requests/s'.format(
+            self.wall_time, completed / max(self.wall_time, 1e-9)))
+        print(' handler runs: {}, duration p50={} max={}'.format(
+            len(cycles), _fmt(percentile(cycles, 50)), _fmt(cycles[-1] if cycles else None)))
+        print(' latency p50={} p90={} p99={} max={}'.format(
+            *[_fmt(percentile(latencies, pct)) for pct in (50, 90, 99, 100)]))
+
+
+def _fmt(seconds):
+    return '-' if seconds is None else '{:.2f}s'.format(seconds)
+
+
+def run_phase(gws_root, request_type, args, env):
+    result = PhaseResult(request_type, args.processes * args.requests_per_process)
+    mgr = RequestsManager(gws_root)
+
+    start = time.time()
+    with Pool(args.processes) as pool:
+        tasks = [(gws_root, request_type, i, args.requests_per_process)
+                 for i in range(args.processes)]
+        created = dict(item for items in pool.map(_create_requests, tasks)
+                       for item in items)
+    result.create_time = time.time() - start
+
+    command = ([sys.executable, '-c',
+                'from gws_migration_tools.handle_requests import main; main()']
+               + args.handler_args.split() + [gws_root])
+
+    while created and time.time() - start < args.timeout:
+        cycle_start = time.time()
+        subprocess.run(command, env=env, stdout=subprocess.DEVNULL, check=True)
+        now = time.time()
+        result.cycles.append(now - cycle_start)
+
+        for status, filename, _ in mgr.scan_filenames(finished_statuses):
+            _, _, reqid, _ = mgr.parse_filename(filename)
+            if reqid in created:
+                result.latencies.append(now - created.pop(reqid))
+                if status == RequestStatus.FAILED:
+                    result.num_failed += 1
+
+        if created:
+            time.sleep(max(0, args.cycle_interval - (time.time() - cycle_start)))
+
+    result.wall_time = time.time() - start
+    return result
+
+
+def main():
+
+    args = parse_args()
+
+    gws_root = args.workspace or tempfile.mkdtemp(prefix='loadgen_', dir='/tmp')
+    os.makedirs(gws_root, exist_ok=True)
+    RequestsManager(gws_root).initialise()
+
+    env = dict(os.environ)
+    env['_USE_TEST_GWS'] = '1'  # lets handle-offline-requests accept /tmp paths
+
+    server = None
+    if args.jdma_url:
+        env['GWS_MIGRATION_JDMA_URL'] = args.jdma_url
+    else:
+        server = start_server(stage_time=args.stage_time,
+                              failure_rate=args.failure_rate,
+                              latency=args.latency,
+                              latency_jitter=args.latency_jitter,
+                              error_rate=args.error_rate)
+        env['GWS_MIGRATION_JDMA_URL'] = server.url
+
+    print('workspace: {}'.format(gws_root))
+    print('JDMA: {}'.format(env['GWS_MIGRATION_JDMA_URL']))
+
+    try:
+        for request_type in args.types:
+            run_phase(gws_root, request_type, args, env).report()
+    finally:
+        if server:
+            server.shutdown()
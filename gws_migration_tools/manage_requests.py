@@ -0,0 +1,57 @@
+import sys
+import argparse
+
+from gws_migration_tools import gws
+from gws_migration_tools.bulk import apply_bulk, bulk_operations
+from gws_migration_tools.migration_request_lib import RequestsManager
+from gws_migration_tools.request_cli import \
+    add_selection_arguments, selection_query
+
+
+def parse_args(arg_list = None):
+
+    parser = argparse.ArgumentParser(
+        arg_list,
+        description=('change the status of many requests at once, for all users '
+                     '(to be run by GWS manager): withdraw NEW requests, fail '
+                     'unfinished requests, or requeue FAILED requests as NEW'))
+
+    parser.add_argument('operation',
+                        choices=sorted(bulk_operations))
+
+    parser.add_argument('gws',
+                        help='path to group workspace')
+
+    add_selection_arguments(parser)
+
+    parser.add_argument('-m', '--message',
+                        help='message to record in requests which are failed')
+
+    return parser.parse_args()
+
+
+def main():
+
+    args = parse_args()
+
+    try:
+        query = selection_query(args)
+    except ValueError as exc:
+        print(exc)
+        sys.exit(1)
+
+    gws_root = gws.get_gws_root_from_path(args.gws)
+
+    if not gws.am_gws_manager(gws_root):
+        print("Exiting")
+        sys.exit(1)
+
+    reqs_mgr = RequestsManager(gws_root)
+    result = apply_bulk(reqs_mgr, args.operation, query,
+                        all_users=True,
+                        message=args.message,
+                        dry_run=args.dry_run,
+                        verbose=args.verbose)
+    result.dump()
+    if result.errors:
+        sys.exit(1)
@@ -1,11 +1,29 @@
 import os
 from enum import Enum
 import datetime
+import time
+import random
 import re
 import json
+import fcntl
+import socket
+import hashlib
+import threading
+import contextlib
+import collections
+from concurrent.futures import ThreadPoolExecutor
 
 from gws_migration_tools.util import get_user_login_name, ensure_parent_dir_exists
 from gws_migration_tools.gws import get_mgr_directory
+from gws_migration_tools.journal import Journal
+from gws_migration_tools.writer import \
+    RequestWriter, remove_stale_tmp_files, _is_tmp_path, _make_tmp_path
+from gws_migration_tools.sizing import \
+    measure_tree, split_tree, dir_attributes, restore_dir_attributes, format_bytes
+from gws_migration_tools.checksums import Manifest
+from gws_migration_tools.preflight import InsufficientSpace, check_space
+from gws_migration_tools.storage_policy import StoragePolicy
+from gws_migration_tools.request_table import RequestTable
 
 #import gws_migration_tools.dummy_jdma_iface as jdma_iface   # dummy code only
 
@@ -37,61 +55,93 @@ class BadFileContent(Exception):
     pass
 
 
+class SubmissionDeferred(Exception):
+    """
+    Raised by claim_and_submit when submission failed for a reason which
+    is expected to be transient, and the request has been put back to
+    status NEW to be retried later.  The transient attribute is False
+    if the reason was not a JDMA failure (e.g. lack of space).
+    """
+    def __init__(self, message, transient=True):
+        Exception.__init__(self, message)
+        self.transient = transient
+
+
 class NotInitialised(Exception):
     def __str__(self):
         return ('Migrations have not yet been initialised for this group '
                 'workspace by the GWS manager')
 
 
-def _make_tmp_path(path):
-    dirname = os.path.dirname(path)
-    filename = os.path.basename(path)
-    return os.path.join(dirname, '.tmp_' + filename)
+def _timestamp():
+    "time of a status transition, to microsecond resolution"
+    return round(time.time(), 6)
+
+
+class RetryPolicy(object):
+    """
+    How often, and after what delays, the submission of a request is
+    retried after a transient failure.  The delay grows exponentially with
+    the number of attempts, up to max_delay, and a random part ("jitter")
+    is added so that requests which failed together are not all retried
+    together.
+    """
 
+    def __init__(self, max_retries=8, base_delay=300, max_delay=6 * 3600):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
 
-def _is_tmp_path(path):
-    # path may be the full path or just the filename
-    return os.path.basename(path).startswith('.tmp_')
+
+    def get_delay(self, attempt):
+        "seconds to wait before the given retry attempt (starting at 1)"
+        delay = min(self.base_delay * 2 ** (attempt - 1), self.max_delay)
+        return delay / 2 + random.uniform(0, delay / 2)
 
 
 class RequestBase(object):
 
-    def __init__(self, filename, requests_mgr, status, reqid=None, is_archived=False):
+    # requests are created in large numbers when scanning, so avoid a
+    # per-instance __dict__
+    __slots__ = ('filename', 'requests_mgr', 'status', 'is_archived',
+                 'reqid', 'user', 'date')
+
+    retry_policy = RetryPolicy()
+
+    # while a request is being submitted, its file is touched this often (in
+    # seconds), so that reconciliation can tell that the claim is alive
+    claim_heartbeat = 60
+
+    def __init__(self, filename, requests_mgr, status, reqid=None, is_archived=False,
+                 parsed=None):
+        """
+        parsed is the result of requests_mgr.parse_filename(filename) if
+        the caller already has it, to avoid parsing the filename again.
+        """
         self.filename = filename
         self.requests_mgr = requests_mgr
         self.status = status
         self.is_archived = is_archived
-        if reqid == None:
-            _, _, reqid, _ = self.requests_mgr.parse_filename(self.filename)
-            self.reqid = reqid
-        else:
-            self.reqid = reqid
+        if parsed == None:
+            parsed = self.requests_mgr.parse_filename(self.filename)
+        self.user, _, parsed_reqid, self.date = parsed
+        self.reqid = parsed_reqid if reqid == None else reqid
 
 
     def write(self, params):
         params = params.copy()
         params['request_type'] = self.request_type
         content = self._encode(params)
-        path = self._path
-        tmp_path = _make_tmp_path(path)
-
-        try:
-            with open(tmp_path, "w") as f:
-                f.write(content)
-            os.chmod(tmp_path, 0o644)
-            os.rename(tmp_path, path)
-
-        except OSError as exc:
-            try:
-                os.remove(tmp_path)
-            except:
-                pass
-            raise exc
+        self.requests_mgr.op_counts['write'] += 1
+        self.requests_mgr.writer.write(self._path, content)
 
 
     def read(self):
-        with open(self._path) as f:
-            content = f.read()
+        self.requests_mgr.op_counts['read'] += 1
+        content = self.requests_mgr.writer.pending_content(self._path)
+        if content == None:
+            with open(self._path) as f:
+                content = f.read()
         try:
             return self._decode(content)
         except BadFileContent:
@@ -112,28 +162,119 @@ class RequestBase(object):
         self.set_status(RequestStatus.FAILED)
 
 
+    def requeue(self):
+        """
+        Put a FAILED request back to status NEW, to be submitted again.
+        The message, any record of earlier retries and the IDs of any
+        JDMA requests made for separate batches are removed.  A migration
+        split into parts keeps its parts, and submitting it again carries
+        on from those whose batches are already on storage.
+        """
+        if self.status != RequestStatus.FAILED:
+            raise ValueError("only failed requests can be requeued : {}"
+                             .format(self))
+        params = self.read()
+        removed = [key for key in ('message', 'retry_count', 'retry_after',
+                                   'space_wait_count', 'external_ids')
+                   if key in params]
+        for key in removed:
+            del params[key]
+        self.write(params)
+        for key in removed:
+            self.requests_mgr.journal_param(self.filename, self.status, key)
+        self.set_status(RequestStatus.NEW)
+
+
     def set_param(self, key, value):
+        self.set_params({key: value})
+
+
+    def set_params(self, updates):
         params = self.read()
-        params[key] = value
+        params.update(updates)
         self.write(params)
+        for key in sorted(updates):
+            self.requests_mgr.journal_param(self.filename, self.status, key)
         
 
-    def dump(self):
+    def dump(self, content=None):
         print(self)
-        content = self.read()
+        if content is None:
+            content = self.read()
         self._dump(content)
         message = content.get('message')
         if message:
             print(message)
+        retry_after = content.get('retry_after')
+        if retry_after != None and self.status == RequestStatus.NEW:
+            print(" submission will be retried after {} (attempt {})".format(
+                time.ctime(retry_after), content.get('retry_count', 0) + 1))
         print("")
 
 
-    def set_status(self, new_status):
+    def to_record(self, params=None):
+        """
+        Returns a flat dictionary describing the request, as used by the
+        machine-readable listing formats.
+        """
+        if params is None:
+            params = self.read()
+        return {
+            'id': self.reqid,
+            'user': self.user,
+            'request_type': self.request_type,
+            'date': self.date.isoformat(),
+            'status': self.status.name,
+            'archived': self.is_archived,
+            'path': params.get('path'),
+            'orig_path': params.get('orig_path'),
+            'new_path': params.get('new_path'),
+            'external_id': (params.get('external_id') if params.get('external_ids') == None
+                            else ','.join(map(str, params['external_ids']))),
+            'message': params.get('message'),
+            'file_count': params.get('file_count'),
+            'total_bytes': params.get('total_bytes'),
+            'storage': params.get('storage'),
+            }
+
+
+    def set_status(self, new_status, when=None):
+        """
+        Moves the request to a new status, recording the time of the
+        transition (by default, now) in the request.
+        """
         if self.is_archived:
             raise ValueError("status cannot be changed for archived request")
         self.requests_mgr.move_request_file(
             self.filename, self.status, new_status)
         self.status = new_status
+        self._record_transition(new_status, when)
+
+
+    def _record_transition(self, status, when=None):
+        """
+        Appends [status name, time] to the 'transitions' parameter.  This
+        is done after the file has been moved, so that if another process
+        changes the status at the same time, the one whose move failed
+        does not write to the file.
+        """
+        params = self.read()
+        params['transitions'] = params.get('transitions', []) + [
+            [status.name, _timestamp() if when == None else when]]
+        self.write(params)
+        self.requests_mgr.journal_param(self.filename, self.status, 'transitions')
+
+
+    def get_transitions(self, params=None):
+        """
+        Returns a list of (status, time) for the status changes recorded in
+        the request, oldest first.  Requests made before transitions were
+        recorded give an empty list.
+        """
+        if params is None:
+            params = self.read()
+        return [(RequestStatus[name], when)
+                for name, when in params.get('transitions', [])]
 
 
     def archive(self):
@@ -150,12 +291,6 @@ class RequestBase(object):
                                                        self.status,
                                                        self.is_archived)
 
-    @property
-    def date(self):
-        _, _, _, date = self.requests_mgr.parse_filename(self.filename)
-        return date
-
-
     
     def _encode(self, params):
         self._check_params(params)
@@ -176,12 +311,10 @@ class RequestBase(object):
         
     
     def __str__(self):
-        user, request_type, reqid, date = \
-            self.requests_mgr.parse_filename(self.filename)
         return '<{}{} request: user={} id={} date={} status={}>'.format(
             ('archived ' if self.is_archived else ''),
-            request_type,
-            user, reqid, date, 
+            self.request_type,
+            self.user, self.reqid, self.date, 
             self.status.name)
 
 
@@ -207,16 +340,96 @@ class RequestBase(object):
             return int(s)
 
 
+    def is_due(self, now=None):
+        """
+        For a NEW request, returns whether it can be submitted now, i.e.
+        it is not waiting to be retried after a transient failure.
+        """
+        retry_after = self.read().get('retry_after')
+        if retry_after == None:
+            return True
+        return retry_after <= (now or time.time())
+
+
     def claim_and_submit(self):
         self.set_status(RequestStatus.SUBMITTING)
+        # who is submitting it, written out at once so that reconciliation
+        # in another handler can see it (see reconcile)
+        self.set_param('claimed_by', {'host': socket.gethostname(),
+                                      'pid': os.getpid()})
+        self.requests_mgr.writer.flush(self._path)
         try:
-            self.submit()            
-            self.set_status(RequestStatus.SUBMITTED)
+            with self._claim_heartbeat():
+                self.submit()
+            # time at which JDMA accepted the request
+            self.set_status(RequestStatus.SUBMITTED, when=_timestamp())
             return "submitted: {}".format(self)
         except Exception as exc:
+            transient = jdma_iface.is_transient_error(exc)
+            if ((transient or isinstance(exc, InsufficientSpace))
+                and self._defer_submission(exc)):
+                raise SubmissionDeferred(
+                    "{} (will retry after {})".format(
+                        exc, time.ctime(self.read()['retry_after'])),
+                    transient=transient)
             self.set_failed("request was not submitted because: {}".format(exc))
             raise exc
 
+
+    @contextlib.contextmanager
+    def _claim_heartbeat(self):
+        """
+        Within the with block, a background thread touches the request
+        file every claim_heartbeat seconds, so that its modification time
+        shows that the claim is alive however long the work before the
+        JDMA request is made (checksumming, measuring or splitting a large
+        directory) takes.
+        """
+        stop = threading.Event()
+
+        def run():
+            while not stop.wait(self.claim_heartbeat):
+                try:
+                    os.utime(self._path)
+                except OSError:
+                    pass  # e.g. just moved to another status
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+
+
+    def _defer_submission(self, exc):
+        """
+        After a transient failure, put the request back to status NEW with
+        a time before which it should not be retried.  Returns False
+        (leaving the request in SUBMITTING) if it has been retried too
+        many times already.  Waiting for room on the destination
+        (InsufficientSpace) is not a failure, so it is counted separately,
+        in space_wait_count, without a limit: the delay grows in the same
+        way, up to the maximum.
+        """
+        if isinstance(exc, InsufficientSpace):
+            key = 'space_wait_count'
+            message = "submission deferred because: {}"
+        else:
+            key = 'retry_count'
+            message = "submission failed temporarily because: {}"
+        attempt = self.read().get(key, 0) + 1
+        if key == 'retry_count' and attempt > self.retry_policy.max_retries:
+            return False
+        self.set_params({
+            key: attempt,
+            'retry_after': time.time() + self.retry_policy.get_delay(attempt),
+            'message': message.format(exc),
+            })
+        self.set_status(RequestStatus.NEW)
+        return True
+
     
     def monitor(self):
         status = self.check()  # True, False, or None
@@ -224,6 +437,10 @@ class RequestBase(object):
         message = status.get('message')
         self.set_message(message)
         if succeeded == True:
+            problem = self._completion_problem()
+            if problem:
+                self.set_failed(problem)
+                return "failed: {}".format(self)
             message = "succeeded: {}".format(self)
             self.set_status(RequestStatus.DONE)
         elif succeeded == False:
@@ -234,37 +451,257 @@ class RequestBase(object):
         return message
         
 
+    def _submit_each(self, items, submit_one):
+        """
+        Submits a request as several JDMA requests, one for each item
+        (e.g. each batch), recording their IDs in the external_ids
+        parameter as it goes.  If it is interrupted by an error, trying
+        again carries on from the first item not yet submitted.
+        """
+        ext_ids = list(self.read().get('external_ids') or [])
+        for item in items[len(ext_ids):]:
+            ext_ids.append(submit_one(item))
+            self.set_params({'external_ids': ext_ids})
+
+
+    def _planned_check_calls(self, params):
+        "JDMA calls made by checking the request once, by endpoint (see plan)"
+        return collections.Counter(get_request=len(params.get('external_ids') or [None]))
+
+
+    def _migrated_storage(self, params, batches):
+        """
+        Returns the storage backend holding the migrated data of a
+        retrieval or deletion, given the JDMA records of its batches: the
+        one recorded in the request, or else the one JDMA gives for the
+        batches, or if it does not give one, the one recorded by the
+        latest completed migration of the path (or the default backend,
+        for migrations made before backends were recorded).  It is then
+        recorded in the request so that any resubmission uses the same
+        one.
+        """
+        storage = params.get('storage')
+        if storage == None:
+            backends = set(batch.get('storage') for batch in batches)
+            if len(backends) == 1 and None not in backends:
+                storage = backends.pop()
+            else:
+                storage = (self.requests_mgr.migrated_storage(params['orig_path'])
+                           or jdma_iface.storage_type)
+            self.set_params({'storage': storage})
+        return storage
+
+
+    def _completion_problem(self):
+        """
+        Called when JDMA reports that the request succeeded, before it is
+        marked DONE.  Returns a message if the request should be failed
+        instead, or None.
+        """
+        return None
+
+
     def check(self):
         params = self.read()
         return jdma_iface.check(params)
 
 
+def _dump_external_ids(d):
+    ext_id = d.get('external_id')
+    if ext_id != None:
+        print(" external ID: {}".format(ext_id))
+    ext_ids = d.get('external_ids')
+    if ext_ids:
+        print(" external IDs: {}".format(','.join(map(str, ext_ids))))
+
+
 class MigrationRequest(RequestBase):
 
+    __slots__ = ()
+
     request_type = 'migration'
 
     _compulsory_params = ['path']
 
+    # if True, measure the directory (if not done already) before submitting
+    measure_before_submit = False
+
+    # if True, build a checksum manifest of the directory before submitting,
+    # using hash_workers processes (default: one per CPU)
+    checksum_before_submit = False
+    hash_workers = None
+
+    # if set, directories bigger than this many bytes are split into up to
+    # max_parts batches of similar size, submitted as separate JDMA jobs
+    split_bytes = None
+    max_parts = 64
+
 
     def _dump(self, d):
         print(" path to migrate: {}".format(d.get('path')))
-        ext_id = d.get('external_id')
-        if ext_id != None:
-            print(" external ID: {}".format(ext_id))
+        if d.get('total_bytes') != None:
+            print(" size: {} in {} files".format(format_bytes(d['total_bytes']),
+                                                  d.get('file_count')))
+        if d.get('parts') and len(d['parts']) > 1:
+            print(" split into {} batches".format(len(d['parts'])))
+        if d.get('access') != None:
+            print(" expected to be retrieved: {}ly".format(d['access']))
+        if d.get('storage') != None:
+            print(" storage: {}".format(d['storage']))
+        _dump_external_ids(d)
+
+
+    def measure(self):
+        """
+        Walk the directory to be migrated, and record its file count and
+        total size in the request.  Raises UnreadableTree (recording
+        nothing) if parts of it could not be read, as they could not be
+        migrated either.
+        """
+        size = measure_tree(self.read()['path'])
+        size.check()
+        self.set_params(size.to_params())
+        return size
+
+
+    def build_manifest(self, max_workers=None):
+        """
+        Checksum every file in the directory to be migrated, store the
+        manifest under .mngr/manifests and record its name in the request
+        (along with the size, if not already known).
+        """
+        params = self.read()
+        manifest = Manifest.build(params['path'], max_workers=max_workers)
+        manifest_name = self.requests_mgr.save_manifest(manifest, self.filename)
+        updates = {'manifest': manifest_name}
+        if params.get('total_bytes') == None:
+            updates.update({'file_count': len(manifest.files),
+                            'total_bytes': manifest.total_bytes})
+        self.set_params(updates)
+        return manifest
+
+
+    def choose_storage(self, params):
+        """
+        Chooses the storage backend for the migration by the policy of the
+        workspace (see storage_policy), measuring the directory first if
+        the policy needs its size, and records it in the request.  Returns
+        the backend.
+        """
+        policy = self.requests_mgr.storage_policy
+        if policy.needs_size and params.get('total_bytes') == None:
+            params = dict(params, **self.measure().to_params())
+        storage = policy.choose(
+            params.get('total_bytes'),
+            access=params.get('access'),
+            count_retrievals=lambda: self.requests_mgr.count_retrievals(params['path']))
+        self.set_params({'storage': storage})
+        return storage
 
 
     def submit(self):
         params = self.read()
-        external_id = jdma_iface.submit_migrate(params)
-        self.set_external_id(external_id)        
+        if self.checksum_before_submit and params.get('manifest') == None:
+            self.build_manifest(max_workers=self.hash_workers)
+            params = self.read()
+        if ((self.measure_before_submit or self.split_bytes)
+            and params.get('total_bytes') == None):
+            self.measure()
+            params = self.read()
+        # chosen once, so that a resubmission goes to the same backend
+        if params.get('storage') == None:
+            self.choose_storage(params)
+            params = self.read()
+
+        parts = params.get('parts')
+        if (parts == None and self.split_bytes
+            and params['total_bytes'] > self.split_bytes):
+            path = os.path.normpath(params['path'])
+            parts, split_dirs = split_tree(path, self.split_bytes,
+                                           max_parts=self.max_parts)
+            # no batch holds these directories themselves, so their
+            # attributes are restored from the request after retrieval
+            self.set_params({'parts': parts,
+                             'split_dirs': dir_attributes(split_dirs, path)})
+
+        if parts == None or len(parts) == 1:
+            external_id = jdma_iface.submit_migrate(params)
+            self.set_external_id(external_id)        
+        else:
+            self._submit_parts(params, parts)
+
+
+    def _submit_parts(self, params, parts):
+        """
+        Submits a migration split into parts, one JDMA job per part.  When
+        starting from the first part (e.g. after a requeue), parts whose
+        batches are already on storage are not migrated again: the JDMA
+        request which put each one there is recorded instead.
+        """
+        stored = {}
+        if not params.get('external_ids'):
+            stored = jdma_iface.get_stored_parts(os.path.normpath(params['path']),
+                                                 len(parts))
+
+        def submit_one(item):
+            part, filelist = item
+            if part in stored:
+                return stored[part]
+            return jdma_iface.submit_migrate(params,
+                                             filelist=filelist,
+                                             part=part,
+                                             num_parts=len(parts),
+                                             check_existing=not stored)
+
+        self._submit_each(list(enumerate(parts, 1)), submit_one)
+
+
+    def _planned_submit_calls(self, params):
+        num_parts = 1
+        if params.get('parts') != None:
+            num_parts = len(params['parts'])
+        elif (self.split_bytes and params.get('total_bytes') != None
+              and params['total_bytes'] > self.split_bytes):
+            num_parts = min(-(-params['total_bytes'] // self.split_bytes),
+                            self.max_parts)
+        num_submitted = len(params.get('external_ids') or [])
+        # check for an existing batch (by label, then by parts) before the first
+        calls = collections.Counter(get_batch=0 if num_submitted else 2,
+                                    upload_files=num_parts - num_submitted)
+        if params.get('parts') != None and num_parts > 1 and not num_submitted:
+            calls['get_batch'] += 1  # parts already on storage
+        return calls
+
+
+    def _jdma_jobs(self, params, catalogue):
+        path = os.path.normpath(params['path'])
+        parts = params.get('parts')
+        if parts == None or len(parts) == 1:
+            labels = [path]
+        else:
+            labels = [jdma_iface.part_label(path, part, len(parts))
+                      for part in range(1, len(parts) + 1)]
+        return [('PUT', catalogue.batch_ids(label)) for label in labels]
 
 
 class RetrievalRequest(RequestBase):
 
+    __slots__ = ()
+
     request_type = 'retrieval'
 
     _compulsory_params = ['orig_path']
 
+    # if True, check retrieved data against the migration's checksum
+    # manifest (if it has one) before marking the request DONE
+    verify_after_retrieval = False
+    hash_workers = None
+
+    # if True, defer submission while the destination filesystem does not
+    # have room for the expected size (when known) on top of the other
+    # retrievals in progress
+    check_space_before_submit = True
+
 
     def _dump(self, d):
         print(" original path: {}".format(d.get('orig_path')))
@@ -273,34 +710,198 @@ class RetrievalRequest(RequestBase):
             print(" restore to original location")
         else:
             print(" restore to {}".format(new_path))
-        ext_id = d.get('external_id')
-        if ext_id != None:
-            print(" external ID: {}".format(ext_id))
+        if d.get('expected_bytes') != None:
+            print(" expected size: {}".format(format_bytes(d['expected_bytes'])))
+        if d.get('storage') != None:
+            print(" storage: {}".format(d['storage']))
+        if d.get('verified') != None:
+            print(" checksums {} ({} files checked)".format(
+                'verified' if d['verified'] else 'did not match',
+                d.get('verify_checked')))
+        _dump_external_ids(d)
 
 
     def submit(self):
         params = self.read()
-        external_id = jdma_iface.submit_retrieve(params)
-        self.set_external_id(external_id)
+        orig_path = os.path.normpath(params['orig_path'])
+        new_path = os.path.normpath(params.get('new_path') or orig_path)
+        if self.check_space_before_submit:
+            self.check_space(params)
+        batches = jdma_iface.get_batches_for_path(orig_path)
+        storage = self._migrated_storage(params, batches)
+        batch_ids = [batch['migration_id'] for batch in batches]
+        if len(batch_ids) == 1:
+            external_id = jdma_iface.retrieve_batch(batch_ids[0], new_path,
+                                                    storage=storage)
+            self.set_external_id(external_id)
+        else:
+            self._submit_each(batch_ids,
+                              lambda batch_id: jdma_iface.retrieve_batch(batch_id,
+                                                                         new_path,
+                                                                         storage=storage))
+
+
+    def _planned_submit_calls(self, params):
+        calls = collections.Counter(get_batch=1, download_files=1)
+        if self.check_space_before_submit and params.get('expected_bytes') == None:
+            calls['get_batch'] += 1  # size, if no migration recorded it
+        return calls
+
+
+    def _jdma_jobs(self, params, catalogue):
+        return [('GET', batch_ids) for batch_ids in
+                catalogue.batch_ids_for_path(os.path.normpath(params['orig_path']))]
+
+
+    def check_space(self, params):
+        """
+        Raises InsufficientSpace if the destination does not have room for
+        the expected size of the retrieval, after setting aside the
+        expected sizes of the other retrievals already submitted (which
+        may be partly written, so this errs on the safe side).  The
+        expected size is recorded in the request when first worked out.
+        Does nothing if the size cannot be found.
+        """
+        size = params.get('expected_bytes')
+        if size == None:
+            size = self.requests_mgr.expected_retrieval_bytes(params['orig_path'])
+            if size == None:
+                return
+            self.set_params({'expected_bytes': size})
+        reserved = self.requests_mgr.reserved_retrieval_bytes(exclude=self.filename)
+        check_space(params.get('new_path') or params['orig_path'], size,
+                    reserved=reserved)
+        self.requests_mgr.reserve_retrieval_bytes(self.filename, size)
+
+
+    def find_manifest(self, params=None):
+        """
+        Returns the checksum manifest made when the original path was
+        migrated (by the latest completed migration which has one), or
+        None.
+        """
+        if params is None:
+            params = self.read()
+        manifest_name = self.requests_mgr.find_migration_manifest(params['orig_path'])
+        if manifest_name == None:
+            return None
+        return self.requests_mgr.load_manifest(manifest_name)
+
+
+    def verify(self, max_workers=None):
+        """
+        Checks the retrieved tree against the checksum manifest of the
+        migration, recording the outcome in the request.  Returns a
+        VerificationResult, or None if there is no manifest.
+        """
+        params = self.read()
+        manifest = self.find_manifest(params)
+        if manifest == None:
+            return None
+        result = manifest.verify(params.get('new_path') or params['orig_path'],
+                                 max_workers=max_workers)
+        self.set_params(result.to_params())
+        return result
+
+
+    def restore_split_dirs(self, params=None):
+        """
+        Gives the directories which the migration of the original path
+        divided between batches (see split_tree) the mode and modification
+        time they had when it was migrated, as no batch held them
+        themselves.  Returns the number of directories set.
+        """
+        if params is None:
+            params = self.read()
+        migrations = self.requests_mgr.find_completed_migrations(params['orig_path'])
+        if not migrations or not migrations[-1][1].get('split_dirs'):
+            return 0
+        return restore_dir_attributes(migrations[-1][1]['split_dirs'],
+                                      params.get('new_path') or params['orig_path'])
+
+
+    def _completion_problem(self):
+        self.restore_split_dirs()
+        if not self.verify_after_retrieval:
+            return None
+        try:
+            result = self.verify(max_workers=self.hash_workers)
+        except (OSError, ValueError) as err:
+            # e.g. the retrieved data is missing or unreadable: fail rather
+            # than check JDMA and try again in every cycle
+            return "retrieved data could not be checked against checksums: {}".format(err)
+        if result == None or result.ok:
+            return None
+        return "retrieved data does not match checksums: {}".format(result)
 
 
 class DeletionRequest(RequestBase):
 
+    __slots__ = ()
+
     request_type = 'deletion'
 
     _compulsory_params = ['orig_path']
 
     def _dump(self, d):
         print(" original path: {}".format(d.get('orig_path')))
-        ext_id = d.get('external_id')
-        if ext_id != None:
-            print(" external ID: {}".format(ext_id))
+        if d.get('storage') != None:
+            print(" storage: {}".format(d['storage']))
+        _dump_external_ids(d)
 
 
     def submit(self):
         params = self.read()
-        external_id = jdma_iface.submit_delete(params)
-        self.set_external_id(external_id)
+        batches = jdma_iface.get_batches_for_path(
+            os.path.normpath(params['orig_path']))
+        storage = self._migrated_storage(params, batches)
+        batch_ids = [batch['migration_id'] for batch in batches]
+        if len(batch_ids) == 1:
+            external_id = jdma_iface.delete_batch(batch_ids[0], storage=storage)
+            self.set_external_id(external_id)
+        else:
+            self._submit_each(batch_ids,
+                              lambda batch_id: jdma_iface.delete_batch(batch_id,
+                                                                       storage=storage))
+
+
+    def _planned_submit_calls(self, params):
+        return collections.Counter(get_batch=1, delete_batch=1)
+
+
+    def _jdma_jobs(self, params, catalogue):
+        return [('DELETE', batch_ids) for batch_ids in
+                catalogue.batch_ids_for_path(os.path.normpath(params['orig_path']))]
+
+
+# default number of threads used to read request files concurrently
+default_read_workers = 8
+
+
+def read_requests(reqs, max_workers=default_read_workers):
+    """
+    Iterable which yields (request, params) for each of the supplied
+    requests, in the order supplied.  The files are read by a pool of
+    threads, so that on high-latency filesystems the per-file open/read
+    times overlap rather than add up.  At most a fixed number of reads are
+    queued ahead of the consumer.
+    """
+    if max_workers <= 1:
+        for req in reqs:
+            yield req, req.read()
+        return
+
+    max_pending = 4 * max_workers
+    pending = collections.deque()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for req in reqs:
+            pending.append((req, executor.submit(req.read)))
+            if len(pending) >= max_pending:
+                req, future = pending.popleft()
+                yield req, future.result()
+        while pending:
+            req, future = pending.popleft()
+            yield req, future.result()
 
 
 _request_class_map = {
@@ -328,9 +929,67 @@ class RequestsManager(object):
 
     _last_id_file = '.last_id'
 
+    _manifests_dir = 'manifests'
+    _manifest_suffix = '.manifest'
+    # under the manifests directory: for each migrated path, the names of
+    # its manifests (see find_migration_manifest)
+    _manifest_index_dir = 'index'
+
+
+    # durability level for request files (see writer.durability_levels)
+    default_durability = 'none'
+
 
     def __init__(self, gws_root):
         self.gws_root = gws_root
+        self.journal = Journal(self.base_dir)
+        self.writer = RequestWriter(self.default_durability)
+        # numbers of request file operations made (see plan.CycleStats)
+        self.op_counts = collections.Counter()
+        self._archive_dirs = set()  # archive subdirectories known to exist
+        self._storage_policy = None
+        # read when first needed in a cycle (see find_completed_migrations
+        # and reserved_retrieval_bytes)
+        self._completed_migrations = None
+        self._retrieval_counts = None
+        self._reserved_bytes = None
+
+
+    @property
+    def storage_policy(self):
+        "the StoragePolicy of the workspace (read when first needed)"
+        if self._storage_policy == None:
+            self._storage_policy = StoragePolicy.load(self)
+        return self._storage_policy
+
+
+    @contextlib.contextmanager
+    def group_commit(self, max_pending=None):
+        """
+        Context manager within which updates to existing request files are
+        written as a group (see RequestWriter), when max_pending updates
+        are waiting and at the end.
+        """
+        self.writer.begin(max_pending)
+        try:
+            yield self
+        finally:
+            self.writer.end()
+
+
+    def remove_stale_tmp_files(self, min_age=600, dry_run=False):
+        """
+        Recovery after a crash: removes temporary files left by
+        interrupted writes in the request directories and the .mngr
+        directory.  Returns the paths removed.
+        """
+        directories = [self.base_dir,
+                       os.path.join(self.base_dir, self._manifests_dir),
+                       os.path.join(self.base_dir, self._manifests_dir,
+                                    self._manifest_index_dir)]
+        directories.extend(self.get_dir_for_status(status)
+                           for status in all_statuses)
+        return remove_stale_tmp_files(directories, min_age=min_age, dry_run=dry_run)
 
 
     @property
@@ -359,6 +1018,7 @@ class RequestsManager(object):
         if not os.path.exists(self._last_id_path):
             self._write_last_id(0)
         os.chmod(self._last_id_path, 0o666)
+        self.journal.initialise()
         self._check_initialised()
 
 
@@ -404,17 +1064,6 @@ class RequestsManager(object):
                                                    date.day)
 
 
-    def withdraw(self, reqid):
-        self._check_initialised()
-        req = self.get_by_id(reqid)
-
-        if req.status != RequestStatus.NEW:
-            raise Exception(('Withdraw only supported for status NEW.'
-                             ' Current status = {}').format(req.status.name))
-            
-        req.set_status(RequestStatus.WITHDRAWN)
-
-
     def get_by_id(self, reqid, **kwargs):
         reqs = self.scan(reqid=reqid, **kwargs)
         if len(reqs) != 1:
@@ -425,47 +1074,100 @@ class RequestsManager(object):
     def scan(self,
              statuses=None, request_types=None,
              reqid=None, all_users=False,
-             include_archived=False):
+             include_archived=False, query=None):
+        """
+        Returns a list of matching requests, sorted by id.  Only the
+        filename-based parts of any RequestQuery are applied here, so that
+        no request file is opened - see select() for the content filters.
+        """
+        return self.scan_table(statuses=statuses, request_types=request_types,
+                               reqid=reqid, all_users=all_users,
+                               include_archived=include_archived,
+                               query=query).requests()
 
-        self._check_initialised()
 
-        if all_users:
-            user = None
+    def scan_table(self,
+                   statuses=None, request_types=None,
+                   reqid=None, all_users=False,
+                   include_archived=False, query=None):
+        """
+        As scan(), but returns the matching requests as a RequestTable,
+        sorted by id, rather than as request objects.
+        """
+        if query != None and query.users != None:
+            users = None  # the query does its own user filtering
+        elif all_users:
+            users = None
         else:
-            user = get_user_login_name()
+            users = [get_user_login_name()]
 
         if statuses == None:
             statuses = all_statuses
-        
-        reqs = []
 
-        for status in statuses:
-            dir_path = self.get_dir_for_status(status)
-            for filename, is_archived in self._scan_dir(dir_path,
-                                                        include_archived=include_archived):
-                if _is_tmp_path(filename):
-                    continue
+        if query != None:
+            statuses = [status for status in statuses
+                        if query.match_status(status)]
+
+        table = RequestTable.from_scan(self, statuses,
+                                       include_archived=include_archived)
+        return table.where(query=query, users=users,
+                           request_types=request_types,
+                           reqid=reqid).sorted_by_id()
+
 
-                req_user, request_type, req_id, req_date = \
-                                             self.parse_filename(filename)
-                if reqid != None and req_id != reqid:
-                    continue
-                if user != None and req_user != user:
-                    continue
+    def make_request(self, filename, status, is_archived=False, parsed=None):
+        """
+        Returns the request object for a request file, given its filename
+        and status, without looking at the file itself.
+        """
+        if parsed == None:
+            parsed = self.parse_filename(filename)
+        request_class = _request_class_map[parsed[1]]
+        return request_class(filename, self, status,
+                             is_archived=is_archived, parsed=parsed)
 
-                if request_types != None and request_type not in request_types:
-                    continue
 
-                request_class = _request_class_map[request_type]
+    def select(self, query, max_workers=default_read_workers, **kwargs):
+        """
+        Iterable which yields the requests matching a RequestQuery, in id
+        order.  Request files are only read if the query has filters which
+        depend on their content.  Keyword arguments are as for scan().
+        """
+        if not query.needs_content:
+            for req in self.scan(query=query, **kwargs):
+                yield req
+        else:
+            for req, _ in self.select_with_content(query, max_workers=max_workers,
+                                                   **kwargs):
+                yield req
+
 
-                request = request_class(filename,
-                                        self,
-                                        status,
-                                        is_archived=is_archived)
-                reqs.append(request)
+    def select_with_content(self, query, max_workers=default_read_workers,
+                            **kwargs):
+        """
+        As select(), but yields (request, params), the request files being
+        read concurrently (see read_requests).  The params can be passed to
+        RequestBase.dump or to_record to avoid reading the files again.
+        """
+        reqs = self.scan(query=query, **kwargs)
+        for req, params in read_requests(reqs, max_workers=max_workers):
+            if query.match_content(params):
+                yield req, params
 
-        reqs.sort(key=lambda req: req.reqid)
-        return reqs
+
+    def scan_filenames(self, statuses=None, include_archived=False):
+        """
+        Iterable which yields (status, filename, is_archived) for every 
+        request file, from the directory listings alone.
+        """
+        if statuses == None:
+            statuses = all_statuses
+        for status in statuses:
+            dir_path = self.get_dir_for_status(status)
+            for filename, is_archived in self._scan_dir(dir_path,
+                                                        include_archived=include_archived):
+                if not _is_tmp_path(filename):
+                    yield status, filename, is_archived
 
 
     def _scan_dir(self, path, include_archived=False):
@@ -489,6 +1191,11 @@ class RequestsManager(object):
                         yield (filename, True)
 
 
+    def get_archive_bucket(self, reqid):
+        "number of the archive subdirectory used for a given request id"
+        return (reqid - 1) // self._requests_per_archive_dir + 1
+
+
     def get_request_file_path(self, filename, status, is_archived):
 
         status_dir = self.get_dir_for_status(status)
@@ -496,7 +1203,7 @@ class RequestsManager(object):
         if is_archived:
             _, _, req_id, _ = self.parse_filename(filename)
             archive_subdir = os.path.join(self._archive_dir,
-                                          str((req_id - 1) // self._requests_per_archive_dir + 1))
+                                          str(self.get_archive_bucket(req_id)))
             return os.path.join(status_dir, archive_subdir, filename)
             
         else:
@@ -506,8 +1213,21 @@ class RequestsManager(object):
     def archive_request_file(self, filename, status):
         old_path = self.get_request_file_path(filename, status, False)
         new_path = self.get_request_file_path(filename, status, True)
-        ensure_parent_dir_exists(new_path)
-        os.rename(old_path, new_path)
+        archive_subdir = os.path.dirname(new_path)
+        if archive_subdir not in self._archive_dirs:
+            ensure_parent_dir_exists(new_path)
+            self._archive_dirs.add(archive_subdir)
+        self.writer.flush(old_path)
+        try:
+            os.rename(old_path, new_path)
+        except FileNotFoundError:
+            if not os.path.exists(old_path):
+                raise
+            # archive subdirectory removed since it was cached
+            ensure_parent_dir_exists(new_path)
+            os.rename(old_path, new_path)
+        self.op_counts['rename'] += 1
+        self._journal('archive', filename, st=self._dir_lookup[status])
 
 
     def move_request_file(self, filename, old_status, new_status):
@@ -516,7 +1236,259 @@ class RequestsManager(object):
         """
         old_path = self.get_request_file_path(filename, old_status, False)
         new_path = self.get_request_file_path(filename, new_status, False)
+        # e.g. the external ID of a submission must be on disk before the
+        # request appears as SUBMITTED
+        self.writer.flush(old_path)
         os.rename(old_path, new_path)
+        self._update_caches(filename, new_status)
+        self.op_counts['rename'] += 1
+        self._journal('move', filename,
+                      **{'from': self._dir_lookup[old_status],
+                         'to': self._dir_lookup[new_status]})
+
+
+    def _update_caches(self, filename, new_status):
+        "keep what is known about the history up to date after a move"
+        if (self._completed_migrations is not None
+            and new_status == RequestStatus.DONE
+            and self.parse_filename(filename)[1] == 'migration'):
+            self._completed_migrations = None
+        if (self._retrieval_counts is not None
+            and new_status == RequestStatus.DONE
+            and self.parse_filename(filename)[1] == 'retrieval'):
+            self._retrieval_counts = None
+        if (self._reserved_bytes is not None
+            and new_status not in (RequestStatus.SUBMITTING, RequestStatus.SUBMITTED)):
+            self._reserved_bytes.pop(filename, None)
+
+
+    def journal_param(self, filename, status, key):
+        """
+        record a parameter update in the transition journal (once the
+        update has been written, if it is part of a group)
+        """
+        dirname = self._dir_lookup[status]
+        self.writer.defer(lambda: self._journal('param', filename,
+                                                st=dirname, key=key))
+
+
+    def find_completed_migrations(self, path):
+        """
+        Returns a list of (request, params) for the migrations of the path
+        which have been done, including archived ones, oldest first.  The
+        history is read once, when first needed, and kept for the lifetime
+        of the manager (one handling cycle); it is read again only after a
+        migration is moved to DONE through this manager.
+        """
+        if self._completed_migrations is None:
+            by_path = collections.defaultdict(list)
+            reqs = self.scan(statuses=[RequestStatus.DONE],
+                             request_types=['migration'],
+                             all_users=True,
+                             include_archived=True)
+            for req, params in read_requests(reqs):
+                by_path[os.path.normpath(params['path'])].append((req, params))
+            self._completed_migrations = by_path
+        return list(self._completed_migrations.get(os.path.normpath(path), []))
+
+
+    def reserved_retrieval_bytes(self, exclude=None):
+        """
+        Returns the total expected size of the retrievals in progress,
+        other than the one with the filename exclude.  Those already
+        submitted are read once, when first needed; after that, those
+        submitted through this manager are counted as they are reserved
+        (see reserve_retrieval_bytes), and those which finish are dropped,
+        without reading the request files again.  Retrievals submitted
+        meanwhile by other handlers are only seen in the next cycle.
+        """
+        if self._reserved_bytes is None:
+            reqs = self.scan(statuses=[RequestStatus.SUBMITTED],
+                             request_types=['retrieval'],
+                             all_users=True)
+            self._reserved_bytes = dict(
+                (req.filename, params.get('expected_bytes') or 0)
+                for req, params in read_requests(reqs))
+        return sum(size for filename, size in self._reserved_bytes.items()
+                   if filename != exclude)
+
+
+    def reserve_retrieval_bytes(self, filename, size):
+        "count a retrieval being submitted (see reserved_retrieval_bytes)"
+        self.reserved_retrieval_bytes()
+        self._reserved_bytes[filename] = size
+
+
+    def migrated_storage(self, path):
+        """
+        Returns the storage backend recorded by the latest completed
+        migration of the path, or None if none recorded one.
+        """
+        backends = [params['storage'] for _, params
+                    in self.find_completed_migrations(path)
+                    if params.get('storage') != None]
+        if backends:
+            return backends[-1]
+        return None
+
+
+    def count_retrievals(self, path):
+        """
+        Returns the number of retrievals of the path (from where it was
+        migrated) which have been done, including archived ones.  As for
+        find_completed_migrations, the history is read once and kept.
+        """
+        if self._retrieval_counts is None:
+            reqs = self.scan(statuses=[RequestStatus.DONE],
+                             request_types=['retrieval'],
+                             all_users=True,
+                             include_archived=True)
+            self._retrieval_counts = collections.Counter(
+                os.path.normpath(params['orig_path'])
+                for _, params in read_requests(reqs))
+        return self._retrieval_counts[os.path.normpath(path)]
+
+
+    def expected_retrieval_bytes(self, orig_path):
+        """
+        Returns the size in bytes of the data that retrieving a migrated
+        path will write: the size recorded by its latest migration which
+        measured it, or else the size JDMA reports for its batches, or
+        None if neither is known.
+        """
+        sizes = [params['total_bytes'] for _, params
+                 in self.find_completed_migrations(orig_path)
+                 if params.get('total_bytes') != None]
+        if sizes:
+            return sizes[-1]
+        return jdma_iface.get_migrated_size(os.path.normpath(orig_path))
+
+
+    def save_manifest(self, manifest, filename):
+        """
+        Stores a checksum manifest for the request with the given filename,
+        returning the name under which it is stored.
+        """
+        manifest_name = filename + self._manifest_suffix
+        manifests_dir = os.path.join(self.base_dir, self._manifests_dir)
+        if not os.path.isdir(manifests_dir):
+            os.makedirs(manifests_dir, exist_ok=True)
+        manifest.save(os.path.join(manifests_dir, manifest_name))
+        self._check_manifest_index()
+        self._index_manifest(manifest.root, manifest_name)
+        return manifest_name
+
+
+    def load_manifest(self, manifest_name):
+        return Manifest.load(os.path.join(self.base_dir, self._manifests_dir,
+                                          manifest_name))
+
+
+    def find_migration_manifest(self, path):
+        """
+        Returns the name of the checksum manifest made by the latest
+        completed migration of the path which has one, or None.  This
+        looks up the manifest index, and then the status of the migrations
+        in it, rather than reading the migration history.
+        """
+        found = self._find_manifested_migration(path)
+        if found == None:
+            return None
+        return found[0]
+
+
+    def recorded_migration_bytes(self, path):
+        """
+        Returns the size recorded by the latest completed migration of the
+        path which made a checksum manifest, or None.  Only that one
+        request file is read (found as in find_migration_manifest), so
+        this is cheap enough to call from the command line, unlike
+        expected_retrieval_bytes.
+        """
+        found = self._find_manifested_migration(path)
+        if found == None:
+            return None
+        manifest_name, is_archived = found
+        req = self.make_request(manifest_name[:-len(self._manifest_suffix)],
+                                RequestStatus.DONE, is_archived=is_archived)
+        return req.read().get('total_bytes')
+
+
+    def _find_manifested_migration(self, path):
+        "(manifest name, is_archived) for find_migration_manifest, or None"
+        self._check_manifest_index()
+        for manifest_name in reversed(self._read_manifest_index(path)):
+            filename = manifest_name[:-len(self._manifest_suffix)]
+            for is_archived in (False, True):
+                if os.path.exists(self.get_request_file_path(
+                        filename, RequestStatus.DONE, is_archived)):
+                    return manifest_name, is_archived
+        return None
+
+
+    def _check_manifest_index(self):
+        "build the manifest index if there is not one yet"
+        if not os.path.isdir(os.path.join(self.base_dir, self._manifests_dir,
+                                          self._manifest_index_dir)):
+            self._build_manifest_index()
+
+
+    def _manifest_index_path(self, path):
+        key = hashlib.sha1(os.path.normpath(path).encode()).hexdigest()
+        return os.path.join(self.base_dir, self._manifests_dir,
+                            self._manifest_index_dir, key)
+
+
+    def _read_manifest_index(self, path):
+        "names of the manifests made for migrations of the path, oldest first"
+        try:
+            with open(self._manifest_index_path(path)) as f:
+                return json.load(f)['manifests']
+        except FileNotFoundError:
+            return []
+
+
+    def _index_manifest(self, path, manifest_name):
+        manifest_names = self._read_manifest_index(path)
+        if manifest_name in manifest_names:
+            return
+        manifest_names.append(manifest_name)
+        index_path = self._manifest_index_path(path)
+        ensure_parent_dir_exists(index_path)
+        tmp_path = _make_tmp_path(index_path)
+        with open(tmp_path, 'w') as f:
+            json.dump({'path': os.path.normpath(path),
+                       'manifests': manifest_names}, f)
+        os.chmod(tmp_path, 0o644)
+        os.rename(tmp_path, index_path)
+
+
+    def _build_manifest_index(self):
+        """
+        Indexes the manifests saved before there was an index, from the
+        original path in the header of each one, in request id order.
+        """
+        manifests_dir = os.path.join(self.base_dir, self._manifests_dir)
+        try:
+            manifest_names = [name for name in os.listdir(manifests_dir)
+                              if name.endswith(self._manifest_suffix)
+                              and not _is_tmp_path(name)]
+        except FileNotFoundError:
+            manifest_names = []
+        manifest_names.sort(key=lambda name: self.parse_filename(
+            name[:-len(self._manifest_suffix)])[2])
+        for manifest_name in manifest_names:
+            with open(os.path.join(manifests_dir, manifest_name)) as f:
+                root = json.loads(f.readline())['root']
+            self._index_manifest(root, manifest_name)
+        os.makedirs(os.path.join(manifests_dir, self._manifest_index_dir),
+                    exist_ok=True)
+
+
+    def _journal(self, op, filename, **fields):
+        _, _, reqid, _ = self.parse_filename(filename)
+        self.op_counts['journal'] += 1
+        self.journal.append(op, reqid, filename, **fields)
 
         
     @property
@@ -536,25 +1508,42 @@ class RequestsManager(object):
 
 
     def _get_next_id(self):
-        last_id = self._read_last_id()
-        next_id = last_id + 1
-        self._write_last_id(next_id)
+        # lock the file so that requests created concurrently get different ids
+        with open(self._last_id_path, "r+") as f:
+            fcntl.lockf(f, fcntl.LOCK_EX)
+            try:
+                next_id = int(f.readline()) + 1
+                f.seek(0)
+                f.truncate()
+                f.write('{}\n'.format(next_id))
+                f.flush()
+            finally:
+                fcntl.lockf(f, fcntl.LOCK_UN)
         return next_id
 
 
-    def create_request(self, request_class, *args, **kwargs):
-
+    def create_request(self, request_class, params, user=None):
+        """
+        Creates a NEW request, by default for the user running this
+        process (a different user is given only when replaying requests,
+        e.g. in the simulator).
+        """
         self._check_initialised()
 
         reqid = self._get_next_id()
-        user = get_user_login_name()
+        if user == None:
+            user = get_user_login_name()
         request_type = getattr(request_class, 'request_type')
         filename = self.make_filename(user, request_type, reqid)
         request = request_class(filename,
                                 self,
                                 RequestStatus.NEW,
                                 reqid=reqid)
-        request.write(*args, **kwargs)
+        params = params.copy()
+        params['transitions'] = [[RequestStatus.NEW.name, _timestamp()]]
+        request.write(params)
+        self._journal('create', filename,
+                      st=self._dir_lookup[RequestStatus.NEW])
         return request
         
 
@@ -564,14 +1553,14 @@ class RequestsManager(object):
             repr(self.gws_root))
 
 
-    def create_migration_request(self, *args, **kwargs):
-        return self.create_request(MigrationRequest, *args, **kwargs)
+    def create_migration_request(self, params):
+        return self.create_request(MigrationRequest, params)
 
-    def create_retrieval_request(self, *args, **kwargs):
-        return self.create_request(RetrievalRequest, *args, **kwargs)
+    def create_retrieval_request(self, params):
+        return self.create_request(RetrievalRequest, params)
     
-    def create_deletion_request(self, *args, **kwargs):
-        return self.create_request(DeletionRequest, *args, **kwargs)
+    def create_deletion_request(self, params):
+        return self.create_request(DeletionRequest, params)
     
 
 if __name__ == '__main__':
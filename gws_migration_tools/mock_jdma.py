@@ -0,0 +1,380 @@
+import re
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlsplit, unquote
+
+from jdma_client import jdma_common
+
+from gws_migration_tools.sizing import measure_tree
+
+
+api_path = '/jdma_control/api/v1/'
+
+
+# the stages that requests and batches go through, by name
+_request_stage_names = {
+    'PUT': ['PUT_START', 'PUT_PENDING', 'PUTTING', 'VERIFYING', 'PUT_TIDY',
+            'PUT_COMPLETED'],
+    'GET': ['GET_START', 'GET_PENDING', 'GETTING', 'GET_RESTORE', 'GET_TIDY',
+            'GET_COMPLETED'],
+    'DELETE': ['DELETE_START', 'DELETE_PENDING', 'DELETING', 'DELETE_TIDY',
+               'DELETE_COMPLETED'],
+}
+
+
+def _stage_codes(get_stage_name, max_code=2000):
+    "reverse lookup of jdma_common stage names to their numeric codes"
+    codes = {}
+    for code in range(max_code):
+        try:
+            name = get_stage_name(code)
+        except Exception:
+            continue
+        if name and name not in codes:
+            codes[name] = code
+    return codes
+
+
+class MockJDMA(object):
+    """
+    In-memory state of a mock JDMA: batches (migrations) and requests.
+
+    Each request moves through the JDMA stages for its type, spending
+    stage_time seconds in each, and ends either completed or FAILED (with
+    probability failure_rate).  Stages are worked out from the elapsed time
+    whenever they are queried.
+    """
+
+    def __init__(self, stage_time=1.0, failure_rate=0.0, seed=None):
+        self.stage_time = stage_time
+        self.failure_rate = failure_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._requests = {}
+        self._batches = {}
+        self._next_request_id = 1
+        self._next_batch_id = 1
+        self._request_codes = _stage_codes(jdma_common.get_request_stage)
+        self._batch_codes = _stage_codes(jdma_common.get_batch_stage)
+        # only use the stages known to this version of jdma_client
+        self._stage_names = dict(
+            (request_type, [name for name in names if name in self._request_codes])
+            for request_type, names in _request_stage_names.items())
+
+
+    def _request_type(self, request_type):
+        request_type = request_type.upper()
+        if request_type in ('MIGRATE', 'PUT'):
+            return 'PUT'
+        return request_type
+
+
+    def create_request(self, fields):
+        request_type = self._request_type(fields.get('request_type', ''))
+        if request_type not in self._stage_names:
+            return 400, {'error': 'unknown request type {}'.format(request_type)}
+
+        with self._lock:
+            if request_type == 'PUT':
+                batch_id = self._next_batch_id
+                self._next_batch_id += 1
+                self._batches[batch_id] = {
+                    'migration_id': batch_id,
+                    'user': fields.get('name'),
+                    'label': fields.get('label'),
+                    'workspace': fields.get('workspace'),
+                    'storage': fields.get('storage'),
+                    'filelist': fields.get('filelist'),
+                    'size': _filelist_size(fields.get('filelist')),
+                    'state': 'ON_DISK',
+                    }
+            else:
+                batch_id = _to_int(fields.get('migration_id'))
+                if batch_id not in self._batches:
+                    return 404, {'error': 'batch {} not found'.format(batch_id)}
+
+            request_id = self._next_request_id
+            self._next_request_id += 1
+            self._requests[request_id] = {
+                'request_id': request_id,
+                'request_type': request_type,
+                'user': fields.get('name'),
+                'migration_id': batch_id,
+                'target_path': fields.get('target_path') or fields.get('target_dir'),
+                'created': time.time(),
+                'will_fail': self._random.random() < self.failure_rate,
+                }
+        return 200, {'request_id': request_id}
+
+
+    def _request_stage(self, req):
+        names = self._stage_names[req['request_type']]
+        index = int((time.time() - req['created']) / self.stage_time)
+        if index >= len(names) - 1:
+            name = 'FAILED' if req['will_fail'] else names[-1]
+        else:
+            name = names[index]
+        return name
+
+
+    def _update_batch(self, req, stage_name):
+        batch = self._batches[req['migration_id']]
+        if batch['state'] == 'DELETED':
+            return
+        if req['request_type'] == 'PUT':
+            batch['state'] = {'PUT_COMPLETED': 'ON_STORAGE',
+                              'FAILED': 'FAILED'}.get(stage_name, 'PUTTING')
+        elif req['request_type'] == 'DELETE' and stage_name == 'DELETE_COMPLETED':
+            batch['state'] = 'DELETED'
+
+
+    def _request_record(self, req):
+        stage_name = self._request_stage(req)
+        self._update_batch(req, stage_name)
+        return {'request_id': req['request_id'],
+                'request_type': req['request_type'],
+                'migration_id': req['migration_id'],
+                'user': req['user'],
+                'stage': self._request_codes[stage_name],
+                'date': time.strftime('%Y-%m-%dT%H:%M:%S',
+                                      time.gmtime(req['created']))}
+
+
+    def get_request(self, query):
+        with self._lock:
+            if 'request_id' in query:
+                req = self._requests.get(_to_int(query['request_id']))
+                if req is None:
+                    return 404, {'error': 'request not found'}
+                return 200, self._request_record(req)
+            return 200, {'requests': [self._request_record(req)
+                                      for req in self._requests.values()
+                                      if req['user'] == query.get('name')]}
+
+
+    def get_batch(self, query):
+        with self._lock:
+            # bring batch states up to date
+            for req in self._requests.values():
+                self._update_batch(req, self._request_stage(req))
+
+            if 'migration_id' in query:
+                batch = self._batches.get(_to_int(query['migration_id']))
+                if batch is None:
+                    return 404, {'error': 'batch not found'}
+                return 200, self._batch_record(batch)
+
+            batches = [batch for batch in self._batches.values()
+                       if all(batch.get(key) == query[key]
+                              for key in ('workspace', 'label') if key in query)]
+            if not batches:
+                return 404, {'error': 'no matching batches'}
+            return 200, {'migrations': [self._batch_record(batch)
+                                        for batch in batches]}
+
+
+    def _batch_record(self, batch):
+        record = dict((key, batch[key]) for key in ('migration_id', 'label',
+                                                    'workspace', 'storage'))
+        record['stage'] = self._batch_codes[batch['state']]
+        if batch.get('size') is not None:
+            record['size'] = batch['size']
+        return record
+
+
+def _filelist_size(filelist):
+    "total size of the files to be uploaded, or None if any cannot be measured"
+    try:
+        return sum(measure_tree(path).total_bytes for path in filelist or [])
+    except OSError:
+        return None
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return value
+
+
+def _parse_query(query_string):
+    "jdma_lib separates query parameters with ';' rather than '&'"
+    query = {}
+    for item in re.split('[;&]', query_string):
+        if '=' in item:
+            key, value = item.split('=', 1)
+            query[unquote(key)] = unquote(value)
+    return query
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+    def _endpoint(self):
+        parts = urlsplit(self.path)
+        if not parts.path.startswith(api_path):
+            return None, {}
+        return parts.path[len(api_path):].strip('/'), _parse_query(parts.query)
+
+
+    def _reply(self, status_code, fields):
+        body = json.dumps(fields).encode()
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def _simulate_conditions(self):
+        """
+        Sleeps for the configured latency.  Returns True if this call
+        should fail with a server error.
+        """
+        server = self.server
+        delay = server.latency
+        if server.latency_jitter:
+            delay += random.expovariate(1. / server.latency_jitter)
+        if delay:
+            time.sleep(delay)
+        return random.random() < server.error_rate
+
+
+    def do_GET(self):
+        endpoint, query = self._endpoint()
+        if self._simulate_conditions():
+            return self._reply(503, {'error': 'simulated server error'})
+        if endpoint == 'request':
+            self._reply(*self.server.jdma.get_request(query))
+        elif endpoint == 'batch':
+            self._reply(*self.server.jdma.get_batch(query))
+        else:
+            self._reply(404, {'error': 'unknown endpoint'})
+
+
+    def do_POST(self):
+        endpoint, _ = self._endpoint()
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            fields = json.loads(self.rfile.read(length).decode() or '{}')
+        except ValueError:
+            return self._reply(400, {'error': 'unparseable request body'})
+        if self._simulate_conditions():
+            return self._reply(503, {'error': 'simulated server error'})
+        if endpoint == 'request':
+            self._reply(*self.server.jdma.create_request(fields))
+        else:
+            self._reply(404, {'error': 'unknown endpoint'})
+
+
+    do_PUT = do_POST
+
+
+class MockJDMAServer(ThreadingMixIn, HTTPServer):
+    """
+    Local HTTP stand-in for the parts of the JDMA API used via jdma_lib
+    (upload, download, delete, get_batch and get_request), for performance
+    testing.  Point the JDMA client at it by setting GWS_MIGRATION_JDMA_URL
+    (see jdma_iface).  Every API call is delayed by the configured latency,
+    and answered with HTTP 503 with probability error_rate.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, jdma, latency=0.0, latency_jitter=0.0,
+                 error_rate=0.0, verbose=False):
+        HTTPServer.__init__(self, address, _Handler)
+        self.jdma = jdma
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.verbose = verbose
+
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return 'http://{}:{}{}'.format(host, port, api_path)
+
+
+def start_server(port=0, host='127.0.0.1', stage_time=1.0, failure_rate=0.0,
+                 latency=0.0, latency_jitter=0.0, error_rate=0.0, seed=None):
+    """
+    Starts a mock JDMA server in a background thread, returning the
+    server (whose url attribute gives the API URL).
+    """
+    jdma = MockJDMA(stage_time=stage_time, failure_rate=failure_rate, seed=seed)
+    server = MockJDMAServer((host, port), jdma,
+                            latency=latency,
+                            latency_jitter=latency_jitter,
+                            error_rate=error_rate)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def add_server_arguments(parser):
+    parser.add_argument('--stage-time',
+                        help='seconds each JDMA request spends in each stage (default: 1)',
+                        type=float, default=1.0)
+    parser.add_argument('--failure-rate',
+                        help='fraction of JDMA requests which end up FAILED (default: 0)',
+                        type=float, default=0.0)
+    parser.add_argument('--latency',
+                        help='seconds added to every API call (default: 0)',
+                        type=float, default=0.0)
+    parser.add_argument('--latency-jitter',
+                        help=('mean of an exponentially distributed extra delay '
+                              'added to every API call (default: 0)'),
+                        type=float, default=0.0)
+    parser.add_argument('--error-rate',
+                        help='fraction of API calls answered with HTTP 503 (default: 0)',
+                        type=float, default=0.0)
+
+
+def parse_args(arg_list = None):
+
+    parser = argparse.ArgumentParser(
+        arg_list,
+        description='run a local mock JDMA server for testing')
+
+    parser.add_argument('-p', '--port',
+                        help='port to listen on (default: 8123)',
+                        type=int, default=8123)
+
+    add_server_arguments(parser)
+
+    parser.add_argument('-v', '--verbose',
+                        help='log each API call',
+                        action='store_true')
+
+    return parser.parse_args()
+
+
+def main():
+
+    args = parse_args()
+
+    jdma = MockJDMA(stage_time=args.stage_time, failure_rate=args.failure_rate)
+    server = MockJDMAServer(('127.0.0.1', args.port), jdma,
+                            latency=args.latency,
+                            latency_jitter=args.latency_jitter,
+                            error_rate=args.error_rate,
+                            verbose=args.verbose)
+    print('mock JDMA listening - set GWS_MIGRATION_JDMA_URL={}'.format(server.url))
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
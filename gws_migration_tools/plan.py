@@ -0,0 +1,237 @@
+import os
+import json
+import collections
+
+from gws_migration_tools.migration_request_lib import NotInitialised
+from gws_migration_tools.checkpoint import Checkpoint, resume_order
+from gws_migration_tools.reconcile import find_stale_submitting
+from gws_migration_tools.latency import _format_seconds
+
+
+# assumed time for each JDMA call, when no handling time has been measured
+# for an action and request type
+assumed_call_seconds = 1.0
+
+# request file operations counted (see RequestsManager.op_counts)
+file_operations = ('read', 'write', 'rename', 'journal')
+
+
+class CycleStats(object):
+    """
+    Recent measurements of how long the handler takes to act on one
+    request, and how many request file operations it makes, for each
+    action and request type, as exponentially weighted moving averages.
+    Kept as a small JSON file in the .mngr directory, and used to estimate
+    the duration of a cycle (see plan_workspace).
+    """
+
+    _file = '.cycle_stats'
+
+    # weight of each new measurement in the averages
+    weight = 0.1
+
+    def __init__(self, reqs_mgr):
+        self.path = os.path.join(reqs_mgr.base_dir, self._file)
+        try:
+            with open(self.path) as f:
+                self._state = json.load(f)
+        except (FileNotFoundError, ValueError):
+            self._state = {}
+        self._changed = False
+
+
+    def add(self, action_name, request_type, seconds, op_counts):
+        item = self._state.setdefault(action_name, {}).get(request_type)
+        if item == None:
+            item = {'count': 0, 'seconds': seconds,
+                    'ops': dict((op, op_counts[op]) for op in file_operations)}
+            self._state[action_name][request_type] = item
+        else:
+            item['seconds'] += self.weight * (seconds - item['seconds'])
+            for op in file_operations:
+                item['ops'][op] = item['ops'].get(op, 0.)
+                item['ops'][op] += self.weight * (op_counts[op] - item['ops'][op])
+        item['count'] += 1
+        self._changed = True
+
+
+    def get(self, action_name, request_type):
+        """
+        Returns (seconds, op counts) per request, or None if nothing has
+        been measured.
+        """
+        item = self._state.get(action_name, {}).get(request_type)
+        if item == None:
+            return None
+        return item['seconds'], collections.Counter(item['ops'])
+
+
+    def save(self):
+        if not self._changed:
+            return
+        tmp_path = os.path.join(os.path.dirname(self.path),
+                                '.tmp_' + os.path.basename(self.path))
+        with open(tmp_path, 'w') as f:
+            json.dump(self._state, f)
+        os.rename(tmp_path, self.path)
+        self._changed = False
+
+
+class ActionPlan(object):
+    """
+    What an action would do in a cycle: the requests it would act on, and
+    the JDMA calls (by endpoint), request file operations and time that
+    are expected.
+    """
+
+    def __init__(self, name, num_candidates=0):
+        self.name = name
+        self.num_candidates = num_candidates
+        self.reqs = []  # descriptions of the requests, in order
+        self.request_types = collections.Counter()
+        self.jdma_calls = collections.Counter()
+        self.file_ops = collections.Counter()
+        self.seconds = 0.
+        self.num_unknown_ops = 0  # requests with no measured file operations
+
+
+    def add(self, req, calls, stats):
+        self.reqs.append(str(req))
+        self.request_types[req.request_type] += 1
+        self.jdma_calls.update(calls)
+        measured = stats.get(self.name, req.request_type)
+        if measured == None:
+            self.seconds += assumed_call_seconds * sum(calls.values())
+            self.num_unknown_ops += 1
+        else:
+            seconds, ops = measured
+            self.seconds += seconds
+            self.file_ops.update(ops)
+
+
+class WorkspacePlan(object):
+
+    def __init__(self, gws_root):
+        self.gws_root = gws_root
+        self.actions = []
+        self.num_stale_submitting = 0
+        self.num_stale_tmp_files = 0
+        self.reconcile_calls = collections.Counter()
+        self.not_initialised = False
+
+
+    @property
+    def jdma_calls(self):
+        calls = collections.Counter(self.reconcile_calls)
+        for action in self.actions:
+            calls.update(action.jdma_calls)
+        return calls
+
+
+    @property
+    def file_ops(self):
+        ops = collections.Counter()
+        for action in self.actions:
+            ops.update(action.file_ops)
+        return ops
+
+
+    @property
+    def seconds(self):
+        return (sum(action.seconds for action in self.actions)
+                + assumed_call_seconds * sum(self.reconcile_calls.values()))
+
+
+    def dump(self):
+        print("plan for {}:".format(self.gws_root))
+        if self.not_initialised:
+            print(" not initialised for migrations - nothing to do")
+            return
+        if self.num_stale_tmp_files:
+            print(" would remove {} temporary files left by interrupted writes"
+                  .format(self.num_stale_tmp_files))
+        if self.num_stale_submitting:
+            print(" would reconcile {} requests left in SUBMITTING".format(
+                self.num_stale_submitting))
+        for action in self.actions:
+            by_type = action.request_types
+            print(" {}: {} of {} requests{}".format(
+                action.name, len(action.reqs), action.num_candidates,
+                ' ({})'.format(', '.join('{} {}'.format(n, request_type)
+                                         for request_type, n in sorted(by_type.items())))
+                if by_type else ''))
+            for req in action.reqs:
+                print("  would {}: {}".format(action.name, req))
+        dump_totals(self.jdma_calls, self.file_ops, self.seconds,
+                    sum(action.num_unknown_ops for action in self.actions),
+                    indent=' ')
+
+
+def dump_totals(jdma_calls, file_ops, seconds, num_unknown_ops, indent=''):
+    print("{}JDMA calls: {}".format(indent, _format_counts(jdma_calls)))
+    print("{}request file operations: {}{}".format(
+        indent, _format_counts(file_ops),
+        ' (and unknown for {} requests not yet measured)'.format(num_unknown_ops)
+        if num_unknown_ops else ''))
+    print("{}estimated time: {}".format(indent, _format_seconds(seconds)))
+
+
+def _format_counts(counts):
+    total = int(round(sum(counts.values())))
+    if not total:
+        return '0'
+    return '{} ({})'.format(total, ', '.join(
+        '{} {}'.format(key, int(round(counts[key])))
+        for key in sorted(counts) if round(counts[key])))
+
+
+def plan_workspace(reqs_mgr, actions, request_types, args):
+    """
+    Works out what a handling cycle would do in a workspace, using the
+    same scan and scheduling logic, but without calling JDMA or changing
+    any files.  The handler's actions must give the name of the request
+    method returning the JDMA calls planned for a request (plan_method)
+    and the status in which acting on a request leaves it for the
+    purposes of scheduling (planned_status, or None if it may stay as it
+    is).  For submission, a directory is assumed to be in a single batch
+    unless the request records that it is split into parts.  The time is estimated from the measured handling times of
+    recent cycles (see CycleStats).  Returns a WorkspacePlan.
+    """
+    plan = WorkspacePlan(reqs_mgr.gws_root)
+    try:
+        reqs_mgr._check_initialised()
+    except NotInitialised:
+        plan.not_initialised = True
+        return plan
+
+    stats = CycleStats(reqs_mgr)
+    checkpoint = Checkpoint(reqs_mgr)
+
+    plan.num_stale_tmp_files = len(reqs_mgr.remove_stale_tmp_files(dry_run=True))
+    if args.stale_submitting:
+        plan.num_stale_submitting = len(find_stale_submitting(reqs_mgr,
+                                                              args.stale_submitting))
+        if plan.num_stale_submitting:
+            plan.reconcile_calls.update(get_batch=1, get_request=1)
+
+    for action in actions:
+        reqs = reqs_mgr.scan(all_users=True,
+                             statuses=(action.input_status,),
+                             request_types=request_types)
+        reqs.sort(key=lambda req:req.reqid)
+        reqs = resume_order(reqs, checkpoint.get(action.name))
+
+        action_plan = ActionPlan(action.name, num_candidates=len(reqs))
+        for req in action.select(reqs, reqs_mgr, args):
+            try:
+                params = req.read()
+            except FileNotFoundError:
+                continue
+            action_plan.add(req, getattr(req, action.plan_method)(params), stats)
+            if action.planned_status:
+                # only in memory, so that the scheduler counts it as it
+                # would after a real submission
+                req.status = action.planned_status
+        plan.actions.append(action_plan)
+
+    return plan
@@ -0,0 +1,70 @@
+import os
+
+from gws_migration_tools.sizing import format_bytes
+
+
+# extra fraction of the size of a retrieval which must be free, to allow
+# for differences in block usage and for files written meanwhile
+space_margin = 0.05
+
+
+class InsufficientSpace(Exception):
+    """
+    Raised when the filesystem holding the destination of a retrieval does
+    not have room for the retrieved data.
+    """
+    pass
+
+
+def is_empty_dir(path):
+    "True if the directory has no entries (stops listing at the first)"
+    with os.scandir(path) as entries:
+        for _ in entries:
+            return False
+    return True
+
+
+def check_destination(dest_dir):
+    """
+    Raises ValueError unless the destination of a retrieval either does
+    not exist or is an empty directory.
+    """
+    if os.path.isdir(dest_dir):
+        if is_empty_dir(dest_dir):
+            return
+    elif not os.path.lexists(dest_dir):
+        return
+    raise ValueError("destination directory {} exists and is not an empty directory"
+                     .format(dest_dir))
+
+
+def free_bytes(path):
+    """
+    Returns the space available to unprivileged users on the filesystem
+    which holds the path, or which would hold it if it does not exist yet.
+    """
+    path = os.path.abspath(path)
+    while not os.path.exists(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    st = os.statvfs(path)
+    return st.f_bavail * st.f_frsize
+
+
+def check_space(dest_dir, size, reserved=0):
+    """
+    Raises InsufficientSpace unless there is room for size bytes (plus the
+    margin) at the destination, after setting aside reserved bytes for
+    other retrievals in progress.
+    """
+    needed = int(size * (1 + space_margin))
+    available = free_bytes(dest_dir) - reserved
+    if needed > available:
+        message = "retrieval to {} needs {} but only {} is free".format(
+            dest_dir, format_bytes(needed), format_bytes(max(available + reserved, 0)))
+        if reserved:
+            message += " ({} of it set aside for other retrievals)".format(
+                format_bytes(reserved))
+        raise InsufficientSpace(message)
@@ -0,0 +1,231 @@
+import os
+import csv
+import json
+import datetime
+
+from gws_migration_tools.migration_request_lib import RequestStatus
+
+
+class RequestQuery(object):
+    """
+    A set of filters that can be applied to requests.
+
+    The filters on user, request type, status, id and date only need the
+    information which is encoded in the request filename (or in the
+    directory which contains it), so RequestsManager.scan applies them
+    before any request file is opened.  The path prefix and external ID
+    filters need the file content, so are only applied afterwards, to the
+    requests which have passed the filename filters.
+    """
+
+    def __init__(self,
+                 users=None, request_types=None, statuses=None,
+                 ids=None, min_id=None, max_id=None,
+                 since=None, until=None,
+                 path_prefix=None, external_ids=None):
+        self.users = _as_set(users)
+        self.request_types = _as_set(request_types)
+        self.statuses = _as_set(statuses)
+        self.ids = None if ids is None else IdSet(ids)
+        self.min_id = min_id
+        self.max_id = max_id
+        self.since = since
+        self.until = until
+        if path_prefix:
+            path_prefix = os.path.normpath(path_prefix)
+        self.path_prefix = path_prefix
+        if external_ids is not None:
+            external_ids = set(str(ext_id) for ext_id in external_ids)
+        self.external_ids = external_ids
+
+
+    def to_dict(self):
+        "JSON-serialisable form of the query, as used by the query service"
+        return {
+            'users': _as_list(self.users),
+            'request_types': _as_list(self.request_types),
+            'statuses': (None if self.statuses is None else
+                         sorted(status.name for status in self.statuses)),
+            'ids': None if self.ids is None else self.ids.to_list(),
+            'min_id': self.min_id,
+            'max_id': self.max_id,
+            'since': None if self.since is None else self.since.isoformat(),
+            'until': None if self.until is None else self.until.isoformat(),
+            'path_prefix': self.path_prefix,
+            'external_ids': _as_list(self.external_ids),
+            }
+
+
+    @classmethod
+    def from_dict(cls, d):
+        "inverse of to_dict"
+        statuses = d.get('statuses')
+        since = d.get('since')
+        until = d.get('until')
+        return cls(users=d.get('users'),
+                   request_types=d.get('request_types'),
+                   statuses=(None if statuses is None else
+                             [RequestStatus[name] for name in statuses]),
+                   ids=d.get('ids'),
+                   min_id=d.get('min_id'),
+                   max_id=d.get('max_id'),
+                   since=None if since is None else parse_date(since),
+                   until=None if until is None else parse_date(until),
+                   path_prefix=d.get('path_prefix'),
+                   external_ids=d.get('external_ids'))
+
+
+    def match_status(self, status):
+        return self.statuses is None or status in self.statuses
+
+
+    def match_filename(self, user, request_type, reqid, date):
+        if self.users is not None and user not in self.users:
+            return False
+        if self.request_types is not None and request_type not in self.request_types:
+            return False
+        if self.ids is not None and reqid not in self.ids:
+            return False
+        if self.min_id is not None and reqid < self.min_id:
+            return False
+        if self.max_id is not None and reqid > self.max_id:
+            return False
+        if self.since is not None and date < self.since:
+            return False
+        if self.until is not None and date > self.until:
+            return False
+        return True
+
+
+    @property
+    def needs_content(self):
+        return self.path_prefix is not None or self.external_ids is not None
+
+
+    def match_content(self, params):
+        if self.external_ids is not None:
+            ext_ids = params.get('external_ids') or [params.get('external_id')]
+            if not any(str(ext_id) in self.external_ids
+                       for ext_id in ext_ids if ext_id is not None):
+                return False
+
+        if self.path_prefix is not None:
+            paths = [params.get(key) for key in ('path', 'orig_path', 'new_path')]
+            if not any(_path_has_prefix(path, self.path_prefix)
+                       for path in paths if path):
+                return False
+
+        return True
+
+
+def _as_set(values):
+    if values is None:
+        return None
+    return set(values)
+
+
+def _as_list(values):
+    if values is None:
+        return None
+    return sorted(values)
+
+
+def _path_has_prefix(path, prefix):
+    path = os.path.normpath(path)
+    if prefix == '/':
+        return path.startswith('/')
+    return path == prefix or path.startswith(prefix + '/')
+
+
+class IdSet(object):
+    """
+    A set of request ids, given as individual ids and inclusive ranges.
+    Ranges are kept as range objects rather than expanded, so that a wide
+    range costs no more than a single id.
+    """
+
+    def __init__(self, items=()):
+        self.ids = set()
+        self.ranges = []
+        for item in items:
+            self.add(item)
+
+
+    def add(self, item):
+        "add an id, a range, or [first, last] as in to_list"
+        if isinstance(item, range):
+            if item:
+                self.ranges.append(range(item[0], item[-1] + 1))
+        elif isinstance(item, (list, tuple)):
+            first, last = item
+            self.add(range(first, last + 1))
+        else:
+            self.ids.add(int(item))
+
+
+    def __contains__(self, reqid):
+        return reqid in self.ids or any(reqid in ids for ids in self.ranges)
+
+
+    def to_list(self):
+        "JSON-serialisable form: ids, then [first, last] for each range"
+        return (sorted(self.ids)
+                + [[ids[0], ids[-1]] for ids in sorted(self.ranges,
+                                                       key=lambda ids: ids[0])])
+
+
+def parse_ids(s):
+    """
+    parse request ids as given on the command line: a comma-separated
+    list of ids and inclusive ranges, e.g. '12,15-20', returned as a list
+    of ids and range objects (see IdSet)
+    """
+    ids = []
+    for item in s.split(','):
+        if '-' in item:
+            first, last = item.split('-', 1)
+            first, last = int(first), int(last)
+            if first > last:
+                raise ValueError("bad id range {}".format(item))
+            ids.append(range(first, last + 1))
+        else:
+            ids.append(int(item))
+    return ids
+
+
+def parse_date(s):
+    "parse a YYYY-MM-DD date as used on the command line"
+    return datetime.datetime.strptime(s, '%Y-%m-%d').date()
+
+
+# fields written by the machine-readable output formats, in column order
+record_fields = ['id', 'user', 'request_type', 'date', 'status', 'archived',
+                 'path', 'orig_path', 'new_path', 'external_id', 'message',
+                 'file_count', 'total_bytes', 'storage']
+
+
+class RecordWriter(object):
+    """
+    Writes requests one at a time as JSON lines or CSV, so that large
+    result sets are streamed rather than built up in memory.
+    """
+
+    formats = ('jsonl', 'csv')
+
+    def __init__(self, stream, fmt):
+        if fmt not in self.formats:
+            raise ValueError("unknown output format {}".format(fmt))
+        self.stream = stream
+        self.fmt = fmt
+        if fmt == 'csv':
+            self._csv_writer = csv.DictWriter(stream, fieldnames=record_fields)
+            self._csv_writer.writeheader()
+
+
+    def write(self, record):
+        if self.fmt == 'jsonl':
+            self.stream.write(json.dumps(record) + '\n')
+        else:
+            self._csv_writer.writerow(
+                dict((key, '' if value is None else value)
+                     for key, value in record.items()))
@@ -0,0 +1,510 @@
+import os
+import pwd
+import sys
+import json
+import stat
+import time
+import socket
+import struct
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from socketserver import ThreadingMixIn, UnixStreamServer, StreamRequestHandler
+
+from gws_migration_tools import gws
+from gws_migration_tools.journal import JournalTruncated
+from gws_migration_tools.migration_request_lib import \
+    RequestsManager, RequestStatus, default_read_workers
+from gws_migration_tools.query import RequestQuery
+from gws_migration_tools.summary import summarise_entries
+from gws_migration_tools.fleet import find_workspaces
+
+
+default_socket_path = '/var/run/gws_migration_tools/query.sock'
+
+
+def get_socket_path():
+    "socket path, which can be overridden with GWS_MIGRATION_QUERY_SOCKET"
+    return os.environ.get('GWS_MIGRATION_QUERY_SOCKET', default_socket_path)
+
+
+class ServiceUnavailable(Exception):
+    """
+    Raised by QueryClient if there is no query service, or it does not
+    serve the requested group workspace.  The caller should scan the
+    request directories itself instead.
+    """
+    pass
+
+
+class WorkspaceView(object):
+    """
+    In-memory view of all the requests of one group workspace, kept up to
+    date from the transition journal.  The status and archived flag of
+    every request are held, along with the content of request files that
+    have been read, which is discarded when the journal shows a parameter
+    change.
+
+    Without a journal (workspaces not initialised since it was added), or
+    if the journal has been compacted past the last offset read, the
+    request directories are listed again instead.
+    """
+
+    def __init__(self, reqs_mgr):
+        self.reqs_mgr = reqs_mgr
+        self._lock = threading.Lock()
+        self._entries = {}  # filename: (status, is_archived)
+        self._params = {}  # filename: request file content
+        self._generations = {}  # filename: number of content changes seen
+        self._offset = None
+        self._statuses = dict((reqs_mgr._dir_lookup[status], status)
+                              for status in RequestStatus)
+
+
+    def refresh(self):
+        with self._lock:
+            journal = self.reqs_mgr.journal
+            if self._offset is None or not journal.exists():
+                return self._rescan()
+            try:
+                records, self._offset = journal.read_since(self._offset)
+            except JournalTruncated:
+                return self._rescan()
+            for record in records:
+                self._apply(record)
+
+
+    def _rescan(self):
+        journal = self.reqs_mgr.journal
+        # records added during the listing are applied again next time,
+        # which is harmless
+        self._offset = journal.end_offset() if journal.exists() else None
+        self._entries = dict(
+            (filename, (status, is_archived))
+            for status, filename, is_archived
+            in self.reqs_mgr.scan_filenames(include_archived=True))
+        self._params.clear()
+        self._generations.clear()
+
+
+    def _apply(self, record):
+        op = record['op']
+        filename = record['fn']
+        if op == 'move':
+            self._entries[filename] = (self._statuses[record['to']], False)
+        elif op == 'archive':
+            self._entries[filename] = (self._statuses[record['st']], True)
+        else:
+            if op == 'create':
+                self._entries[filename] = (self._statuses[record['st']], False)
+            self._params.pop(filename, None)
+            self._generations[filename] = self._generations.get(filename, 0) + 1
+
+
+    def entries(self, query=None, user=None, include_archived=False):
+        """
+        Returns a list of (status, filename, is_archived) for the requests
+        matching the filename-based filters, sorted by id.  As for
+        RequestsManager.scan, the requests are restricted to the given user
+        unless the query has its own user filter.
+        """
+        parse = self.reqs_mgr.parse_filename
+        if query is not None and query.users is not None:
+            user = None
+        matched = []
+        with self._lock:
+            items = list(self._entries.items())
+        for filename, (status, is_archived) in items:
+            if is_archived and not include_archived:
+                continue
+            if query is not None and not query.match_status(status):
+                continue
+            req_user, request_type, reqid, date = parse(filename)
+            if user is not None and req_user != user:
+                continue
+            if query is not None and not query.match_filename(
+                    req_user, request_type, reqid, date):
+                continue
+            matched.append((reqid, status, filename, is_archived))
+        matched.sort()
+        return [(status, filename, is_archived)
+                for _, status, filename, is_archived in matched]
+
+
+    def with_content(self, entries, max_workers=default_read_workers):
+        """
+        Iterable which yields (status, filename, is_archived, params) for
+        the given entries, reading any request files not already cached.
+        A request whose file has moved since the entries were made is
+        given with its new status, or left out if it has gone.
+        """
+        # a chunk at a time, so that the replies to a large query are
+        # streamed rather than all held in memory first
+        chunk_size = max_workers * 4
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for start in range(0, len(entries), chunk_size):
+                chunk = entries[start:start + chunk_size]
+                with self._lock:
+                    cached = dict((filename, self._params.get(filename))
+                                  for _, filename, _ in chunk)
+
+                to_read = [entry for entry in chunk if cached[entry[1]] is None]
+                for entry, result in zip(to_read,
+                                         executor.map(self._read, to_read)):
+                    if result is not None:
+                        cached[entry[1]] = result
+
+                for status, filename, is_archived in chunk:
+                    result = cached[filename]
+                    if result is None:
+                        continue
+                    if isinstance(result, tuple):  # moved while being read
+                        status, is_archived, params = result
+                    else:
+                        params = result
+                    yield status, filename, is_archived, params
+
+
+    def readable_by(self, uid, gids):
+        """
+        Whether a user (given the uid and group ids of a client) could
+        read the request files of the workspace themselves, i.e. could
+        search every directory down to the .mngr directory and list it.
+        """
+        if uid == 0:
+            return True
+        path = os.path.abspath(self.reqs_mgr.base_dir)
+        dirs = [path]
+        while os.path.dirname(dirs[-1]) != dirs[-1]:
+            dirs.append(os.path.dirname(dirs[-1]))
+        for dirpath in dirs:
+            needed = 'rx' if dirpath == path else 'x'
+            try:
+                st = os.stat(dirpath)
+            except OSError:
+                return False
+            if not _allowed(st, uid, gids, needed):
+                return False
+        return True
+
+
+    def _read(self, entry):
+        status, filename, is_archived = entry
+        for attempt in range(2):
+            with self._lock:
+                generation = self._generations.get(filename, 0)
+            req = self.reqs_mgr.make_request(filename, status,
+                                             is_archived=is_archived)
+            try:
+                params = req.read()
+            except FileNotFoundError:
+                if attempt:
+                    return None
+                self.refresh()
+                with self._lock:
+                    if filename not in self._entries:
+                        return None
+                    status, is_archived = self._entries[filename]
+                continue
+            with self._lock:
+                # don't cache content which was changed while being read
+                if self._generations.get(filename, 0) == generation:
+                    self._params[filename] = params
+            if attempt:
+                return status, is_archived, params
+            return params
+        return None
+
+
+def _allowed(st, uid, gids, needed):
+    "whether the owner, group or other permission bits of st allow the access"
+    if st.st_uid == uid:
+        bits = {'r': stat.S_IRUSR, 'x': stat.S_IXUSR}
+    elif st.st_gid in gids:
+        bits = {'r': stat.S_IRGRP, 'x': stat.S_IXGRP}
+    else:
+        bits = {'r': stat.S_IROTH, 'x': stat.S_IXOTH}
+    return all(st.st_mode & bits[access] for access in needed)
+
+
+def _peer_credentials(sock):
+    """
+    Returns (uid, set of group ids) for the process at the other end of a
+    Unix socket, from SO_PEERCRED and the group database.
+    """
+    creds = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED,
+                            struct.calcsize('3i'))
+    _, uid, gid = struct.unpack('3i', creds)
+    gids = set([gid])
+    try:
+        gids.update(os.getgrouplist(pwd.getpwuid(uid).pw_name, gid))
+    except KeyError:
+        pass  # no such user in the password database
+    return uid, gids
+
+
+class _Handler(StreamRequestHandler):
+    """
+    Protocol: the client sends one line of JSON, and the service replies
+    with lines of JSON, the last of which is {"end": true} or {"error": ...}.
+
+    Requests have keys:
+       op: 'list' or 'summary'
+       gws: group workspace root
+       query: RequestQuery.to_dict() (optional)
+       user: only requests for this user, unless the query has its own
+             user filter (optional)
+       include_archived: (list only) include archived requests
+    Each reply line for 'list' has keys status, filename, archived and
+    params; for 'summary' there is one line with the key summary, holding
+    WorkspaceSummary.to_record().
+    """
+
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline().decode())
+            peer = None
+            if self.server.check_peers:
+                peer = _peer_credentials(self.connection)
+            for reply in self.server.answer(request, peer=peer):
+                self._send(reply)
+            self._send({'end': True})
+        except BrokenPipeError:
+            pass
+        except Exception as exc:
+            try:
+                self._send({'error': str(exc)})
+            except BrokenPipeError:
+                pass
+
+
+    def _send(self, reply):
+        self.wfile.write((json.dumps(reply) + '\n').encode())
+
+
+class QueryServer(ThreadingMixIn, UnixStreamServer):
+    """
+    Answers list and summary queries about the requests of a set of group
+    workspaces, from a WorkspaceView of each.  Each view is brought up to
+    date from the journal before it is used.
+
+    Anyone can connect to the socket, but a client is only answered about
+    a workspace whose request directory it could read itself, judging by
+    its user and groups (from SO_PEERCRED).  Where peer credentials are
+    not available, the socket is only accessible to the user running the
+    service.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, socket_path, gws_roots, max_workers=default_read_workers):
+        self.views = dict((gws_root, WorkspaceView(RequestsManager(gws_root)))
+                          for gws_root in gws_roots)
+        self.max_workers = max_workers
+        for view in self.views.values():
+            view.refresh()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        UnixStreamServer.__init__(self, socket_path, _Handler)
+        self.check_peers = hasattr(socket, 'SO_PEERCRED')
+        os.chmod(socket_path, 0o666 if self.check_peers else 0o600)
+
+
+    def refresh_all(self):
+        for view in self.views.values():
+            view.refresh()
+
+
+    def answer(self, request, peer=None):
+        """
+        Iterable which yields the replies to a request, from a client with
+        the given (uid, group ids), or None if they are not checked.
+        """
+        view = self.views.get(request.get('gws'))
+        if view is None:
+            raise ServiceUnavailable("group workspace {} is not served"
+                                     .format(request.get('gws')))
+        if peer is not None and not view.readable_by(*peer):
+            raise PermissionError("not permitted to read the requests of {}"
+                                  .format(request.get('gws')))
+        view.refresh()
+
+        query = None
+        if request.get('query') is not None:
+            query = RequestQuery.from_dict(request['query'])
+        user = request.get('user')
+        op = request.get('op')
+
+        if op == 'list':
+            entries = view.entries(query, user=user,
+                                   include_archived=request.get('include_archived'))
+            for status, filename, is_archived, params in view.with_content(
+                    entries, max_workers=self.max_workers):
+                if query is None or query.match_content(params):
+                    yield {'status': status.name, 'filename': filename,
+                           'archived': is_archived, 'params': params}
+
+        elif op == 'summary':
+            if query is not None and query.needs_content:
+                raise ValueError("summary cannot be combined with filters "
+                                 "on path or external ID")
+            if user is not None and (query is None or query.users is None):
+                query = query or RequestQuery()
+                query.users = set([user])
+            entries = view.entries(query, include_archived=True)
+            summary = summarise_entries(view.reqs_mgr, entries, query=query)
+            yield {'summary': summary.to_record()}
+
+        else:
+            raise ValueError("unknown operation {}".format(op))
+
+
+class QueryClient(object):
+    """
+    Client for the query service.  Raises ServiceUnavailable if the
+    service cannot be used for the workspace, in which case nothing will
+    have been yielded.
+    """
+
+    def __init__(self, socket_path=None, timeout=10.0):
+        self.socket_path = socket_path or get_socket_path()
+        self.timeout = timeout
+
+
+    def _call(self, request):
+        if not os.path.exists(self.socket_path):
+            raise ServiceUnavailable("no query service socket")
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+            sock.sendall((json.dumps(request) + '\n').encode())
+            stream = sock.makefile('rb')
+        except OSError as exc:
+            sock.close()
+            raise ServiceUnavailable("cannot connect to query service: {}"
+                                     .format(exc))
+        try:
+            first = True
+            while True:
+                try:
+                    line = stream.readline()
+                except OSError as exc:
+                    if first:
+                        raise ServiceUnavailable("query service: {}".format(exc))
+                    raise
+                if not line:
+                    break
+                reply = json.loads(line.decode())
+                if 'error' in reply:
+                    if first:
+                        raise ServiceUnavailable(reply['error'])
+                    raise Exception("query service: {}".format(reply['error']))
+                if reply.get('end'):
+                    return
+                first = False
+                yield reply
+            if first:
+                raise ServiceUnavailable("query service closed the connection")
+            raise Exception("query service closed the connection")
+        finally:
+            stream.close()
+            sock.close()
+
+
+    def list_requests(self, gws_root, query=None, user=None,
+                      include_archived=False):
+        """
+        Iterable which yields (status, filename, is_archived, params) for
+        the matching requests, in id order.
+        """
+        for reply in self._call({'op': 'list', 'gws': gws_root,
+                                 'query': None if query is None else query.to_dict(),
+                                 'user': user,
+                                 'include_archived': include_archived}):
+            yield (RequestStatus[reply['status']], reply['filename'],
+                   reply['archived'], reply['params'])
+
+
+    def summary_record(self, gws_root, query=None, user=None):
+        for reply in self._call({'op': 'summary', 'gws': gws_root,
+                                 'query': None if query is None else query.to_dict(),
+                                 'user': user}):
+            return reply['summary']
+
+
+def parse_args(arg_list = None):
+
+    parser = argparse.ArgumentParser(
+        arg_list,
+        description=('serve list and summary queries about requests for one or '
+                     'more group workspaces over a local Unix socket, so that '
+                     'list-offline-requests and dashboards need not scan the '
+                     'request directories themselves'))
+
+    parser.add_argument('gws',
+                        help='path to group workspace',
+                        nargs='*')
+
+    parser.add_argument('--fleet',
+                        help=('serve all group workspaces for which migrations '
+                              'have been initialised (see fleet-offline-requests)'),
+                        action='store_true')
+
+    parser.add_argument('-s', '--socket',
+                        help=('path of the socket (default: $GWS_MIGRATION_QUERY_SOCKET '
+                              'or {})').format(default_socket_path))
+
+    parser.add_argument('-i', '--refresh-interval',
+                        help=('seconds between background updates of the views, '
+                              'in addition to the update made for each query '
+                              '(default: 30)'),
+                        type=float,
+                        default=30.)
+
+    parser.add_argument('-j', '--jobs',
+                        help=('number of request files to read concurrently '
+                              '(default: {})').format(default_read_workers),
+                        type=int,
+                        default=default_read_workers)
+
+    args = parser.parse_args()
+
+    if not (args.gws or args.fleet):
+        parser.error('no group workspaces specified (give paths or use --fleet)')
+
+    return args
+
+
+def main():
+
+    args = parse_args()
+
+    gws_roots = [gws.get_gws_root_from_path(path) for path in args.gws]
+    if args.fleet:
+        gws_roots.extend(gws_root for gws_root in find_workspaces()
+                         if gws_root not in gws_roots)
+
+    socket_path = args.socket or get_socket_path()
+    server = QueryServer(socket_path, gws_roots, max_workers=args.jobs)
+    print('serving {} group workspace(s) on {}'.format(len(gws_roots), socket_path))
+    sys.stdout.flush()
+
+    def refresh_loop():
+        while True:
+            time.sleep(args.refresh_interval)
+            try:
+                server.refresh_all()
+            except Exception as exc:
+                print('refresh failed: {}'.format(exc))
+
+    thread = threading.Thread(target=refresh_loop)
+    thread.daemon = True
+    thread.start()
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        os.remove(socket_path)
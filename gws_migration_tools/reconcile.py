@@ -0,0 +1,165 @@
+import os
+import time
+import socket
+
+from gws_migration_tools.migration_request_lib import \
+    RequestStatus, read_requests, default_read_workers, jdma_iface
+
+
+# allowance for the clocks of this host and JDMA being out of step, when
+# ignoring JDMA requests made before a request was claimed
+clock_slack = 300
+
+
+def find_stale_submitting(reqs_mgr, stale_after, now=None,
+                          max_workers=default_read_workers):
+    """
+    Returns a list of (request, params, claimed) for the requests which
+    have been in SUBMITTING for more than stale_after seconds, where
+    claimed is when the request was moved to SUBMITTING (or if that was
+    not recorded, when the file was last written), oldest first.
+
+    A claim is presumed alive, and the request left alone, while the
+    handler submitting it keeps touching the file (see
+    RequestBase._claim_heartbeat), i.e. if the file was modified within
+    stale_after seconds, or while the process recorded as the claimer is
+    still running on this host.
+    """
+    if now is None:
+        now = time.time()
+    reqs = reqs_mgr.scan(all_users=True, statuses=(RequestStatus.SUBMITTING,))
+    stale = []
+    for req, params in read_requests(reqs, max_workers=max_workers):
+        if _is_live_claim(params.get('claimed_by')):
+            continue
+        try:
+            heartbeat = os.stat(req._path).st_mtime
+        except FileNotFoundError:
+            continue
+        claimed = [when for status, when in req.get_transitions(params)
+                   if status == RequestStatus.SUBMITTING]
+        claimed = claimed[-1] if claimed else heartbeat
+        if now - max(claimed, heartbeat) > stale_after:
+            stale.append((req, params, claimed))
+    stale.sort(key=lambda item: item[2])
+    return stale
+
+
+def _is_live_claim(claimer):
+    "whether the claimer recorded in a request is a process running on this host"
+    if not claimer or claimer.get('host') != socket.gethostname():
+        return False
+    try:
+        os.kill(claimer['pid'], 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # running as another user
+    return True
+
+
+def reconcile_request(req, params, claimed, catalogue, used):
+    """
+    Matches a request left in SUBMITTING against the JDMA requests in the
+    catalogue (the request's _jdma_jobs method gives those that submitting
+    it makes, in order, as a list of (kind, IDs of the batches each may be
+    on)), and moves it to SUBMITTED with the external id(s) if all
+    the JDMA requests that submitting it makes are found, or otherwise
+    back to NEW (keeping the external ids of those found in order, so that
+    submission carries on after them).  JDMA requests in used, or made
+    before the request was claimed, are not considered; those matched are
+    added to used.  Returns a message.
+    """
+    jobs = req._jdma_jobs(params, catalogue)
+
+    if params.get('external_id') != None:
+        ext_ids = [params['external_id']]
+    else:
+        ext_ids = list(params.get('external_ids') or [])
+    used.update(ext_ids)
+
+    found = []
+    for kind, batch_ids in jobs[len(ext_ids):]:
+        job = catalogue.find_request(kind, batch_ids,
+                                     since=claimed - clock_slack,
+                                     exclude=used)
+        if job is None:
+            break
+        used.add(job['request_id'])
+        ext_ids.append(job['request_id'])
+        found.append(job)
+
+    if found:
+        if len(jobs) == 1:
+            req.set_external_id(ext_ids[0])
+        else:
+            req.set_params({'external_ids': ext_ids})
+
+    if jobs and len(ext_ids) >= len(jobs):
+        accepted = [catalogue.request_time(job) for job in found]
+        req.set_message('submission found in JDMA by reconciliation')
+        req.set_status(RequestStatus.SUBMITTED,
+                       when=max(accepted) if found and None not in accepted else None)
+        return "reconciled: {} (JDMA request {})".format(
+            req, ','.join(map(str, ext_ids)))
+
+    if ext_ids:
+        detail = '{} of {} JDMA requests found'.format(len(ext_ids), len(jobs))
+    else:
+        detail = 'no JDMA request found'
+    req.set_message('returned to NEW by reconciliation: {}'.format(detail))
+    req.set_status(RequestStatus.NEW)
+    return "returned to NEW: {} ({})".format(req, detail)
+
+
+def attached_external_ids(reqs_mgr, exclude=(), max_workers=default_read_workers):
+    """
+    Returns the set of the external ids recorded in the requests (not yet
+    archived) which have been submitted, except those in exclude.
+    """
+    statuses = (RequestStatus.SUBMITTING, RequestStatus.SUBMITTED,
+                RequestStatus.DONE, RequestStatus.FAILED)
+    exclude = set(req.reqid for req in exclude)
+    reqs = [req for req in reqs_mgr.scan(all_users=True, statuses=statuses)
+            if req.reqid not in exclude]
+    ext_ids = set()
+    for req, params in read_requests(reqs, max_workers=max_workers):
+        if params.get('external_id') != None:
+            ext_ids.add(params['external_id'])
+        ext_ids.update(params.get('external_ids') or [])
+    return ext_ids
+
+
+def reconcile_submitting(reqs_mgr, stale_after, lease_mgr=None,
+                         max_workers=default_read_workers):
+    """
+    Deals with requests left in SUBMITTING by a handler which was stopped
+    while submitting them (see reconcile_request).  The batches of the
+    workspace and the JDMA requests of this user are fetched once, so that
+    any number of requests are matched up with two JDMA queries.  With a
+    lease manager, requests whose lease is held by another worker are
+    skipped.  JDMA requests already recorded in other requests are not
+    matched again.  Returns a list of messages.
+    """
+    stale = find_stale_submitting(reqs_mgr, stale_after, max_workers=max_workers)
+    if not stale:
+        return []
+
+    catalogue = jdma_iface.get_catalogue(reqs_mgr.gws_root)
+    used = attached_external_ids(reqs_mgr,
+                                 exclude=[req for req, _, _ in stale],
+                                 max_workers=max_workers)
+    messages = []
+    for req, params, claimed in stale:
+        if lease_mgr and not lease_mgr.acquire(req.reqid):
+            continue
+        try:
+            messages.append(reconcile_request(req, params, claimed, catalogue, used))
+        except Exception as err:
+            messages.append("reconciliation of request {}: failed with: {}"
+                            .format(req.reqid, err))
+        finally:
+            if lease_mgr:
+                reqs_mgr.writer.commit()
+                lease_mgr.release(req.reqid)
+    return messages
@@ -1,10 +1,24 @@
 import os
 import sys
+import copy
+import json
 import argparse
+import itertools
 
 
 from gws_migration_tools import gws
-from gws_migration_tools.migration_request_lib import RequestsManager, RequestStatus
+from gws_migration_tools.migration_request_lib import \
+    RequestsManager, RequestStatus, all_statuses, default_read_workers
+from gws_migration_tools.query import \
+    RequestQuery, RecordWriter, parse_date, parse_ids
+from gws_migration_tools.bulk import apply_bulk
+from gws_migration_tools.summary import summarise_workspaces, WorkspaceSummary
+from gws_migration_tools.query_service import QueryClient, ServiceUnavailable
+from gws_migration_tools.follow import follow
+from gws_migration_tools.sizing import measure_tree
+from gws_migration_tools.preflight import check_destination, check_space
+from gws_migration_tools.storage_policy import access_patterns
+from gws_migration_tools.util import get_user_login_name
 
 
 def parse_args_migration(arg_list = None):
@@ -16,6 +30,17 @@ def parse_args_migration(arg_list = None):
     parser.add_argument('directory',
                         help='directory to migrate')
 
+    parser.add_argument('-s', '--size',
+                        help=('measure the number of files and total size of the '
+                              'directory and record them in the request'),
+                        action='store_true')
+
+    parser.add_argument('-a', '--access',
+                        help=('how often the data is expected to be retrieved, '
+                              'used to choose where it is stored by the policy '
+                              'of the group workspace (see init-migrations)'),
+                        choices=access_patterns)
+
     return parser.parse_args()
 
 
@@ -48,18 +73,94 @@ def parse_args_deletion(arg_list = None):
     return parser.parse_args()
 
 
+def add_selection_arguments(parser):
+    """
+    Adds the arguments used to choose the requests for a bulk operation:
+    ids and id ranges, and filters as for list-offline-requests.
+    """
+    parser.add_argument('ids',
+                        help=('request ids, as a comma-separated list of ids '
+                              'and ranges, e.g. 12,15-20 (may be repeated)'),
+                        type=parse_ids,
+                        nargs='*')
+
+    filters = parser.add_argument_group('filters')
+
+    filters.add_argument('-u', '--user',
+                         help='only requests for this user (may be repeated)',
+                         action='append')
+
+    filters.add_argument('-t', '--type',
+                         help='only requests of this type (may be repeated)',
+                         choices=('migration', 'retrieval', 'deletion'),
+                         action='append')
+
+    filters.add_argument('--min-id',
+                         help='only requests with at least this id',
+                         type=int)
+
+    filters.add_argument('--max-id',
+                         help='only requests with at most this id',
+                         type=int)
+
+    filters.add_argument('--since',
+                         help='only requests made on or after this date (YYYY-MM-DD)',
+                         type=parse_date)
+
+    filters.add_argument('--until',
+                         help='only requests made on or before this date (YYYY-MM-DD)',
+                         type=parse_date)
+
+    filters.add_argument('-p', '--path-prefix',
+                         help='only requests for paths under this directory')
+
+    parser.add_argument('-n', '--dry-run',
+                        help='report which requests would be changed, without changing them',
+                        action='store_true')
+
+    parser.add_argument('-v', '--verbose',
+                        help='list each request changed',
+                        action='store_true')
+
+
+def selection_query(args):
+    """
+    Returns the RequestQuery for the arguments added by
+    add_selection_arguments.  At least one id or filter is required, so
+    that a mistyped command does not act on every request.
+    """
+    ids = None
+    if args.ids:
+        ids = [reqid for ids_list in args.ids for reqid in ids_list]
+
+    query = RequestQuery(users=args.user,
+                         request_types=args.type,
+                         ids=ids,
+                         min_id=args.min_id,
+                         max_id=args.max_id,
+                         since=args.since,
+                         until=args.until,
+                         path_prefix=args.path_prefix)
+
+    if (ids == None and args.user == None and args.type == None
+        and args.min_id == None and args.max_id == None
+        and args.since == None and args.until == None
+        and args.path_prefix == None):
+        raise ValueError("give request ids, or at least one filter")
+
+    return query
+
+
 def parse_args_withdraw(arg_list = None):
     
     parser = argparse.ArgumentParser(
         arg_list,
-        description='withdraw request to migrate/retrieve data')
+        description='withdraw requests to migrate/retrieve data')
 
     parser.add_argument('gws',
                         help='path to group workspace')
 
-    parser.add_argument('id',
-                        type=int,
-                        help='request id')
+    add_selection_arguments(parser)
 
     return parser.parse_args()
 
@@ -71,7 +172,8 @@ def parse_args_list(arg_list = None):
         description=('list migration and retrieval requests '))
 
     parser.add_argument('gws',
-                        help='path to group workspace')
+                        help='path to group workspace',
+                        nargs='+')
 
     parser.add_argument('-a', '--all-users',
                         help='show requests for all users',
@@ -85,6 +187,90 @@ def parse_args_list(arg_list = None):
                         help='only show requests with status NEW or SUBMITTED',
                         action='store_true')
 
+    filters = parser.add_argument_group('filters')
+
+    filters.add_argument('-u', '--user',
+                         help='only show requests for this user (may be repeated)',
+                         action='append')
+
+    filters.add_argument('-t', '--type',
+                         help='only show requests of this type (may be repeated)',
+                         choices=('migration', 'retrieval', 'deletion'),
+                         action='append')
+
+    filters.add_argument('-s', '--status',
+                         help='only show requests with this status (may be repeated)',
+                         choices=[status.name.lower() for status in all_statuses],
+                         action='append')
+
+    filters.add_argument('-i', '--id',
+                         help='only show the request with this id (may be repeated)',
+                         type=int,
+                         action='append')
+
+    filters.add_argument('--min-id',
+                         help='only show requests with at least this id',
+                         type=int)
+
+    filters.add_argument('--max-id',
+                         help='only show requests with at most this id',
+                         type=int)
+
+    filters.add_argument('--since',
+                         help='only show requests made on or after this date (YYYY-MM-DD)',
+                         type=parse_date)
+
+    filters.add_argument('--until',
+                         help='only show requests made on or before this date (YYYY-MM-DD)',
+                         type=parse_date)
+
+    filters.add_argument('-p', '--path-prefix',
+                         help='only show requests for paths under this directory')
+
+    filters.add_argument('-x', '--external-id',
+                         help='only show requests with this external ID (may be repeated)',
+                         action='append')
+
+    parser.add_argument('-f', '--format',
+                        help='output format (default: text)',
+                        choices=('text',) + RecordWriter.formats,
+                        default='text')
+
+    parser.add_argument('-j', '--jobs',
+                        help=('number of request files to read concurrently '
+                              '(default: {})').format(default_read_workers),
+                        type=int,
+                        default=default_read_workers)
+
+    parser.add_argument('-S', '--summary',
+                        help=('only show counts of requests, computed from the '
+                              'filenames without reading the request files'),
+                        action='store_true')
+
+    parser.add_argument('--no-service',
+                        help=('scan the request directories, even if a query '
+                              'service is running (see query-offline-requests-service)'),
+                        action='store_true')
+
+    follow = parser.add_argument_group('following changes')
+
+    follow.add_argument('-F', '--follow',
+                        help=('list matching requests, and then report status '
+                              'changes as they happen, until interrupted'),
+                        action='store_true')
+
+    follow.add_argument('--poll-interval',
+                        help=('when following, seconds between checks for changes '
+                              '(default: 5)'),
+                        type=float,
+                        default=5.0)
+
+    follow.add_argument('--no-inotify',
+                        help=('when following, compare directory listings rather '
+                              'than using inotify (needed to see changes made '
+                              'from other hosts on network filesystems)'),
+                        action='store_true')
+
     return parser.parse_args()
 
 
@@ -97,7 +283,14 @@ def create_migration_request(args):
 
     gws_root = gws.get_gws_root_from_path(args.directory)
     rm = RequestsManager(gws_root)
-    req = rm.create_migration_request({'path': args.directory})
+    params = {'path': args.directory}
+    if args.size:
+        size = measure_tree(args.directory)
+        size.check()
+        params.update(size.to_params())
+    if args.access:
+        params['access'] = args.access
+    req = rm.create_migration_request(params)
     print("created request")
     req.dump()
 
@@ -111,14 +304,26 @@ def create_retrieval_request(args):
         raise Exception("You cannot restore to a different Group Workspace.")
     
     dest_dir = args.dest_dir or args.orig_dir
-    if os.path.exists(dest_dir) and not (os.path.isdir(dest_dir) and not os.listdir(dest_dir)):
-        raise ValueError("destination directory {} exists and is not an empty directory"
-                         .format(dest_dir))
+    check_destination(dest_dir)
 
     rm = RequestsManager(gws_root)
 
-    req = rm.create_retrieval_request({'orig_path': args.orig_dir,
-                                       'new_path': args.dest_dir})
+    params = {'orig_path': args.orig_dir,
+              'new_path': args.dest_dir}
+
+    # reject a retrieval which could not fit even on its own (whether it
+    # fits alongside others is checked again when it is submitted), if the
+    # size was recorded by the migration - otherwise it is left to the
+    # handler, rather than reading the history or asking JDMA here
+    try:
+        size = rm.recorded_migration_bytes(args.orig_dir)
+    except OSError:
+        size = None
+    if size != None:
+        check_space(dest_dir, size)
+        params['expected_bytes'] = size
+
+    req = rm.create_retrieval_request(params)
     print("created request")
     req.dump()
 
@@ -134,26 +339,175 @@ def create_deletion_request(args):
 
 def withdraw_request(args):
 
+    query = selection_query(args)
     gws_root = gws.get_gws_root_from_path(args.gws)    
     rm = RequestsManager(gws_root)
-    rm.withdraw(args.id)
-    print("withdrew request id={}".format(args.id))
+    result = apply_bulk(rm, 'withdraw', query,
+                        dry_run=args.dry_run, verbose=args.verbose)
+    result.dump()
+
+    # ids given explicitly must all be withdrawn, as they used to be one
+    # at a time (ids in a range need not all exist, but those found must
+    # be withdrawn)
+    unchanged = []
+    if query.ids is not None:
+        handled = set(req.reqid for req in result.changed)
+        handled.update(req.reqid for req, _ in result.errors)  # reported above
+        expected = query.ids.ids.union(reqid for reqid in result.skipped_ids
+                                       if reqid in query.ids)
+        for reqid in sorted(expected - handled):
+            status = result.skipped_ids.get(reqid)
+            if status is None:
+                print(" error: no request with id {}".format(reqid))
+            else:
+                print((" error: request id={} not withdrawn: withdraw only supported "
+                       "for status NEW. Current status = {}").format(reqid, status.name))
+            unchanged.append(reqid)
+
+    if result.errors or unchanged:
+        sys.exit(1)
 
 
 def list_requests(args):
 
-    gws_root = gws.get_gws_root_from_path(args.gws)
+    gws_roots = [gws.get_gws_root_from_path(path) for path in args.gws]
 
     statuses = None
     if args.current:
         statuses = (RequestStatus.NEW, RequestStatus.SUBMITTED)
 
-    mgr = RequestsManager(gws_root)
-    for req in mgr.scan(all_users=args.all_users,
-                        statuses=statuses,
-                        include_archived=args.include_archived):
-        req.dump()
-    
+    query = RequestQuery(
+        users=args.user,
+        request_types=args.type,
+        statuses=(None if args.status == None else
+                  [RequestStatus[status.upper()] for status in args.status]),
+        ids=args.id,
+        min_id=args.min_id,
+        max_id=args.max_id,
+        since=args.since,
+        until=args.until,
+        path_prefix=args.path_prefix,
+        external_ids=args.external_id)
+
+    if args.summary:
+        summarise_requests(gws_roots, query, args)
+        return
+
+    if args.follow:
+        follow_requests(gws_roots, query, args)
+        return
+
+    writer = None
+    if args.format != 'text':
+        writer = RecordWriter(sys.stdout, args.format)
+
+    client = None if args.no_service else QueryClient()
+
+    for gws_root in gws_roots:
+        mgr = RequestsManager(gws_root)
+        reqs = None
+        if client:
+            reqs = _list_from_service(client, mgr, query, statuses, args)
+        if reqs == None:
+            reqs = mgr.select_with_content(query,
+                                           max_workers=args.jobs,
+                                           all_users=args.all_users,
+                                           statuses=statuses,
+                                           include_archived=args.include_archived)
+
+        for req, params in reqs:
+            if writer:
+                writer.write(req.to_record(params))
+            else:
+                req.dump(params)
+
+
+def _list_from_service(client, mgr, query, statuses, args):
+    """
+    Returns an iterable of (request, params) from the query service, or
+    None if the service cannot be used for this workspace.
+    """
+    if statuses != None:
+        query = copy.copy(query)
+        query.statuses = set(status for status in statuses
+                             if query.match_status(status))
+
+    replies = client.list_requests(
+        mgr.gws_root, query,
+        user=None if args.all_users else get_user_login_name(),
+        include_archived=args.include_archived)
+    try:
+        first = next(replies)
+    except StopIteration:
+        return []
+    except ServiceUnavailable:
+        return None
+
+    return ((mgr.make_request(filename, status, is_archived=is_archived), params)
+            for status, filename, is_archived, params
+            in itertools.chain([first], replies))
+
+
+def follow_requests(gws_roots, query, args):
+
+    if query.needs_content:
+        raise ValueError("--follow cannot be combined with filters "
+                         "on path or external ID")
+
+    if args.current:
+        query.statuses = set(status for status in (RequestStatus.NEW,
+                                                   RequestStatus.SUBMITTED)
+                             if query.match_status(status))
+
+    try:
+        follow([RequestsManager(gws_root) for gws_root in gws_roots],
+               query,
+               all_users=args.all_users,
+               interval=args.poll_interval,
+               use_inotify=not args.no_inotify)
+    except KeyboardInterrupt:
+        pass
+
+
+def summarise_requests(gws_roots, query, args):
+
+    if query.needs_content:
+        raise ValueError("--summary cannot be combined with filters "
+                         "on path or external ID")
+
+    if args.current:
+        query.statuses = set(status for status in (RequestStatus.NEW,
+                                                   RequestStatus.SUBMITTED)
+                             if query.match_status(status))
+
+    if query.users == None and not args.all_users:
+        query.users = set([get_user_login_name()])
+
+    if args.format not in ('text', 'jsonl'):
+        raise ValueError("--summary supports text and jsonl formats only")
+
+    for summary in _summaries(gws_roots, query, args):
+        if args.format == 'text':
+            summary.dump()
+        else:
+            print(json.dumps(summary.to_record()))
+
+
+def _summaries(gws_roots, query, args):
+    "summaries from the query service where possible, otherwise by scanning"
+    client = None if args.no_service else QueryClient()
+    for gws_root in gws_roots:
+        record = None
+        if client:
+            try:
+                record = client.summary_record(gws_root, query)
+            except ServiceUnavailable:
+                pass
+        if record != None:
+            yield WorkspaceSummary.from_record(record)
+        else:
+            for summary in summarise_workspaces([gws_root], query=query):
+                yield summary
 
 
 def common_wrapper(func, args):
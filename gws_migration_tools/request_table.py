@@ -0,0 +1,310 @@
+import datetime
+import collections
+from array import array
+from itertools import compress
+
+
+class _Interned(object):
+    "table of values, each stored once and referred to by an integer code"
+
+    def __init__(self):
+        self.values = []
+        self.codes = {}
+
+
+    def code(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+
+    def codes_of(self, values):
+        "set of the codes of those of the values which have one"
+        return set(self.codes[value] for value in values if value in self.codes)
+
+
+class RequestTable(object):
+    """
+    Compact, column-oriented table of requests, as found by scanning the
+    request directories.  Each request is a row, stored as numbers in
+    typed arrays: the id, the date (as an ordinal), whether it is
+    archived, and codes for the user, request type and status, which are
+    interned.  The filename is not stored, as it can be made from the
+    other columns.
+
+    Filtering (where), sorting (sorted_by_id) and counting work on whole
+    columns, through builtins (map, compress, sorted, Counter) rather
+    than a Python loop per row, and return new tables sharing the
+    interned values.  Rows become request objects only when asked for
+    (requests, or RequestHandle.to_request).
+    """
+
+    _columns = (('ids', 'q'), ('dates', 'l'), ('user_codes', 'l'),
+                ('type_codes', 'b'), ('status_codes', 'b'), ('archived', 'b'))
+
+    def __init__(self, requests_mgr, users=None, request_types=None,
+                 statuses=None):
+        self.requests_mgr = requests_mgr
+        self._users = users or _Interned()
+        self._types = request_types or _Interned()
+        self._statuses = statuses or _Interned()
+        for name, typecode in self._columns:
+            setattr(self, name, array(typecode))
+
+
+    @classmethod
+    def from_scan(cls, requests_mgr, statuses=None, include_archived=False):
+        """
+        Builds a table from the directory listings, parsing each filename
+        once.  No request file is opened.
+        """
+        requests_mgr._check_initialised()
+        return cls.from_entries(requests_mgr, requests_mgr.scan_filenames(
+            statuses, include_archived=include_archived))
+
+
+    @classmethod
+    def from_entries(cls, requests_mgr, entries):
+        """
+        Builds a table from an iterable of (status, filename, is_archived)
+        as yielded by RequestsManager.scan_filenames.  Filenames which
+        cannot be parsed are skipped.
+        """
+        table = cls(requests_mgr)
+        parse = requests_mgr._fn_matcher
+        user_code = table._users.code
+        type_code = table._types.code
+        status_code = table._statuses.code
+        date_ordinals = {}
+
+        for status, filename, is_archived in entries:
+            m = parse(filename)
+            if not m:
+                continue
+            user, request_type, reqid, year, month, day = m.groups()
+            ymd = (year, month, day)
+            ordinal = date_ordinals.get(ymd)
+            if ordinal is None:
+                ordinal = date_ordinals[ymd] = datetime.date(
+                    int(year), int(month), int(day)).toordinal()
+            table.ids.append(int(reqid))
+            table.dates.append(ordinal)
+            table.user_codes.append(user_code(user))
+            table.type_codes.append(type_code(request_type))
+            table.status_codes.append(status_code(status))
+            table.archived.append(is_archived)
+        return table
+
+
+    def __len__(self):
+        return len(self.ids)
+
+
+    def __iter__(self):
+        for index in range(len(self.ids)):
+            yield RequestHandle(self, index)
+
+
+    def __getitem__(self, index):
+        if not -len(self.ids) <= index < len(self.ids):
+            raise IndexError(index)
+        return RequestHandle(self, index % len(self.ids))
+
+
+    def take(self, indices):
+        "returns a new table holding the given rows, in the given order"
+        indices = list(indices)
+        table = RequestTable(self.requests_mgr, self._users, self._types,
+                             self._statuses)
+        for name, typecode in self._columns:
+            column = getattr(self, name)
+            setattr(table, name, array(typecode, map(column.__getitem__, indices)))
+        return table
+
+
+    def sorted_by_id(self):
+        ids = self.ids
+        return self.take(sorted(range(len(ids)), key=ids.__getitem__))
+
+
+    def where(self, query=None, users=None, request_types=None,
+              statuses=None, reqid=None, archived=None):
+        """
+        Returns a new table with the rows matching the filename-based
+        filters of a RequestQuery (if given) and of the other arguments
+        (users, request types and statuses as collections, a single id,
+        and True or False for archived rows only or unarchived rows only).
+        Each filter is applied to a whole column, to the rows which have
+        passed the filters before it, with users, request types and
+        statuses compared as their integer codes.
+        """
+        rows = range(len(self.ids))
+
+        def restrict(column, accept):
+            return list(compress(rows, map(accept, map(column.__getitem__, rows))))
+
+        filters = []
+        if users is not None:
+            filters.append((self.user_codes, self._users.codes_of(users).__contains__))
+        if request_types is not None:
+            filters.append((self.type_codes,
+                            self._types.codes_of(request_types).__contains__))
+        if statuses is not None:
+            filters.append((self.status_codes,
+                            self._statuses.codes_of(statuses).__contains__))
+        if reqid is not None:
+            filters.append((self.ids, reqid.__eq__))
+        if archived is not None:
+            filters.append((self.archived, int(archived).__eq__))
+
+        if query is not None:
+            if query.users is not None:
+                filters.append((self.user_codes,
+                                self._users.codes_of(query.users).__contains__))
+            if query.request_types is not None:
+                filters.append((self.type_codes,
+                                self._types.codes_of(query.request_types).__contains__))
+            if query.statuses is not None:
+                filters.append((self.status_codes,
+                                self._statuses.codes_of(query.statuses).__contains__))
+            if query.ids is not None:
+                filters.append((self.ids, query.ids.__contains__))
+            if query.min_id is not None:
+                filters.append((self.ids, query.min_id.__le__))
+            if query.max_id is not None:
+                filters.append((self.ids, query.max_id.__ge__))
+            if query.since is not None:
+                filters.append((self.dates, query.since.toordinal().__le__))
+            if query.until is not None:
+                filters.append((self.dates, query.until.toordinal().__ge__))
+
+        for column, accept in filters:
+            rows = restrict(column, accept)
+        return self.take(rows)
+
+
+    def requests(self):
+        "list of the request objects for the rows, in table order"
+        return [handle.to_request() for handle in self]
+
+
+    def counts(self):
+        """
+        Returns a Counter of the number of rows keyed on
+        (status, request type, user).
+        """
+        counts = collections.Counter(zip(self.status_codes,
+                                         self.type_codes,
+                                         self.user_codes))
+        return collections.Counter(
+            dict(((self._statuses.values[status_code],
+                   self._types.values[type_code],
+                   self._users.values[user_code]), count)
+                 for (status_code, type_code, user_code), count in counts.items()))
+
+
+    def status_counts(self):
+        "Counter of the number of rows keyed on status"
+        return collections.Counter(dict(
+            (self._statuses.values[status_code], count)
+            for status_code, count in collections.Counter(self.status_codes).items()))
+
+
+    def oldest_dates(self):
+        "dict of the date of the oldest row keyed on status"
+        return dict((self._statuses.values[status_code],
+                     datetime.date.fromordinal(min(compress(
+                         self.dates, map(status_code.__eq__, self.status_codes)))))
+                    for status_code in set(self.status_codes))
+
+
+    def before(self, date):
+        "returns a new table with the rows dated before the given date"
+        rows = range(len(self.ids))
+        return self.take(compress(rows, map(date.toordinal().__gt__, self.dates)))
+
+
+    def archive_bucket_counts(self):
+        "dict of the number of archive subdirectories used keyed on status"
+        buckets = set(zip(self.status_codes,
+                          map(self.requests_mgr.get_archive_bucket, self.ids)))
+        return dict((self._statuses.values[status_code], count)
+                    for status_code, count in collections.Counter(
+                        status_code for status_code, _ in buckets).items())
+
+
+class RequestHandle(object):
+    """
+    Lightweight reference to one row of a RequestTable.  The request file
+    is read the first time params is used, and then kept.  to_request()
+    gives the full request object, e.g. to change its status.
+    """
+
+    __slots__ = ('table', 'index', '_params')
+
+    def __init__(self, table, index):
+        self.table = table
+        self.index = index
+        self._params = None
+
+
+    @property
+    def reqid(self):
+        return self.table.ids[self.index]
+
+
+    @property
+    def user(self):
+        return self.table._users.values[self.table.user_codes[self.index]]
+
+
+    @property
+    def request_type(self):
+        return self.table._types.values[self.table.type_codes[self.index]]
+
+
+    @property
+    def date(self):
+        return datetime.date.fromordinal(self.table.dates[self.index])
+
+
+    @property
+    def status(self):
+        return self.table._statuses.values[self.table.status_codes[self.index]]
+
+
+    @property
+    def is_archived(self):
+        return bool(self.table.archived[self.index])
+
+
+    @property
+    def filename(self):
+        return self.table.requests_mgr.make_filename(
+            self.user, self.request_type, self.reqid, self.date)
+
+
+    def to_request(self):
+        parsed = (self.user, self.request_type, self.reqid, self.date)
+        requests_mgr = self.table.requests_mgr
+        return requests_mgr.make_request(requests_mgr.make_filename(*parsed),
+                                         self.status,
+                                         is_archived=self.is_archived,
+                                         parsed=parsed)
+
+
+    @property
+    def params(self):
+        if self._params is None:
+            self._params = self.to_request().read()
+        return self._params
+
+
+    def __str__(self):
+        return '<{}{} request: user={} id={} date={} status={}>'.format(
+            ('archived ' if self.is_archived else ''),
+            self.request_type,
+            self.user, self.reqid, self.date,
+            self.status.name)
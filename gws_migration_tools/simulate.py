@@ -0,0 +1,878 @@
+import os
+import sys
+import json
+import time
+import math
+import random
+import shutil
+import argparse
+import tempfile
+import itertools
+import contextlib
+import collections
+
+import gws_migration_tools.jdma_iface as jdma_iface_module
+from gws_migration_tools import gws, checkpoint, lease, handle_requests, \
+    migration_request_lib
+from gws_migration_tools.migration_request_lib import \
+    RequestsManager, RequestStatus, default_read_workers, _request_class_map
+from gws_migration_tools.handle_requests import Submit, Monitor, handle_workspace
+from gws_migration_tools.lease import LeaseManager
+from gws_migration_tools.mock_jdma import MockJDMA
+from gws_migration_tools.query import RequestQuery, parse_date
+from gws_migration_tools.fleet import find_workspaces
+from gws_migration_tools.latency import request_latencies, _format_seconds
+from gws_migration_tools.util import percentile
+
+
+request_types = ('migration', 'retrieval', 'deletion')
+
+# statuses whose queue depths are reported
+queue_statuses = (RequestStatus.NEW, RequestStatus.SUBMITTED)
+
+active_statuses = (RequestStatus.NEW, RequestStatus.SUBMITTING,
+                   RequestStatus.SUBMITTED)
+
+# modules whose use of the time module is redirected to the virtual clock
+_clocked_modules = (migration_request_lib, handle_requests, checkpoint, lease,
+                    jdma_iface_module)
+
+# lease time-to-live for simulated workers: they never die, and lease files
+# have real modification times, which must not look expired in virtual time
+_worker_lease_ttl = 100 * 365 * 86400
+
+
+Arrival = collections.namedtuple('Arrival', 'time request_type user path')
+Arrival.__doc__ = """
+A request in a workload: seconds from the start of the workload, request
+type, user, and a key standing for the directory (e.g. 'p12'), so that
+requests about the same directory can be matched up.
+"""
+
+
+class VirtualClock(object):
+    """
+    Stands in for the time module in the modules used by the handler, so
+    that a simulation runs in virtual time.  The functions which use the
+    current time are replaced, and everything else is passed through.
+    """
+
+    def __init__(self, now=0.):
+        self.now = now
+
+
+    def time(self):
+        return self.now
+
+
+    def set(self, now):
+        self.now = now
+
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+    def sleep(self, seconds):
+        self.advance(seconds)
+
+
+    def ctime(self, secs=None):
+        return time.ctime(self.now if secs is None else secs)
+
+
+    def asctime(self, t=None):
+        return time.asctime(time.localtime(self.now) if t is None else t)
+
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+
+class SimulatedJDMA(MockJDMA):
+    """
+    MockJDMA in virtual time, called directly (see SimulatedJDMALib) rather
+    than over HTTP.  Each JDMA request takes a job time drawn from
+    job_times to complete, spread evenly over the stages for its type.
+    Directories migrated before the simulation can be added with
+    add_stored_batch.
+    """
+
+    def __init__(self, clock, job_times, failure_rate=0.0, seed=None):
+        MockJDMA.__init__(self, failure_rate=failure_rate, seed=seed)
+        self.clock = clock
+        self.job_times = job_times
+
+
+    def create_request(self, fields):
+        status_code, reply = MockJDMA.create_request(self, fields)
+        if status_code == 200:
+            req = self._requests[reply['request_id']]
+            req['created'] = self.clock.time()
+            req['job_time'] = self._random.choice(self.job_times)
+        return status_code, reply
+
+
+    def _request_stage(self, req):
+        names = self._stage_names[req['request_type']]
+        # the workers of a cycle are simulated one after another from the
+        # same start time, so a request can be checked "before" it was made
+        elapsed = max(0., self.clock.time() - req['created'])
+        if elapsed >= req['job_time']:
+            return 'FAILED' if req['will_fail'] else names[-1]
+        return names[int(elapsed / req['job_time'] * (len(names) - 1))]
+
+
+    def add_stored_batch(self, label, workspace, user=None):
+        with self._lock:
+            batch_id = self._next_batch_id
+            self._next_batch_id += 1
+            self._batches[batch_id] = {
+                'migration_id': batch_id,
+                'user': user,
+                'label': label,
+                'workspace': workspace,
+                'storage': 'elastictape',
+                'filelist': [label],
+                'state': 'ON_STORAGE',
+                }
+        return batch_id
+
+
+class _Response(object):
+
+    def __init__(self, status_code, fields):
+        self.status_code = status_code
+        self._fields = fields
+
+
+    def json(self):
+        return self._fields
+
+
+class SimulatedJDMALib(object):
+    """
+    Stands in for jdma_client.jdma_lib (as used by jdma_iface), passing
+    calls straight to a SimulatedJDMA.  Each call advances the clock by
+    call_time, is answered with HTTP 503 with probability error_rate, and
+    is counted by function name.
+    """
+
+    def __init__(self, jdma, clock, call_time=0.0, error_rate=0.0, seed=None):
+        self.jdma = jdma
+        self.clock = clock
+        self.call_time = call_time
+        self.error_rate = error_rate
+        self.calls = collections.Counter()
+        self._random = random.Random(seed)
+
+
+    def _call(self, name, func, fields):
+        self.calls[name] += 1
+        self.clock.advance(self.call_time)
+        if self.error_rate and self._random.random() < self.error_rate:
+            return _Response(503, {'error': 'simulated server error'})
+        return _Response(*func(fields))
+
+
+    def upload_files(self, name, filelist=None, request_type='PUT', storage=None,
+                     label=None, credentials=None, workspace=None):
+        return self._call('upload_files', self.jdma.create_request,
+                          {'request_type': request_type, 'name': name,
+                           'filelist': filelist, 'label': label,
+                           'workspace': workspace, 'storage': storage})
+
+
+    def download_files(self, name, batch_id=None, filelist=None, target_dir=None,
+                       credentials=None):
+        return self._call('download_files', self.jdma.create_request,
+                          {'request_type': 'GET', 'name': name,
+                           'migration_id': batch_id, 'target_dir': target_dir})
+
+
+    def delete_batch(self, name, batch_id, storage=None, credentials=None):
+        return self._call('delete_batch', self.jdma.create_request,
+                          {'request_type': 'DELETE', 'name': name,
+                           'migration_id': batch_id})
+
+
+    def get_batch(self, name, batch_id=None, workspace=None, label=None):
+        query = dict((key, value) for key, value in (('migration_id', batch_id),
+                                                     ('workspace', workspace),
+                                                     ('label', label))
+                     if value is not None)
+        return self._call('get_batch', self.jdma.get_batch, query)
+
+
+    def get_request(self, name, req_id=None):
+        query = {'name': name}
+        if req_id is not None:
+            query['request_id'] = req_id
+        return self._call('get_request', self.jdma.get_request, query)
+
+
+@contextlib.contextmanager
+def simulated_environment(clock, jdma_lib):
+    """
+    Context manager within which the handler code runs against the given
+    virtual clock and simulated jdma_lib.
+    """
+    saved_times = [(module, module.time) for module in _clocked_modules]
+    saved_lib = jdma_iface_module.jdma_lib
+    try:
+        for module in _clocked_modules:
+            module.time = clock
+        jdma_iface_module.jdma_lib = jdma_lib
+        yield
+    finally:
+        for module, saved_time in saved_times:
+            module.time = saved_time
+        jdma_iface_module.jdma_lib = saved_lib
+
+
+class Workload(object):
+    """
+    Requests to replay (a list of Arrival, in time order), with the JDMA
+    behaviour to simulate: the job times to draw from and the fraction of
+    JDMA requests which fail.  Saved as JSON lines: a header, then one line
+    per arrival.
+    """
+
+    def __init__(self, arrivals, job_times=None, failure_rate=None):
+        self.arrivals = sorted(arrivals)
+        self.job_times = job_times
+        self.failure_rate = failure_rate
+
+
+    @property
+    def duration(self):
+        return self.arrivals[-1].time if self.arrivals else 0.
+
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            f.write(json.dumps({'job_times': self.job_times,
+                                'failure_rate': self.failure_rate}) + '\n')
+            for arrival in self.arrivals:
+                f.write(json.dumps(arrival._asdict()) + '\n')
+
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            header = json.loads(f.readline())
+            arrivals = [Arrival(**json.loads(line)) for line in f if line.strip()]
+        return cls(arrivals, job_times=header.get('job_times'),
+                   failure_rate=header.get('failure_rate'))
+
+
+    @classmethod
+    def from_history(cls, gws_roots, query, max_workers=default_read_workers):
+        """
+        Builds a workload from the requests recorded in the given
+        workspaces, including archived ones, using their transition times.
+        Requests made before transitions were recorded are left out.  The
+        job times are the recorded times spent in SUBMITTED, and the
+        failure rate is the fraction of submitted requests which failed.
+        """
+        paths = {}
+        arrivals = []
+        job_times = []
+        outcomes = collections.Counter()
+        for gws_root in gws_roots:
+            reqs_mgr = RequestsManager(gws_root)
+            for req, params in reqs_mgr.select_with_content(query,
+                                                            max_workers=max_workers,
+                                                            all_users=True,
+                                                            include_archived=True):
+                transitions = req.get_transitions(params)
+                if not transitions:
+                    continue
+                path = params.get('path' if req.request_type == 'migration'
+                                  else 'orig_path')
+                key = paths.setdefault((gws_root, os.path.normpath(path)),
+                                       'p{}'.format(len(paths)))
+                arrivals.append(Arrival(transitions[0][1], req.request_type,
+                                        req.user, key))
+                job_times.extend(seconds for metric, seconds
+                                 in request_latencies(transitions)
+                                 if metric == RequestStatus.SUBMITTED.name)
+                for (status, _), (next_status, _) in zip(transitions,
+                                                         transitions[1:]):
+                    if status == RequestStatus.SUBMITTED:
+                        outcomes[next_status] += 1
+
+        start = min(arrival.time for arrival in arrivals) if arrivals else 0.
+        arrivals = [arrival._replace(time=arrival.time - start)
+                    for arrival in arrivals]
+        num_completed = sum(outcomes.values())
+        return cls(arrivals,
+                   job_times=job_times or None,
+                   failure_rate=(outcomes[RequestStatus.FAILED] / num_completed
+                                 if num_completed else None))
+
+
+    @classmethod
+    def synthetic(cls, rate, duration, mix, num_users, seed=None):
+        """
+        Builds a workload of requests arriving at random (a Poisson process)
+        at the given rate per hour for duration seconds, with request types
+        chosen in the given proportions (a list of (type, weight)) and
+        users chosen uniformly.  Retrievals and deletions are of
+        directories migrated before the workload starts, a different one
+        for each request.
+        """
+        rng = random.Random(seed)
+        total_weight = float(sum(weight for _, weight in mix))
+        arrivals = []
+        t = rng.expovariate(rate / 3600.)
+        for i in itertools.count():
+            if t >= duration:
+                break
+            x = rng.random() * total_weight
+            for request_type, weight in mix:
+                x -= weight
+                if x < 0:
+                    break
+            arrivals.append(Arrival(t, request_type,
+                                    'user{}'.format(rng.randrange(num_users) + 1),
+                                    'p{}'.format(i)))
+            t += rng.expovariate(rate / 3600.)
+        return cls(arrivals)
+
+
+class PollingPolicy(object):
+    """
+    Decides which SUBMITTED requests the handler checks with JDMA in a
+    cycle.  This one checks them all, as handle-offline-requests does.
+    """
+
+    name = 'every'
+
+    def __init__(self, min_age=0.):
+        self.min_age = min_age
+
+
+    def due(self, req, now):
+        return True
+
+
+    def _age(self, req, now):
+        "seconds since the request was submitted"
+        submitted = [when for status, when in req.get_transitions()
+                     if status == RequestStatus.SUBMITTED]
+        return now - submitted[-1] if submitted else None
+
+
+class MinAgePolicy(PollingPolicy):
+    "checks requests only once they were submitted at least min_age seconds ago"
+
+    name = 'min-age'
+
+    def due(self, req, now):
+        age = self._age(req, now)
+        return age is None or age >= self.min_age
+
+
+class BackoffPolicy(PollingPolicy):
+    """
+    As MinAgePolicy, and then checks a request again only when its age has
+    doubled since it was last checked.
+    """
+
+    name = 'backoff'
+
+    def __init__(self, min_age=0.):
+        PollingPolicy.__init__(self, min_age)
+        self._checked_at_age = {}  # reqid: age when last checked
+
+
+    def due(self, req, now):
+        age = self._age(req, now)
+        if age is None:
+            return True
+        if age < self.min_age:
+            return False
+        last_age = self._checked_at_age.get(req.reqid)
+        if last_age is not None and age < 2 * last_age:
+            return False
+        self._checked_at_age[req.reqid] = age
+        return True
+
+
+polling_policies = collections.OrderedDict(
+    (policy.name, policy) for policy in (PollingPolicy, MinAgePolicy, BackoffPolicy))
+
+
+def _monitor_action(policy, clock):
+    "the handler's Monitor action, checking only the requests the policy selects"
+
+    class PolicyMonitor(Monitor):
+
+        @staticmethod
+        def select(reqs, reqs_mgr, args):
+            now = clock.time()
+            return [req for req in reqs if policy.due(req, now)]
+
+    return PolicyMonitor
+
+
+Scenario = collections.namedtuple('Scenario', 'interval workers policy')
+
+
+class ScenarioResult(object):
+    """
+    What happened in one simulated scenario: handler runs, queue depths
+    (at each cron slot, including those with nothing to do), JDMA calls
+    and request latencies.
+    """
+
+    def __init__(self, scenario):
+        self.scenario = scenario
+        self.runs = []  # virtual duration of each handler run
+        self.overrun_slots = 0  # cron slots missed because a run was still going
+        self.num_slots = 0
+        self.queue_totals = collections.Counter()
+        self.queue_max = collections.Counter()
+        self.calls = collections.Counter()
+        self.sim_time = 0.
+        self.latencies = collections.defaultdict(list)  # metric: [seconds]
+        self.outcomes = collections.Counter()  # status name: number of requests
+
+
+    def sample_queues(self, counts, num_slots=1):
+        self.num_slots += num_slots
+        for status in queue_statuses:
+            self.queue_totals[status.name] += counts[status] * num_slots
+            self.queue_max[status.name] = max(self.queue_max[status.name],
+                                              counts[status])
+
+
+    def row(self):
+        hours = max(self.sim_time, 1e-9) / 3600.
+        row = collections.OrderedDict()
+        row['interval'] = self.scenario.interval
+        row['workers'] = self.scenario.workers
+        row['policy'] = self.scenario.policy
+        for status in (RequestStatus.DONE, RequestStatus.FAILED):
+            row[status.name.lower()] = self.outcomes[status.name]
+        row['unfinished'] = sum(self.outcomes[status.name]
+                                for status in active_statuses)
+        row['runs'] = len(self.runs)
+        row['overruns'] = self.overrun_slots
+        row['run_p90'] = percentile(sorted(self.runs), 90)
+        for status in queue_statuses:
+            name = status.name.lower()
+            row[name + '_mean'] = (self.queue_totals[status.name]
+                                   / float(max(self.num_slots, 1)))
+            row[name + '_max'] = self.queue_max[status.name]
+        row['calls_per_hour'] = sum(self.calls.values()) / hours
+        row['get_request_per_hour'] = self.calls['get_request'] / hours
+        for metric in ('NEW', 'end_to_end'):
+            values = sorted(self.latencies[metric])
+            for pct in (50, 90, 99):
+                row['{}_p{}'.format(metric.lower(), pct)] = percentile(values, pct)
+        return row
+
+
+class Simulation(object):
+    """
+    Replays a workload through RequestsManager and the handler's actions
+    (see handle_requests.handle_workspace) in a temporary workspace, with
+    a simulated JDMA in virtual time.
+
+    The handler is run from cron every interval seconds; a run still going
+    at the next slot makes cron skip it.  Several workers share the
+    requests as with handle-offline-requests --partition; they are run one
+    after another from the same start time, and the run ends when the
+    last of them finishes.  Each JDMA call takes call_time seconds, and
+    other handler work is taken to be instantaneous.
+    """
+
+    def __init__(self, workload, job_time=3600., failure_rate=0.0, call_time=0.5,
+                 error_rate=0.0, poll_min_age=600., horizon=7 * 86400,
+                 handler_args=None, seed=None):
+        self.workload = workload
+        self.job_times = workload.job_times or [job_time]
+        self.failure_rate = (workload.failure_rate if failure_rate is None
+                             else failure_rate) or 0.0
+        self.call_time = call_time
+        self.error_rate = error_rate
+        self.poll_min_age = poll_min_age
+        self.horizon = horizon
+        self.handler_args = handler_args or {}
+        self.seed = seed
+
+
+    def _handler_args(self):
+        "the handle-offline-requests options used by handle_workspace"
+        args = argparse.Namespace(max_transient_failures=3,
+                                  max_submitted=None,
+                                  max_submitted_per_user=None,
+                                  group_size=32,
+                                  debug=False)
+        vars(args).update(self.handler_args)
+        return args
+
+
+    def run(self, scenario):
+        clock = VirtualClock(time.time())
+        jdma = SimulatedJDMA(clock, self.job_times, failure_rate=self.failure_rate,
+                             seed=self.seed)
+        jdma_lib = SimulatedJDMALib(jdma, clock, call_time=self.call_time,
+                                    error_rate=self.error_rate, seed=self.seed)
+        gws_root = tempfile.mkdtemp(prefix='simulate_', dir='/tmp')
+        try:
+            with simulated_environment(clock, jdma_lib), \
+                    open(os.devnull, 'w') as devnull, \
+                    contextlib.redirect_stdout(devnull):
+                result = self._run(scenario, gws_root, clock, jdma)
+        finally:
+            shutil.rmtree(gws_root, ignore_errors=True)
+        result.calls = jdma_lib.calls
+        return result
+
+
+    def _run(self, scenario, gws_root, clock, jdma):
+        result = ScenarioResult(scenario)
+        base = clock.time()
+        reqs_mgr = RequestsManager(gws_root)
+        reqs_mgr.initialise()
+        data_dir = os.path.join(gws_root, 'data')
+        self._add_stored_batches(jdma, data_dir)
+
+        policy = polling_policies[scenario.policy](min_age=self.poll_min_age)
+        actions = [_monitor_action(policy, clock), Submit]
+        args = self._handler_args()
+        lease_mgrs = []
+        if scenario.workers > 1:
+            lease_mgrs = [LeaseManager(reqs_mgr, worker_id='worker{}'.format(i),
+                                       ttl=_worker_lease_ttl)
+                          for i in range(scenario.workers)]
+
+        arrivals = collections.deque(self.workload.arrivals)
+        end_time = self.workload.duration + self.horizon
+        slot = 0
+        while True:
+            start = slot * scenario.interval
+            while arrivals and arrivals[0].time <= start:
+                arrival = arrivals.popleft()
+                clock.set(base + arrival.time)
+                self._create_request(reqs_mgr, arrival, data_dir)
+            clock.set(base + start)
+
+            counts = collections.Counter(
+                status for status, _, _ in reqs_mgr.scan_filenames(active_statuses))
+            if not counts:
+                if not arrivals:
+                    break
+                # nothing to do until the next request arrives
+                next_slot = int(math.ceil(arrivals[0].time / scenario.interval))
+                result.sample_queues(counts, next_slot - slot)
+                slot = next_slot
+                continue
+            if start > end_time:
+                break
+            result.sample_queues(counts)
+
+            if lease_mgrs:
+                for lease_mgr in lease_mgrs:
+                    lease_mgr.heartbeat()
+                finish = start
+                for lease_mgr in lease_mgrs:
+                    clock.set(base + start)
+                    handle_workspace(reqs_mgr, actions, None, args, lease_mgr=lease_mgr)
+                    finish = max(finish, clock.time() - base)
+                for lease_mgr in lease_mgrs:
+                    lease_mgr.unregister()
+            else:
+                handle_workspace(reqs_mgr, actions, None, args)
+                finish = clock.time() - base
+            result.runs.append(finish - start)
+
+            next_slot = max(slot + 1, int(math.ceil(finish / scenario.interval)))
+            result.overrun_slots += next_slot - slot - 1
+            if next_slot - slot > 1:
+                result.sample_queues(counts, next_slot - slot - 1)
+            slot = next_slot
+
+        result.sim_time = slot * scenario.interval
+        for req, params in reqs_mgr.select_with_content(RequestQuery(),
+                                                        all_users=True):
+            result.outcomes[req.status.name] += 1
+            for metric, seconds in request_latencies(req.get_transitions(params)):
+                result.latencies[metric].append(seconds)
+        return result
+
+
+    def _add_stored_batches(self, jdma, data_dir):
+        "add the directories which are retrieved or deleted before being migrated"
+        workspace = os.path.basename(os.path.dirname(data_dir))
+        migrated = set()
+        for arrival in self.workload.arrivals:
+            if arrival.request_type == 'migration':
+                migrated.add(arrival.path)
+            elif arrival.path not in migrated:
+                migrated.add(arrival.path)
+                jdma.add_stored_batch(os.path.join(data_dir, arrival.path),
+                                      workspace, user=arrival.user)
+
+
+    def _create_request(self, reqs_mgr, arrival, data_dir):
+        path = os.path.join(data_dir, arrival.path)
+        if arrival.request_type == 'migration':
+            params = {'path': path}
+        elif arrival.request_type == 'retrieval':
+            params = {'orig_path': path, 'new_path': None}
+        else:
+            params = {'orig_path': path}
+        reqs_mgr.create_request(_request_class_map[arrival.request_type], params,
+                                user=arrival.user)
+
+
+def dump_results(results):
+    columns = list(results[0].row()) if results else []
+    rows = []
+    for result in results:
+        row = result.row()
+        rows.append([_format_value(key, row[key]) for key in columns])
+    widths = [max([len(key)] + [len(row[i]) for row in rows])
+              for i, key in enumerate(columns)]
+    for row in [columns] + rows:
+        print('  '.join(value.ljust(width)
+                        for value, width in zip(row, widths)).rstrip())
+
+
+def _format_value(key, value):
+    if value is None:
+        return '-'
+    if key in ('interval', 'run_p90') or key.endswith(('_p50', '_p90', '_p99')):
+        return _format_seconds(value)
+    if isinstance(value, float):
+        return '{:.1f}'.format(value)
+    return str(value)
+
+
+def _comma_list(convert):
+    def parse(value):
+        try:
+            return [convert(item) for item in value.split(',') if item]
+        except ValueError:
+            raise argparse.ArgumentTypeError('invalid list: {}'.format(value))
+    return parse
+
+
+def _parse_mix(value):
+    mix = []
+    for item in value.split(','):
+        request_type, _, weight = item.partition('=')
+        if request_type not in request_types:
+            raise argparse.ArgumentTypeError('unknown request type {}'.format(request_type))
+        try:
+            mix.append((request_type, float(weight or 1)))
+        except ValueError:
+            raise argparse.ArgumentTypeError('invalid weight {}'.format(weight))
+    return mix
+
+
+def parse_args(arg_list = None):
+
+    parser = argparse.ArgumentParser(
+        arg_list,
+        description=('simulate handling a workload of requests, replayed from the '
+                     'recorded history of group workspaces or generated at random, '
+                     'against a simulated JDMA in virtual time, and report queue '
+                     'depths, JDMA call rates and latencies for each combination '
+                     'of cron interval, number of workers and polling policy'))
+
+    source = parser.add_argument_group('workload')
+
+    source.add_argument('gws',
+                        help='replay the requests recorded in these group workspaces',
+                        nargs='*')
+
+    source.add_argument('--fleet',
+                        help=('replay the requests of all group workspaces for which '
+                              'migrations have been initialised'),
+                        action='store_true')
+
+    source.add_argument('-t', '--type',
+                        help='only replay requests of this type (may be repeated)',
+                        choices=request_types,
+                        action='append')
+
+    source.add_argument('--since',
+                        help='only replay requests made on or after this date (YYYY-MM-DD)',
+                        type=parse_date)
+
+    source.add_argument('--until',
+                        help='only replay requests made on or before this date (YYYY-MM-DD)',
+                        type=parse_date)
+
+    source.add_argument('--workload',
+                        help='replay a workload saved with --save-workload')
+
+    source.add_argument('--synthetic',
+                        help='generate requests at random (see --rate etc.)',
+                        action='store_true')
+
+    source.add_argument('--rate',
+                        help='synthetic requests per hour (default: 10)',
+                        type=float, default=10.)
+
+    source.add_argument('--duration',
+                        help='hours over which synthetic requests arrive (default: 24)',
+                        type=float, default=24.)
+
+    source.add_argument('--mix',
+                        help=('proportions of synthetic request types (default: '
+                              'migration=6,retrieval=3,deletion=1)'),
+                        type=_parse_mix,
+                        default=_parse_mix('migration=6,retrieval=3,deletion=1'))
+
+    source.add_argument('--users',
+                        help='number of users making synthetic requests (default: 5)',
+                        type=int, default=5)
+
+    source.add_argument('--save-workload',
+                        help='save the workload to this file, for later replay')
+
+    scenarios = parser.add_argument_group('scenarios (comma-separated lists, all '
+                                          'combinations are simulated)')
+
+    scenarios.add_argument('-i', '--interval',
+                           help='seconds between handler runs from cron (default: 600)',
+                           type=_comma_list(float), default=[600.])
+
+    scenarios.add_argument('-w', '--workers',
+                           help='number of workers sharing the requests (default: 1)',
+                           type=_comma_list(int), default=[1])
+
+    scenarios.add_argument('-p', '--poll',
+                           help=('policies for checking submitted requests, from {} '
+                                 '(default: every)').format(', '.join(polling_policies)),
+                           type=_comma_list(str), default=['every'])
+
+    scenarios.add_argument('--poll-min-age',
+                           help=('seconds after submission before a request is first '
+                                 'checked, with the min-age and backoff policies '
+                                 '(default: 600)'),
+                           type=float, default=600.)
+
+    scenarios.add_argument('--max-submitted',
+                           help='maximum number of requests in progress on JDMA',
+                           type=int)
+
+    scenarios.add_argument('--max-submitted-per-user',
+                           help='maximum number of requests in progress on JDMA per user',
+                           type=int)
+
+    jdma = parser.add_argument_group('simulated JDMA')
+
+    jdma.add_argument('--job-time',
+                      help=('seconds JDMA takes to complete a request (default: '
+                            'drawn from the recorded times in SUBMITTED, or 3600)'),
+                      type=float)
+
+    jdma.add_argument('--failure-rate',
+                      help=('fraction of JDMA requests which fail (default: as '
+                            'recorded, or 0)'),
+                      type=float)
+
+    jdma.add_argument('--error-rate',
+                      help='fraction of JDMA API calls answered with HTTP 503 (default: 0)',
+                      type=float, default=0.)
+
+    jdma.add_argument('--call-time',
+                      help='seconds taken by each JDMA API call (default: 0.5)',
+                      type=float, default=0.5)
+
+    parser.add_argument('--horizon',
+                        help=('hours to carry on simulating after the last request '
+                              'arrives (default: 168)'),
+                        type=float, default=168.)
+
+    parser.add_argument('--seed',
+                        help='random seed, the same for every scenario (default: 1)',
+                        type=int, default=1)
+
+    parser.add_argument('-f', '--format',
+                        help='output format (default: text)',
+                        choices=('text', 'jsonl'),
+                        default='text')
+
+    parser.add_argument('-j', '--jobs',
+                        help=('number of request files to read concurrently from the '
+                              'recorded history (default: {})').format(default_read_workers),
+                        type=int,
+                        default=default_read_workers)
+
+    args = parser.parse_args()
+
+    num_sources = sum(map(bool, [args.gws or args.fleet, args.workload, args.synthetic]))
+    if num_sources != 1:
+        parser.error('give exactly one workload: group workspaces (or --fleet), '
+                     '--workload or --synthetic')
+
+    for policy in args.poll:
+        if policy not in polling_policies:
+            parser.error('unknown polling policy {}'.format(policy))
+
+    return args
+
+
+def main():
+
+    args = parse_args()
+
+    if args.workload:
+        workload = Workload.load(args.workload)
+    elif args.synthetic:
+        workload = Workload.synthetic(args.rate, args.duration * 3600, args.mix,
+                                      args.users, seed=args.seed)
+    else:
+        gws_roots = [gws.get_gws_root_from_path(path) for path in args.gws]
+        if args.fleet:
+            gws_roots.extend(gws_root for gws_root in find_workspaces()
+                             if gws_root not in gws_roots)
+        query = RequestQuery(request_types=args.type,
+                             since=args.since,
+                             until=args.until)
+        workload = Workload.from_history(gws_roots, query, max_workers=args.jobs)
+
+    if args.save_workload:
+        workload.save(args.save_workload)
+
+    if args.job_time is not None:
+        workload.job_times = None
+
+    # the simulated workspaces are under /tmp
+    os.environ['_USE_TEST_GWS'] = '1'
+
+    simulation = Simulation(workload,
+                            job_time=args.job_time or 3600.,
+                            failure_rate=args.failure_rate,
+                            call_time=args.call_time,
+                            error_rate=args.error_rate,
+                            poll_min_age=args.poll_min_age,
+                            horizon=args.horizon * 3600,
+                            handler_args={
+                                'max_submitted': args.max_submitted,
+                                'max_submitted_per_user': args.max_submitted_per_user},
+                            seed=args.seed)
+
+    if args.format == 'text':
+        print('{} requests over {}'.format(len(workload.arrivals),
+                                           _format_seconds(workload.duration)))
+
+    results = []
+    for interval, workers, policy in itertools.product(args.interval, args.workers,
+                                                       args.poll):
+        result = simulation.run(Scenario(interval, workers, policy))
+        results.append(result)
+        if args.format == 'jsonl':
+            print(json.dumps(result.row()))
+            sys.stdout.flush()
+
+    if args.format == 'text':
+        dump_results(results)
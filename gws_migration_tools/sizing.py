@@ -0,0 +1,314 @@
+import os
+import stat
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+# default number of threads used to walk a directory tree
+default_walk_workers = 16
+
+
+class TreeSize(object):
+    """
+    Result of measuring a directory tree.  Files with several hard links
+    inside the tree are only counted once.  Symbolic links are not
+    followed, and are not counted.  Paths which could not be looked at
+    (directories which could not be listed, or entries which could not be
+    stat'ed) are listed in error_paths, and are not counted.
+    """
+
+    def __init__(self):
+        self.file_count = 0
+        self.total_bytes = 0
+        self.dir_count = 0
+        self.error_paths = []
+
+
+    @property
+    def errors(self):
+        return len(self.error_paths)
+
+
+    def check(self):
+        "raises UnreadableTree if any part of the tree could not be measured"
+        if self.error_paths:
+            raise UnreadableTree(self.error_paths)
+
+
+    def to_params(self):
+        "the request parameters in which the size is recorded"
+        return {'file_count': self.file_count,
+                'total_bytes': self.total_bytes}
+
+
+    def __repr__(self):
+        return '<TreeSize files={} bytes={} dirs={} errors={}>'.format(
+            self.file_count, self.total_bytes, self.dir_count, self.errors)
+
+
+class UnreadableTree(Exception):
+    """
+    Raised by TreeSize.check if parts of a tree could not be measured, so
+    that its size (and any migration of it) would be incomplete.
+    """
+
+    # number of the paths given in the message
+    max_shown = 5
+
+    def __init__(self, error_paths):
+        self.error_paths = error_paths
+
+
+    def __str__(self):
+        shown = ', '.join(sorted(self.error_paths)[:self.max_shown])
+        if len(self.error_paths) > self.max_shown:
+            shown += ' and {} more'.format(len(self.error_paths) - self.max_shown)
+        return 'could not read {} path(s): {}'.format(len(self.error_paths), shown)
+
+
+def _scan_one_dir(path):
+    """
+    Lists one directory, returning (subdirs, files, error_paths) where
+    files is a list of (dev, inode, nlink, size).
+    """
+    subdirs = []
+    files = []
+    error_paths = []
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    st = entry.stat(follow_symlinks=False)
+                except OSError:
+                    error_paths.append(entry.path)
+                    continue
+                if stat.S_ISDIR(st.st_mode):
+                    subdirs.append(entry.path)
+                elif stat.S_ISREG(st.st_mode):
+                    files.append((st.st_dev, st.st_ino, st.st_nlink, st.st_size))
+    except OSError:
+        error_paths.append(path)
+    return subdirs, files, error_paths
+
+
+def measure_tree(path, max_workers=default_walk_workers):
+    """
+    Returns a TreeSize for the file or directory tree at the given path.
+    Directories are listed concurrently by a pool of threads, as on
+    parallel filesystems the time is dominated by metadata latency rather
+    than by CPU.
+    """
+    result = TreeSize()
+    seen_inodes = set()
+
+    def add_files(files):
+        for dev, ino, nlink, size in files:
+            if nlink > 1:
+                if (dev, ino) in seen_inodes:
+                    continue
+                seen_inodes.add((dev, ino))
+            result.file_count += 1
+            result.total_bytes += size
+
+    st = os.stat(path)
+    if not stat.S_ISDIR(st.st_mode):
+        add_files([(st.st_dev, st.st_ino, st.st_nlink, st.st_size)])
+        return result
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = set([executor.submit(_scan_one_dir, path)])
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                subdirs, files, error_paths = future.result()
+                result.dir_count += 1
+                result.error_paths.extend(error_paths)
+                add_files(files)
+                for subdir in subdirs:
+                    pending.add(executor.submit(_scan_one_dir, subdir))
+
+    return result
+
+
+def split_tree(path, part_bytes, max_parts=64, max_depth=4,
+               max_workers=default_walk_workers):
+    """
+    Divides the tree under a directory into parts of roughly equal total
+    size, for migrating as separate batches.  Returns (parts, split_dirs),
+    where parts is a list of parts, each a list of paths (files or
+    directories) under the directory, and split_dirs lists the
+    directories whose entries were divided between parts, so which no
+    part holds as a whole (see dir_attributes).
+
+    The number of parts is the total size divided by part_bytes (rounded
+    up), but at most max_parts.  The tree is walked once (see
+    _walk_tree), and any entry of the directory which is too big to fit
+    in one part is replaced by its own entries (down to max_depth
+    levels).  Every other entry, including empty directories, is kept.
+    The entries are then allotted to parts largest first, each going to
+    the part which is smallest so far.  If the tree is not bigger than
+    part_bytes, the result is a single part holding the directory itself.
+    """
+    totals, entries = _walk_tree(path, max_depth, max_workers)
+    num_parts = min(max_parts, -(-totals[path] // part_bytes))
+    if num_parts <= 1:
+        return [[path]], []
+
+    target = totals[path] / num_parts
+    items = entries[path]
+    split_dirs = [path]
+    for depth in range(1, max_depth):
+        too_big = set(subpath for size, subpath, is_dir in items
+                      if is_dir and size > target and entries.get(subpath))
+        if not too_big:
+            break
+        items = [item for item in items if item[1] not in too_big]
+        for subpath in sorted(too_big):
+            items.extend(entries[subpath])
+            split_dirs.append(subpath)
+
+    parts = [[0, []] for _ in range(num_parts)]
+    for size, subpath, _ in sorted(items, reverse=True):
+        part = min(parts, key=lambda part: part[0])
+        part[0] += size
+        part[1].append(subpath)
+    return [sorted(paths) for _, paths in parts if paths], split_dirs
+
+
+def _scan_dir_entries(path, depth, keep_entries):
+    """
+    Lists one directory for _walk_tree, returning (path, depth, subdirs,
+    files, others, error) where files is a list of (dev, inode, nlink,
+    size, path) and others lists the paths of entries which are neither
+    directories nor regular files (only if keep_entries).
+    """
+    subdirs = []
+    files = []
+    others = []
+    try:
+        with os.scandir(path) as dir_entries:
+            for entry in dir_entries:
+                try:
+                    st = entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+                if stat.S_ISDIR(st.st_mode):
+                    subdirs.append(entry.path)
+                elif stat.S_ISREG(st.st_mode):
+                    files.append((st.st_dev, st.st_ino, st.st_nlink, st.st_size,
+                                  entry.path))
+                elif keep_entries:
+                    others.append(entry.path)
+    except OSError:
+        return path, depth, subdirs, files, others, True
+    return path, depth, subdirs, files, others, False
+
+
+def _walk_tree(path, max_depth, max_workers):
+    """
+    Walks the tree under a directory once (concurrently, as measure_tree
+    does), returning (totals, entries): totals maps every directory to
+    the total size of its tree, and entries maps each directory less than
+    max_depth levels down to a list of (total bytes, path, is_dir) for its
+    entries.  Files with several hard links are counted once; symbolic
+    links and other special files are entries with zero size.
+    """
+    own_bytes = {}
+    children = {}
+    depths = {}
+    files_of = {}
+    others_of = {}
+    seen_inodes = set()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = set([executor.submit(_scan_dir_entries, path, 0, max_depth > 0)])
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                dirpath, depth, subdirs, files, others, _ = future.result()
+                size = 0
+                kept = []
+                for dev, ino, nlink, file_size, file_path in files:
+                    if nlink > 1:
+                        if (dev, ino) in seen_inodes:
+                            file_size = 0
+                        else:
+                            seen_inodes.add((dev, ino))
+                    size += file_size
+                    kept.append((file_size, file_path, False))
+                own_bytes[dirpath] = size
+                children[dirpath] = subdirs
+                depths[dirpath] = depth
+                if depth < max_depth:
+                    files_of[dirpath] = kept
+                    others_of[dirpath] = others
+                for subdir in subdirs:
+                    pending.add(executor.submit(_scan_dir_entries, subdir,
+                                                depth + 1, depth + 1 < max_depth))
+
+    totals = dict(own_bytes)
+    for dirpath in sorted(depths, key=depths.get, reverse=True):
+        for subdir in children[dirpath]:
+            totals[dirpath] += totals[subdir]
+
+    entries = {}
+    for dirpath, kept in files_of.items():
+        entries[dirpath] = (kept
+                            + [(totals[subdir], subdir, True)
+                               for subdir in children[dirpath]]
+                            + [(0, other, False) for other in others_of[dirpath]])
+    return totals, entries
+
+
+def dir_attributes(paths, root):
+    """
+    Returns the mode and modification time of each of the directories,
+    as a dictionary keyed on their paths relative to root, for
+    restore_dir_attributes.
+    """
+    attrs = {}
+    for path in paths:
+        st = os.stat(path)
+        attrs[os.path.relpath(path, root)] = [stat.S_IMODE(st.st_mode), st.st_mtime]
+    return attrs
+
+
+def restore_dir_attributes(attrs, root):
+    """
+    Sets the modes and modification times recorded by dir_attributes on
+    the directories under root (e.g. after the tree has been retrieved
+    elsewhere).  Directories which cannot be set (e.g. not retrieved) are
+    skipped; returns the number which were set.
+    """
+    num_set = 0
+    for relpath, (mode, mtime) in attrs.items():
+        path = os.path.normpath(os.path.join(root, relpath))
+        try:
+            os.chmod(path, mode)
+            os.utime(path, (mtime, mtime))
+        except OSError:
+            continue
+        num_set += 1
+    return num_set
+
+
+def parse_size(s):
+    "parse a size given on the command line, e.g. 500G or 10T (binary units)"
+    units = {'K': 1, 'M': 2, 'G': 3, 'T': 4, 'P': 5}
+    s = s.strip().upper().rstrip('IB')
+    if s and s[-1] in units:
+        return int(float(s[:-1]) * 1024 ** units[s[-1]])
+    return int(s)
+
+
+def format_bytes(num_bytes):
+    "human-readable size"
+    size = float(num_bytes)
+    for unit in ('B', 'KiB', 'MiB', 'GiB', 'TiB'):
+        if size < 1024:
+            break
+        size /= 1024
+    else:
+        unit = 'PiB'
+    if unit == 'B':
+        return '{} B'.format(num_bytes)
+    return '{:.1f} {}'.format(size, unit)
@@ -0,0 +1,108 @@
+import os
+import json
+
+from gws_migration_tools.sizing import format_bytes
+
+
+# JDMA storage backends which migrations can be sent to
+storage_backends = ('elastictape', 'objectstore')
+
+# how often the data of a migration is expected to be retrieved (given when
+# requesting a migration)
+access_patterns = ('frequent', 'rare')
+
+
+class StoragePolicy(object):
+    """
+    Chooses the JDMA storage backend for each migration in a workspace,
+    from the size of the directory and how often it is expected to be
+    retrieved.
+
+    Directories of at most small_bytes go to small_storage if they are
+    expected to be retrieved often, and everything else goes to
+    default_storage.  A directory is expected to be retrieved often if
+    the migration request says so, or (unless it says it will be rarely
+    retrieved) if the path has already been retrieved at least
+    frequent_retrievals times; with frequent_retrievals of None, every
+    small directory is, unless the request says otherwise.  With
+    small_bytes of None, everything goes to default_storage.
+
+    Kept as a small JSON file in the .mngr directory (see init-migrations).
+    """
+
+    _file = '.storage_policy'
+
+    _fields = ('default_storage', 'small_storage', 'small_bytes',
+               'frequent_retrievals')
+
+    def __init__(self, default_storage='elastictape', small_storage='objectstore',
+                 small_bytes=None, frequent_retrievals=None):
+        for storage in (default_storage, small_storage):
+            if storage not in storage_backends:
+                raise ValueError("unknown storage backend {}".format(storage))
+        self.default_storage = default_storage
+        self.small_storage = small_storage
+        self.small_bytes = small_bytes
+        self.frequent_retrievals = frequent_retrievals
+
+
+    @classmethod
+    def _path(cls, reqs_mgr):
+        return os.path.join(reqs_mgr.base_dir, cls._file)
+
+
+    @classmethod
+    def load(cls, reqs_mgr):
+        "the policy of a workspace (the default policy if none has been set)"
+        try:
+            with open(cls._path(reqs_mgr)) as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return cls()
+        return cls(**dict((key, state[key]) for key in cls._fields if key in state))
+
+
+    def save(self, reqs_mgr):
+        path = self._path(reqs_mgr)
+        tmp_path = os.path.join(os.path.dirname(path),
+                                '.tmp_' + os.path.basename(path))
+        with open(tmp_path, 'w') as f:
+            json.dump(dict((key, getattr(self, key)) for key in self._fields), f)
+        os.chmod(tmp_path, 0o644)
+        os.rename(tmp_path, path)
+
+
+    @property
+    def needs_size(self):
+        "True if the size of a directory is needed to choose its backend"
+        return self.small_bytes != None and self.small_storage != self.default_storage
+
+
+    def choose(self, total_bytes, access=None, count_retrievals=None):
+        """
+        Returns the backend for a directory of total_bytes (which must be
+        known if needs_size), given the access pattern in the request (or
+        None) and a function returning the number of earlier retrievals of
+        the path (only called if needed).
+        """
+        if not self.needs_size or total_bytes > self.small_bytes:
+            return self.default_storage
+        if access == None and self.frequent_retrievals != None:
+            if count_retrievals and count_retrievals() >= self.frequent_retrievals:
+                access = 'frequent'
+        if access == 'frequent' or (access == None and self.frequent_retrievals == None):
+            return self.small_storage
+        return self.default_storage
+
+
+    def __str__(self):
+        if not self.needs_size:
+            return "all migrations to {}".format(self.default_storage)
+        if self.frequent_retrievals == None:
+            expected = "unless requested as rarely retrieved"
+        else:
+            expected = ("if requested as frequently retrieved, or already "
+                        "retrieved at least {} times".format(self.frequent_retrievals))
+        return ("directories of up to {} to {} {}, others to {}"
+                .format(format_bytes(self.small_bytes), self.small_storage,
+                        expected, self.default_storage))
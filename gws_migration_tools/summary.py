@@ -0,0 +1,184 @@
+import datetime
+import collections
+
+from gws_migration_tools.migration_request_lib import \
+    RequestsManager, RequestStatus, all_statuses
+from gws_migration_tools.request_table import RequestTable
+
+
+# statuses for which the age of the oldest request is reported
+age_statuses = [RequestStatus.NEW, RequestStatus.SUBMITTED]
+
+# statuses in which a request can be stuck
+in_progress_statuses = [RequestStatus.NEW, RequestStatus.SUBMITTING,
+                        RequestStatus.SUBMITTED]
+
+
+class WorkspaceSummary(object):
+    """
+    Request counts for one group workspace.
+
+    counts: number of unarchived requests keyed on (status, request type, user)
+    oldest: date of the oldest unarchived request for each status in
+            age_statuses (if there are any)
+    archived: number of archived requests keyed on status
+    archive_buckets: number of archive subdirectories keyed on status
+    stale: number of unfinished requests made before the stale_before date
+           keyed on status (only if a stale_before date is given)
+    """
+
+    def __init__(self, gws_root, today=None, stale_before=None):
+        self.gws_root = gws_root
+        self.today = today or datetime.date.today()
+        self.stale_before = stale_before
+        self.counts = collections.Counter()
+        self.oldest = {}
+        self.archived = collections.Counter()
+        self.archive_buckets = {}
+        self.stale = collections.Counter()
+
+
+    def count_for_status(self, status):
+        return sum(count for (count_status, _, _), count in self.counts.items()
+                   if count_status == status)
+
+
+    def age_days(self, status):
+        date = self.oldest.get(status)
+        if date is None:
+            return None
+        return (self.today - date).days
+
+
+    @classmethod
+    def from_record(cls, record, today=None):
+        """
+        Rebuilds a summary from the output of to_record (e.g. as received
+        from the query service), apart from stale_before.
+        """
+        summary = cls(record['gws'], today=today)
+        for item in record['counts']:
+            summary.counts[(RequestStatus[item['status']],
+                            item['request_type'],
+                            item['user'])] = item['count']
+        for name, age in record['oldest_age_days'].items():
+            if age is not None:
+                summary.oldest[RequestStatus[name]] = \
+                    summary.today - datetime.timedelta(days=age)
+        for name, count in record['archived'].items():
+            summary.archived[RequestStatus[name]] = count
+        for name, num in record['archive_buckets'].items():
+            summary.archive_buckets[RequestStatus[name]] = num
+        for name, count in record['stale'].items():
+            summary.stale[RequestStatus[name]] = count
+        return summary
+
+
+    @property
+    def total(self):
+        return sum(self.counts.values())
+
+
+    def to_record(self):
+        return {
+            'gws': self.gws_root,
+            'counts': [{'status': status.name,
+                        'request_type': request_type,
+                        'user': user,
+                        'count': count}
+                       for (status, request_type, user), count
+                       in sorted(self.counts.items(), key=_count_sort_key)],
+            'oldest_age_days': dict((status.name, self.age_days(status))
+                                    for status in age_statuses),
+            'archived': dict((status.name, self.archived[status])
+                             for status in all_statuses
+                             if self.archived[status]),
+            'archive_buckets': dict((status.name, num)
+                                    for status, num
+                                    in self.archive_buckets.items()),
+            'stale': dict((status.name, self.stale[status])
+                          for status in in_progress_statuses
+                          if self.stale[status]),
+            }
+
+
+    def dump(self):
+        print('<summary of {}>'.format(self.gws_root))
+        if not self.counts:
+            print(' no current requests')
+        for (status, request_type, user), count in \
+                sorted(self.counts.items(), key=_count_sort_key):
+            print(' {:<10} {:<9} {:<16} {:>8}'.format(
+                status.name, request_type, user, count))
+        for status in age_statuses:
+            age = self.age_days(status)
+            if age is not None:
+                print(' oldest {} request: {} days'.format(status.name, age))
+        for status in all_statuses:
+            if self.archived[status]:
+                print(' archived {}: {} requests in {} directories'.format(
+                    status.name, self.archived[status],
+                    self.archive_buckets[status]))
+        for status in in_progress_statuses:
+            if self.stale[status]:
+                print(' {} {} requests made before {}'.format(
+                    self.stale[status], status.name, self.stale_before))
+        print('')
+
+
+def _count_sort_key(item):
+    (status, request_type, user), _ = item
+    return (status.value, request_type, user)
+
+
+def summarise(mgr, query=None, today=None, stale_before=None,
+              include_archived=True):
+    """
+    Returns a WorkspaceSummary for the requests managed by a RequestsManager.
+    This uses only the directory listings and the information encoded in
+    the filenames - no request file is opened.  An optional RequestQuery
+    restricts the requests counted; only its filename-based filters are used.
+    Counting the archived requests means walking the whole archive, so
+    with include_archived False they are left out (archived and
+    archive_buckets are then empty).
+    """
+    mgr._check_initialised()
+    return summarise_entries(mgr, mgr.scan_filenames(include_archived=include_archived),
+                             query=query, today=today,
+                             stale_before=stale_before)
+
+
+def summarise_entries(mgr, entries, query=None, today=None, stale_before=None):
+    """
+    As summarise(), but from an iterable of (status, filename, is_archived)
+    as yielded by RequestsManager.scan_filenames, rather than scanning.
+    The entries are loaded into a RequestTable, and counted a column at a
+    time.
+    """
+    summary = WorkspaceSummary(mgr.gws_root, today=today,
+                               stale_before=stale_before)
+    table = RequestTable.from_entries(mgr, entries)
+    if query is not None:
+        table = table.where(query=query)
+
+    archived = table.where(archived=True)
+    summary.archived.update(archived.status_counts())
+    summary.archive_buckets.update(archived.archive_bucket_counts())
+
+    current = table.where(archived=False)
+    summary.counts.update(current.counts())
+    summary.oldest.update(current.where(statuses=age_statuses).oldest_dates())
+    if stale_before is not None:
+        summary.stale.update(current.where(statuses=in_progress_statuses)
+                             .before(stale_before).status_counts())
+
+    return summary
+
+
+def summarise_workspaces(gws_roots, query=None, today=None):
+    """
+    Iterable which yields a WorkspaceSummary for each of several group
+    workspaces.
+    """
+    for gws_root in gws_roots:
+        yield summarise(RequestsManager(gws_root), query=query, today=today)
@@ -1,5 +1,6 @@
 import os
 import pwd
+import math
 import sys
 import traceback
 
@@ -16,6 +17,17 @@ def ensure_parent_dir_exists(path):
         os.mkdir(parent)
     
 
+def percentile(sorted_values, pct):
+    """
+    Returns the given percentile (0-100) of a sorted list of numbers, 
+    by the nearest-rank method, or None if the list is empty.
+    """
+    if not sorted_values:
+        return None
+    rank = int(math.ceil(pct / 100. * len(sorted_values)))
+    return sorted_values[max(rank, 1) - 1]
+
+
 def get_traceback():
     exc, msg, tb = sys.exc_info()
     if exc:
@@ -0,0 +1,205 @@
+import os
+import time
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+
+# how hard to try to make request file updates survive a crash:
+#   none: no fsync - the update may be lost, or leave an empty file,
+#         if the host crashes soon after it
+#   data: fsync each file before renaming it into place, so that a file
+#         never appears with incomplete content
+#   full: as data, and also fsync each directory after the renames, so
+#         that they are durable too
+durability_levels = ('none', 'data', 'full')
+
+# number of threads used to fsync the files of a group
+fsync_workers = 8
+
+
+def _make_tmp_path(path):
+    dirname = os.path.dirname(path)
+    filename = os.path.basename(path)
+    return os.path.join(dirname, '.tmp_' + filename)
+
+
+def _is_tmp_path(path):
+    # path may be the full path or just the filename
+    return os.path.basename(path).startswith('.tmp_')
+
+
+class RequestWriter(object):
+    """
+    Writes request files (via a temporary file, renamed into place) with
+    a given durability level.
+
+    Within a group (see RequestsManager.group_commit), updates to existing
+    request files are held in memory and written together when the group
+    is committed: all the temporary files are written, then fsynced
+    (concurrently), then renamed, and then each directory is fsynced once.
+    Reads of a request with a pending update see the pending content, and
+    actions to be done after the update is on disk (such as journal
+    records) can be deferred until the commit.  Updates are held only
+    until max_pending of them are waiting, so that not too much is lost
+    if the process is killed.  A file with a pending update must be
+    flushed before it is renamed (e.g. to a new status directory), so
+    that it never appears under its new name without the updates made
+    before the move.
+    """
+
+    def __init__(self, durability='none'):
+        if durability not in durability_levels:
+            raise ValueError("unknown durability level {}".format(durability))
+        self.durability = durability
+        self.max_pending = None
+        self._pending = collections.OrderedDict()  # path: content
+        self._deferred = []
+        self._depth = 0
+
+
+    @property
+    def grouping(self):
+        return self._depth > 0
+
+
+    def begin(self, max_pending=None):
+        if self._depth == 0:
+            self.max_pending = max_pending
+        self._depth += 1
+
+
+    def end(self):
+        self._depth -= 1
+        if self._depth == 0:
+            self.commit()
+
+
+    def write(self, path, content):
+        # new files are always written at once, so that other processes
+        # which are told about them (e.g. by the journal) can read them
+        if self.grouping and (path in self._pending or os.path.exists(path)):
+            self._pending[path] = content
+            if self.max_pending and len(self._pending) >= self.max_pending:
+                self.commit()
+        else:
+            self._write_files([(path, content)], check_exists=False)
+
+
+    def pending_content(self, path):
+        "content of a pending update to the file, or None"
+        return self._pending.get(path)
+
+
+    def flush(self, path):
+        """
+        write the pending updates now if one of them is to the file (all
+        of them, so that deferred journal records stay in order)
+        """
+        if path in self._pending:
+            self.commit()
+
+
+    def defer(self, func):
+        "call func after the pending updates are on disk (at once if not grouping)"
+        if self.grouping and self._pending:
+            self._deferred.append(func)
+        else:
+            func()
+
+
+    def commit(self):
+        """
+        Writes the pending updates, and then calls the deferred actions.
+        If the write fails, the updates and the deferred actions are both
+        dropped (the actions describe updates which did not happen), and
+        the error is raised.
+        """
+        items = list(self._pending.items())
+        deferred = self._deferred
+        self._pending = collections.OrderedDict()
+        self._deferred = []
+        self._write_files(items, check_exists=True)
+        for func in deferred:
+            func()
+
+
+    def _write_files(self, items, check_exists):
+        staged = []
+        try:
+            for path, content in items:
+                tmp_path = _make_tmp_path(path)
+                staged.append((tmp_path, path))
+                with open(tmp_path, "w") as f:
+                    f.write(content)
+                os.chmod(tmp_path, 0o644)
+
+            if self.durability != 'none':
+                self._fsync_all([tmp_path for tmp_path, _ in staged])
+
+            renamed = []
+            for tmp_path, path in staged:
+                # a request moved or withdrawn by another process since the
+                # update was made must not be recreated
+                if check_exists and not os.path.exists(path):
+                    os.remove(tmp_path)
+                    continue
+                os.rename(tmp_path, path)
+                renamed.append(path)
+            staged = []
+
+        except OSError:
+            for tmp_path, _ in staged:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+            raise
+
+        if self.durability == 'full':
+            self._fsync_all(sorted(set(os.path.dirname(path) for path in renamed)),
+                            flags=os.O_RDONLY | getattr(os, 'O_DIRECTORY', 0))
+
+
+    def _fsync_all(self, paths, flags=os.O_RDONLY):
+        def fsync_one(path):
+            fd = os.open(path, flags)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+        if len(paths) <= 1:
+            for path in paths:
+                fsync_one(path)
+            return
+        with ThreadPoolExecutor(max_workers=min(fsync_workers, len(paths))) as executor:
+            list(executor.map(fsync_one, paths))
+
+
+def remove_stale_tmp_files(directories, min_age=600, dry_run=False):
+    """
+    Removes temporary files ('.tmp_' names) left in the given directories
+    by writes that were interrupted, e.g. by a crash.  Only files older
+    than min_age seconds are removed, so as not to disturb writes in
+    progress in other processes.  Returns the paths removed (or with
+    dry_run, that would be removed).
+    """
+    removed = []
+    now = time.time()
+    for directory in directories:
+        try:
+            entries = list(os.scandir(directory))
+        except FileNotFoundError:
+            continue
+        for entry in entries:
+            if not _is_tmp_path(entry.name):
+                continue
+            try:
+                if now - entry.stat(follow_symlinks=False).st_mtime < min_age:
+                    continue
+                if not dry_run:
+                    os.remove(entry.path)
+            except FileNotFoundError:
+                continue
+            removed.append(entry.path)
+    return removed
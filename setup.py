@@ -37,6 +37,14 @@ setup(
             'init-migrations = gws_migration_tools.init_migrations:main',
             'handle-offline-requests = gws_migration_tools.handle_requests:main',
             'archive-offline-requests = gws_migration_tools.archive_requests:main',
+            'fleet-offline-requests = gws_migration_tools.fleet:main',
+            'manage-offline-requests = gws_migration_tools.manage_requests:main',
+            'query-offline-requests-service = gws_migration_tools.query_service:main',
+            'report-offline-requests-latency = gws_migration_tools.latency:main',
+
+            'mock-jdma-server = gws_migration_tools.mock_jdma:main',
+            'offline-requests-loadgen = gws_migration_tools.loadgen:main',
+            'simulate-offline-requests = gws_migration_tools.simulate:main',
             ],
         }
 )
@@ -0,0 +1,112 @@
+import json
+import collections
+
+import pytest
+
+from gws_migration_tools import checkpoint
+from gws_migration_tools.checkpoint import Checkpoint, Deadline, resume_order
+
+
+Request = collections.namedtuple('Request', 'reqid')
+
+
+class FakeRequestsManager(object):
+    def __init__(self, base_dir):
+        self.base_dir = base_dir
+
+
+class FakeClock(object):
+    "stands in for the time module in the checkpoint module"
+
+    def __init__(self, now=1000.):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(checkpoint, 'time', clock)
+    return clock
+
+
+def _ids(reqs):
+    return [req.reqid for req in reqs]
+
+
+def test_resume_order_puts_unhandled_first():
+    reqs = [Request(reqid) for reqid in (5, 3, 8, 1, 9)]
+    assert _ids(resume_order(reqs, set())) == [5, 3, 8, 1, 9]
+    assert _ids(resume_order(reqs, set([3, 1]))) == [5, 8, 9, 3, 1]
+    assert _ids(resume_order(reqs, set([2, 4]))) == [5, 3, 8, 1, 9]
+    assert _ids(resume_order(reqs, set([5, 3, 8, 1, 9]))) == [5, 3, 8, 1, 9]
+
+
+def test_checkpoint_round_trip(tmp_path):
+    reqs_mgr = FakeRequestsManager(str(tmp_path))
+    saved = Checkpoint(reqs_mgr)
+    assert saved.get('submit') == set()
+    saved.set('submit', set([7, 2]))
+    saved.set('monitor', set())
+    saved.save()
+
+    loaded = Checkpoint(reqs_mgr)
+    assert loaded.get('submit') == set([2, 7])
+    assert loaded.get('monitor') == set()
+
+    loaded.set('submit', set())
+    loaded.save()
+    assert Checkpoint(reqs_mgr).get('submit') == set()
+
+
+def test_checkpoint_of_older_version_is_ignored(tmp_path):
+    with open(str(tmp_path / Checkpoint._file), 'w') as f:
+        json.dump({'submit': 42}, f)
+    assert Checkpoint(FakeRequestsManager(str(tmp_path))).get('submit') == set()
+
+
+def test_deadline_without_limit(clock):
+    deadline = Deadline()
+    clock.now += 1e6
+    assert not deadline.expired()
+    assert not deadline.share(0.5).expired()
+
+
+def test_deadline_allows_for_longest_request(clock):
+    deadline = Deadline(max_runtime=100)
+    deadline.start_request()
+    clock.now += 30
+    deadline.end_request()
+    assert not deadline.expired()
+    clock.now += 40
+    assert deadline.expired()  # 70s gone, and a request can take 30s
+
+
+def test_share_is_fraction_of_time_left(clock):
+    deadline = Deadline(max_runtime=100)
+    clock.now += 20
+    share = deadline.share(0.25)
+    assert share.end == pytest.approx(clock.now + 20)
+    clock.now += 19
+    assert not share.expired()
+    clock.now += 1
+    assert share.expired()
+    assert not deadline.expired()
+
+
+def test_share_after_deadline_is_expired(clock):
+    deadline = Deadline(max_runtime=10)
+    clock.now += 20
+    assert deadline.share(0.5).expired()
+
+
+def test_share_times_requests_for_parent(clock):
+    deadline = Deadline(max_runtime=100)
+    share = deadline.share(0.5)
+    share.start_request()
+    clock.now += 30
+    share.end_request()
+    clock.now += 45
+    assert deadline.expired()  # 75s gone, and a request can take 30s
@@ -0,0 +1,110 @@
+import os
+
+import pytest
+
+from gws_migration_tools.journal import Journal, JournalTruncated
+
+
+@pytest.fixture
+def journal(tmp_path):
+    journal = Journal(str(tmp_path))
+    journal.initialise()
+    return journal
+
+
+def _segments(tmp_path):
+    return sorted(path.name for path in tmp_path.glob('journal.0*'))
+
+
+def test_append_needs_initialised_journal(tmp_path):
+    journal = Journal(str(tmp_path))
+    journal.append('create', 1, 'fn1', st='NEW')
+    assert not journal.exists()
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_read_since_continues_from_offset(journal):
+    journal.append('create', 1, 'fn1', st='NEW')
+    journal.append('move', 1, 'fn1', **{'from': 'NEW', 'to': 'SUBMITTING'})
+    records, offset = journal.read_since(0)
+    assert [(r['op'], r['id'], r['fn']) for r in records] == [
+        ('create', 1, 'fn1'), ('move', 1, 'fn1')]
+    assert records[1]['to'] == 'SUBMITTING'
+    assert offset == journal.end_offset()
+
+    assert journal.read_since(offset) == ([], offset)
+
+    journal.append('param', 1, 'fn1', st='SUBMITTING', key='external_id')
+    records, next_offset = journal.read_since(offset)
+    assert [(r['op'], r['key']) for r in records] == [('param', 'external_id')]
+    assert next_offset == journal.end_offset()
+
+
+def test_partial_record_is_left_for_next_read(journal, tmp_path):
+    journal.append('create', 1, 'fn1', st='NEW')
+    partial = b'{"op":"cre'
+    with open(str(tmp_path / _segments(tmp_path)[-1]), 'ab') as f:
+        f.write(partial)
+    records, offset = journal.read_since(0)
+    assert [r['id'] for r in records] == [1]
+    assert offset == journal.end_offset() - len(partial)
+
+
+def test_segments_roll_over(journal, tmp_path):
+    journal.max_segment_size = 1
+    for reqid in range(1, 4):
+        journal.append('create', reqid, 'fn{}'.format(reqid), st='NEW')
+    assert len(_segments(tmp_path)) == 3
+
+    records, offset = journal.read_since(0)
+    assert [r['id'] for r in records] == [1, 2, 3]
+    assert offset == journal.end_offset()
+
+    # an offset at the start of a later segment reads on from there
+    third_start = int(_segments(tmp_path)[-1].split('.')[1])
+    records, _ = journal.read_since(third_start)
+    assert [r['id'] for r in records] == [3]
+
+
+def test_compact_keeps_latest_unarchived_records(journal, tmp_path):
+    journal.max_segment_size = 1
+    journal.append('create', 1, 'fn1', st='NEW')
+    journal.append('create', 2, 'fn2', st='NEW')
+    journal.append('move', 1, 'fn1', **{'from': 'NEW', 'to': 'SUBMITTING'})
+    journal.append('archive', 2, 'fn2', st='WITHDRAWN')
+    journal.append('create', 3, 'fn3', st='NEW')
+    _, end = journal.read_since(0)
+
+    journal.compact()
+
+    assert [name.endswith('.c') for name in _segments(tmp_path)] == [True, False]
+    records, offset = journal.read_since(0)
+    assert [(r['op'], r['id']) for r in records] == [('move', 1), ('create', 3)]
+    assert offset == end
+
+    # compacting again, with nothing new, changes nothing
+    journal.compact()
+    assert journal.read_since(0) == (records, offset)
+
+
+def test_offset_within_compacted_segment_rereads_it(journal, tmp_path):
+    journal.max_segment_size = 1
+    for reqid in range(1, 4):
+        journal.append('create', reqid, 'fn{}'.format(reqid), st='NEW')
+    second_start = int(_segments(tmp_path)[1].split('.')[1])
+
+    journal.compact()
+
+    records, offset = journal.read_since(second_start)
+    assert [r['id'] for r in records] == [1, 2, 3]
+    assert offset == journal.end_offset()
+
+
+def test_offset_before_kept_segments_is_truncated(journal, tmp_path):
+    journal.max_segment_size = 1
+    journal.append('create', 1, 'fn1', st='NEW')
+    journal.append('create', 2, 'fn2', st='NEW')
+    os.remove(str(tmp_path / _segments(tmp_path)[0]))
+
+    with pytest.raises(JournalTruncated):
+        journal.read_since(0)
@@ -0,0 +1,105 @@
+import os
+import time
+import collections
+
+import pytest
+
+from gws_migration_tools.lease import LeaseManager
+
+
+Request = collections.namedtuple('Request', 'reqid')
+
+
+class FakeRequestsManager(object):
+    def __init__(self, base_dir):
+        self.base_dir = base_dir
+
+
+@pytest.fixture
+def reqs_mgr(tmp_path):
+    return FakeRequestsManager(str(tmp_path))
+
+
+def _age(path, seconds):
+    then = time.time() - seconds
+    os.utime(path, (then, then))
+
+
+def test_acquire_is_exclusive(reqs_mgr):
+    first = LeaseManager(reqs_mgr, worker_id='w1')
+    second = LeaseManager(reqs_mgr, worker_id='w2')
+    assert first.acquire(1)
+    assert not second.acquire(1)
+    assert not first.acquire(1)
+    assert second.acquire(2)
+
+    first.release(1)
+    assert second.acquire(1)
+
+
+def test_expired_lease_is_taken_over(reqs_mgr):
+    first = LeaseManager(reqs_mgr, worker_id='w1', ttl=60)
+    second = LeaseManager(reqs_mgr, worker_id='w2', ttl=60)
+    assert first.acquire(1)
+    _age(first._lease_path(1), 30)
+    assert not second.acquire(1)
+
+    _age(first._lease_path(1), 120)
+    assert second.acquire(1)
+    with open(second._lease_path(1)) as f:
+        assert f.read() == 'w2\n'
+    assert os.listdir(second._leases_path) == ['1']
+
+
+def test_heartbeat_renews_held_leases(reqs_mgr):
+    first = LeaseManager(reqs_mgr, worker_id='w1', ttl=60)
+    second = LeaseManager(reqs_mgr, worker_id='w2', ttl=60)
+    assert first.acquire(1)
+    _age(first._lease_path(1), 120)
+    first.heartbeat()
+    assert not second.acquire(1)
+
+
+def test_break_expired_puts_back_fresh_lease(reqs_mgr, monkeypatch):
+    first = LeaseManager(reqs_mgr, worker_id='w1', ttl=60)
+    second = LeaseManager(reqs_mgr, worker_id='w2', ttl=60)
+    assert first.acquire(1)
+    path = first._lease_path(1)
+    _age(path, 120)
+
+    # between checking and renaming the lease, it is renewed (as if
+    # taken again by another worker)
+    real_rename = os.rename
+
+    def rename(src, dst):
+        os.utime(src)
+        real_rename(src, dst)
+
+    monkeypatch.setattr(os, 'rename', rename)
+    assert not second._break_expired(path)
+    monkeypatch.undo()
+
+    assert os.listdir(second._leases_path) == ['1']
+    assert not second.acquire(1)
+
+
+def test_break_expired_released_lease(reqs_mgr):
+    worker = LeaseManager(reqs_mgr, worker_id='w1')
+    assert worker._break_expired(worker._lease_path(1))
+
+
+def test_partition_between_live_workers(reqs_mgr):
+    first = LeaseManager(reqs_mgr, worker_id='w1', ttl=60)
+    second = LeaseManager(reqs_mgr, worker_id='w2', ttl=60)
+    first.heartbeat()
+    second.heartbeat()
+    reqs = [Request(reqid) for reqid in range(1, 7)]
+    assert [req.reqid for req in first.partition(reqs)] == [2, 4, 6]
+    assert [req.reqid for req in second.partition(reqs)] == [1, 3, 5]
+
+    # a worker whose heartbeat has expired is left out
+    _age(os.path.join(first._workers_path, 'w2'), 120)
+    assert first.partition(reqs) == reqs
+
+    second.unregister()
+    assert first.live_workers() == ['w1']
@@ -0,0 +1,63 @@
+import datetime
+
+import pytest
+
+from gws_migration_tools.migration_request_lib import RequestStatus
+from gws_migration_tools.query import RequestQuery, IdSet, parse_ids, parse_date
+
+
+def test_parse_ids():
+    assert parse_ids('12') == [12]
+    assert parse_ids('12,15-20,3') == [12, range(15, 21), 3]
+    assert parse_ids('7-7') == [range(7, 8)]
+
+
+@pytest.mark.parametrize('s', ['', '1,,2', 'x', '1-', '-3', '5-2'])
+def test_parse_bad_ids(s):
+    with pytest.raises(ValueError):
+        parse_ids(s)
+
+
+def test_wide_range_is_not_expanded():
+    ids = IdSet(parse_ids('1-1000000000000,5'))
+    assert ids.ranges == [range(1, 1000000000001)]
+    assert ids.ids == set([5])
+    assert 1000000000000 in ids
+    assert 1000000000001 not in ids
+    assert 0 not in ids
+
+
+def test_id_set():
+    ids = IdSet([3, range(10, 13), [20, 21], range(5, 5)])
+    assert [reqid for reqid in range(25) if reqid in ids] == [3, 10, 11, 12, 20, 21]
+    assert ids.to_list() == [3, [10, 12], [20, 21]]
+    assert IdSet(ids.to_list()).to_list() == ids.to_list()
+
+
+def test_query_round_trip():
+    query = RequestQuery(users=['bob', 'alice'],
+                         request_types=['migration'],
+                         statuses=[RequestStatus.NEW, RequestStatus.DONE],
+                         ids=parse_ids('4,100-200'),
+                         min_id=2, max_id=300,
+                         since=parse_date('2020-01-02'),
+                         until=datetime.date(2020, 3, 4),
+                         path_prefix='/gws/nopw/j04/ws/data/',
+                         external_ids=[17])
+    d = query.to_dict()
+    assert d['ids'] == [4, [100, 200]]
+    assert d['statuses'] == ['DONE', 'NEW']
+    assert d['path_prefix'] == '/gws/nopw/j04/ws/data'
+    assert d['external_ids'] == ['17']
+
+    again = RequestQuery.from_dict(d)
+    assert again.to_dict() == d
+    assert 150 in again.ids and 99 not in again.ids
+    assert again.statuses == set([RequestStatus.NEW, RequestStatus.DONE])
+    assert again.until == datetime.date(2020, 3, 4)
+
+
+def test_empty_query_round_trip():
+    d = RequestQuery().to_dict()
+    assert set(d.values()) == set([None])
+    assert RequestQuery.from_dict(d).to_dict() == d
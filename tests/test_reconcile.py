@@ -0,0 +1,117 @@
+import os
+import time
+import socket
+
+import pytest
+
+import gws_migration_tools.jdma_iface as jdma_iface_module
+from gws_migration_tools.migration_request_lib import \
+    RequestsManager, RequestStatus, jdma_iface
+from gws_migration_tools.mock_jdma import MockJDMA
+from gws_migration_tools.simulate import SimulatedJDMALib, VirtualClock
+from gws_migration_tools.reconcile import \
+    find_stale_submitting, reconcile_request, clock_slack
+
+
+@pytest.fixture
+def jdma(monkeypatch):
+    "a MockJDMA in which requests stay in their first stage"
+    jdma = MockJDMA(stage_time=1e6)
+    monkeypatch.setattr(jdma_iface_module, 'jdma_lib',
+                        SimulatedJDMALib(jdma, VirtualClock(time.time())))
+    return jdma
+
+
+@pytest.fixture
+def reqs_mgr(tmp_path, monkeypatch):
+    gws_root = tmp_path / 'gws'
+    (gws_root / 'data').mkdir(parents=True)
+    monkeypatch.delenv('_USE_TEST_GWS', raising=False)
+    monkeypatch.setenv('GWS_MIGRATION_LAYOUTS',
+                       '{}:{}'.format(tmp_path, len(gws_root.parts) - 1))
+    reqs_mgr = RequestsManager(str(gws_root))
+    reqs_mgr.initialise()
+    return reqs_mgr
+
+
+def _claimed_migration(reqs_mgr, name):
+    path = os.path.join(reqs_mgr.gws_root, 'data', name)
+    os.mkdir(path)
+    req = reqs_mgr.create_migration_request({'path': path})
+    req.set_status(RequestStatus.SUBMITTING)
+    return req
+
+
+def _reconcile(reqs_mgr, used=None):
+    catalogue = jdma_iface.get_catalogue(reqs_mgr.gws_root)
+    used = set() if used is None else used
+    stale = find_stale_submitting(reqs_mgr, stale_after=60, now=time.time() + 100)
+    return [(req, reconcile_request(req, params, claimed, catalogue, used))
+            for req, params, claimed in stale]
+
+
+def _current(reqs_mgr, req):
+    return reqs_mgr.scan(all_users=True, reqid=req.reqid)[0]
+
+
+def test_submitted_request_is_reconciled(reqs_mgr, jdma):
+    submitted = _claimed_migration(reqs_mgr, 'd1')
+    ext_id = jdma_iface.submit_migrate(submitted.read())
+    not_submitted = _claimed_migration(reqs_mgr, 'd2')
+
+    results = dict((req.reqid, message) for req, message in _reconcile(reqs_mgr))
+    assert results[submitted.reqid].startswith('reconciled')
+    assert results[not_submitted.reqid].startswith('returned to NEW')
+
+    req = _current(reqs_mgr, submitted)
+    assert req.status == RequestStatus.SUBMITTED
+    assert req.read()['external_id'] == ext_id
+    assert _current(reqs_mgr, not_submitted).status == RequestStatus.NEW
+
+
+def test_jdma_request_is_only_matched_once(reqs_mgr, jdma):
+    req = _claimed_migration(reqs_mgr, 'd1')
+    ext_id = jdma_iface.submit_migrate(req.read())
+    (_, message), = _reconcile(reqs_mgr, used=set([ext_id]))
+    assert message.startswith('returned to NEW')
+    assert _current(reqs_mgr, req).status == RequestStatus.NEW
+
+
+def test_jdma_request_before_claim_is_not_matched(reqs_mgr, jdma):
+    req = _claimed_migration(reqs_mgr, 'd1')
+    jdma_iface.submit_migrate(req.read())
+    for jdma_req in jdma._requests.values():
+        jdma_req['created'] -= clock_slack + 3600
+    (_, message), = _reconcile(reqs_mgr)
+    assert message.startswith('returned to NEW')
+
+
+def test_split_migration_carries_on_after_parts_found(reqs_mgr, jdma):
+    req = _claimed_migration(reqs_mgr, 'd1')
+    path = req.read()['path']
+    req.set_params({'parts': [[path + '/a'], [path + '/b'], [path + '/c']]})
+    params = req.read()
+    for part in (1, 2):
+        jdma_iface.submit_migrate(params, filelist=params['parts'][part - 1],
+                                  part=part, num_parts=3)
+
+    (_, message), = _reconcile(reqs_mgr)
+    assert message.endswith('(2 of 3 JDMA requests found)')
+    req = _current(reqs_mgr, req)
+    assert req.status == RequestStatus.NEW
+    assert len(req.read()['external_ids']) == 2
+
+
+def test_live_claim_is_left_alone(reqs_mgr, jdma):
+    req = _claimed_migration(reqs_mgr, 'd1')
+    req.set_params({'claimed_by': {'host': socket.gethostname(),
+                                   'pid': os.getpid()}})
+    assert _reconcile(reqs_mgr) == []
+    assert _current(reqs_mgr, req).status == RequestStatus.SUBMITTING
+
+
+def test_claim_from_other_host_is_reconciled(reqs_mgr, jdma):
+    req = _claimed_migration(reqs_mgr, 'd1')
+    req.set_params({'claimed_by': {'host': 'elsewhere', 'pid': os.getpid()}})
+    (_, message), = _reconcile(reqs_mgr)
+    assert message.startswith('returned to NEW')
@@ -0,0 +1,124 @@
+import os
+
+import pytest
+
+from gws_migration_tools.sizing import split_tree, measure_tree, \
+    dir_attributes, restore_dir_attributes
+
+
+def _write(path, num_bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(b'x' * num_bytes)
+
+
+@pytest.fixture
+def tree(tmp_path):
+    """
+    top/
+        big/        a (400), b (300), c (300)
+        small/      d (100)
+        empty/
+        e (200)
+        link -> e
+    """
+    top = str(tmp_path / 'top')
+    _write(os.path.join(top, 'big', 'a'), 400)
+    _write(os.path.join(top, 'big', 'b'), 300)
+    _write(os.path.join(top, 'big', 'c'), 300)
+    _write(os.path.join(top, 'small', 'd'), 100)
+    os.makedirs(os.path.join(top, 'empty'))
+    _write(os.path.join(top, 'e'), 200)
+    os.symlink('e', os.path.join(top, 'link'))
+    return top
+
+
+def _files_under(paths):
+    files = set()
+    for path in paths:
+        if os.path.isdir(path) and not os.path.islink(path):
+            for dirpath, dirnames, filenames in os.walk(path):
+                files.update(os.path.join(dirpath, name) for name in filenames)
+        else:
+            files.add(path)
+    return files
+
+
+def test_small_tree_is_one_part(tree):
+    assert split_tree(tree, part_bytes=10000) == ([[tree]], [])
+
+
+def test_parts_cover_tree_once(tree):
+    parts, split_dirs = split_tree(tree, part_bytes=500)
+    assert len(parts) == 3  # 1300 bytes
+
+    all_paths = [path for part in parts for path in part]
+    assert len(all_paths) == len(set(all_paths))
+    for i, part in enumerate(parts):
+        for other in parts[i + 1:]:
+            assert not _files_under(part) & _files_under(other)
+
+    expected = _files_under([tree])
+    assert set().union(*map(_files_under, parts)) == expected
+
+    # the directory too big for one part is divided, and is listed
+    assert split_dirs == [tree, os.path.join(tree, 'big')]
+    assert os.path.join(tree, 'big') not in all_paths
+    assert os.path.join(tree, 'big', 'a') in all_paths
+
+    # an empty directory and a symbolic link are still migrated
+    assert os.path.join(tree, 'empty') in all_paths
+    assert os.path.join(tree, 'link') in all_paths
+
+
+def _size(path):
+    if os.path.islink(path):
+        return 0
+    if os.path.isdir(path):
+        return measure_tree(path).total_bytes
+    return os.path.getsize(path)
+
+
+def test_parts_are_balanced(tree):
+    parts, _ = split_tree(tree, part_bytes=500)
+    sizes = [sum(map(_size, part)) for part in parts]
+    assert sum(sizes) == measure_tree(tree).total_bytes
+    assert sorted(sizes) == [400, 400, 500]
+
+
+def test_max_parts(tree):
+    parts, _ = split_tree(tree, part_bytes=100, max_parts=2)
+    assert len(parts) == 2
+
+
+def test_max_depth(tree):
+    parts, split_dirs = split_tree(tree, part_bytes=500, max_depth=1)
+    assert split_dirs == [tree]
+    assert os.path.join(tree, 'big') in [path for part in parts for path in part]
+
+
+def test_hard_links_counted_once(tmp_path):
+    top = str(tmp_path / 'top')
+    _write(os.path.join(top, 'one', 'f'), 1000)
+    os.makedirs(os.path.join(top, 'two'))
+    os.link(os.path.join(top, 'one', 'f'), os.path.join(top, 'two', 'f'))
+    _write(os.path.join(top, 'g'), 1000)
+    assert split_tree(top, part_bytes=2000) == ([[top]], [])
+
+
+def test_split_dir_attributes_are_restored(tree, tmp_path):
+    _, split_dirs = split_tree(tree, part_bytes=500)
+    big = os.path.join(tree, 'big')
+    os.chmod(big, 0o750)
+    os.utime(big, (1000000, 1000000))
+    attrs = dir_attributes(split_dirs, tree)
+    assert attrs['big'] == [0o750, 1000000]
+
+    copy = str(tmp_path / 'copy')
+    os.makedirs(os.path.join(copy, 'big'))
+    assert restore_dir_attributes(attrs, copy) == 2
+    st = os.stat(os.path.join(copy, 'big'))
+    assert (st.st_mode & 0o777, st.st_mtime) == (0o750, 1000000)
+
+    # directories not retrieved are skipped
+    assert restore_dir_attributes({'missing': [0o755, 0]}, copy) == 0
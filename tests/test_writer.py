@@ -0,0 +1,138 @@
+import os
+
+import pytest
+
+from gws_migration_tools.writer import RequestWriter
+
+
+def _read(path):
+    with open(str(path)) as f:
+        return f.read()
+
+
+@pytest.fixture
+def request_file(tmp_path):
+    path = tmp_path / 'req'
+    path.write_text('old')
+    return str(path)
+
+
+def test_unknown_durability():
+    with pytest.raises(ValueError):
+        RequestWriter('sometimes')
+
+
+@pytest.mark.parametrize('durability', ['none', 'data', 'full'])
+def test_group_is_written_on_end(request_file, durability):
+    writer = RequestWriter(durability)
+    done = []
+    writer.begin()
+    writer.write(request_file, 'new')
+    writer.defer(lambda: done.append(_read(request_file)))
+    assert _read(request_file) == 'old'
+    assert writer.pending_content(request_file) == 'new'
+    assert done == []
+    writer.end()
+    assert _read(request_file) == 'new'
+    assert done == ['new']
+    assert writer.pending_content(request_file) is None
+
+
+def test_new_files_are_written_at_once(tmp_path):
+    writer = RequestWriter()
+    writer.begin()
+    path = str(tmp_path / 'new')
+    writer.write(path, 'content')
+    assert _read(path) == 'content'
+    writer.end()
+
+
+def test_failed_commit_drops_updates_and_deferred(request_file, monkeypatch):
+    writer = RequestWriter('data')
+    done = []
+    writer.begin()
+    writer.write(request_file, 'new')
+    writer.defer(lambda: done.append(True))
+
+    def fsync_fails(paths, flags=os.O_RDONLY):
+        raise OSError('fsync failed')
+
+    monkeypatch.setattr(writer, '_fsync_all', fsync_fails)
+    with pytest.raises(OSError):
+        writer.end()
+
+    assert done == []
+    assert _read(request_file) == 'old'
+    assert writer.pending_content(request_file) is None
+    assert sorted(os.listdir(os.path.dirname(request_file))) == ['req']
+
+    # the next group starts afresh
+    monkeypatch.undo()
+    writer.begin()
+    writer.write(request_file, 'newer')
+    writer.end()
+    assert done == []
+    assert _read(request_file) == 'newer'
+
+
+def test_failed_rename_removes_temporary_files(tmp_path, monkeypatch):
+    paths = [str(tmp_path / name) for name in ('a', 'b')]
+    for path in paths:
+        with open(path, 'w') as f:
+            f.write('old')
+    writer = RequestWriter()
+    writer.begin()
+    for path in paths:
+        writer.write(path, 'new')
+
+    real_rename = os.rename
+
+    def rename(src, dst):
+        if dst == paths[1]:
+            raise OSError('rename failed')
+        real_rename(src, dst)
+
+    monkeypatch.setattr(os, 'rename', rename)
+    with pytest.raises(OSError):
+        writer.end()
+    monkeypatch.undo()
+
+    assert [_read(path) for path in paths] == ['new', 'old']
+    assert sorted(os.listdir(str(tmp_path))) == ['a', 'b']
+
+
+def test_removed_file_is_not_recreated(request_file):
+    writer = RequestWriter()
+    writer.begin()
+    writer.write(request_file, 'new')
+    os.remove(request_file)
+    writer.end()
+    assert os.listdir(os.path.dirname(request_file)) == []
+
+
+def test_flush_writes_pending_updates(tmp_path):
+    paths = [str(tmp_path / name) for name in ('a', 'b')]
+    for path in paths:
+        with open(path, 'w') as f:
+            f.write('old')
+    writer = RequestWriter()
+    writer.begin()
+    writer.write(paths[0], 'new')
+    writer.write(paths[1], 'new')
+    writer.flush(paths[0])
+    assert [_read(path) for path in paths] == ['new', 'new']
+    writer.end()
+
+
+def test_max_pending(tmp_path):
+    paths = [str(tmp_path / name) for name in ('a', 'b', 'c')]
+    for path in paths:
+        with open(path, 'w') as f:
+            f.write('old')
+    writer = RequestWriter()
+    writer.begin(max_pending=2)
+    for path in paths:
+        writer.write(path, 'new')
+    assert [_read(path) for path in paths] == ['new', 'new', 'old']
+    writer.end()
+    assert _read(paths[2]) == 'new'